@@ -0,0 +1,113 @@
+import itertools
+
+import pandas as pd
+
+# Process-wide write clock, so a version is never reused, even by a rebuilt cache.
+_clock = itertools.count(1)
+
+
+def _amount(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ExpenseAggregates:
+    """Running per-(user, trip, category) and per-(user, trip, day, category) totals.
+
+    Rows are ledger rows as lists of cell values, located through ``header``.
+    ``add``/``remove`` apply one row as a delta, so keeping the summary current
+    costs O(1) per write, and reading a trip's summary only touches that trip's
+    (small) tables instead of regrouping the ledger. ``version(username)``
+    changes whenever one of the user's rows does.
+    """
+
+    def __init__(self, header: list):
+        self._cols = {name: header.index(name) for name in ("username", "date", "category", "amount", "trip")
+                      if name in header}
+        self._data = {}
+        self._created = next(_clock)
+        self._versions = {}
+
+    def _key(self, row: list):
+        def cell(name):
+            idx = self._cols.get(name)
+            return row[idx] if idx is not None and idx < len(row) else ""
+
+        day = str(cell("date"))[:10]
+        return cell("username"), cell("trip"), day, cell("category"), _amount(cell("amount"))
+
+    def _apply(self, row: list, sign: int) -> None:
+        user, trip, day, category, amount = self._key(row)
+        self._versions[user] = next(_clock)
+        tables = self._data.setdefault(user, {}).setdefault(trip, {"categories": {}, "days": {}})
+        for table, key in ((tables["categories"], category), (tables["days"], (day, category))):
+            total, count = table.get(key, (0.0, 0))
+            total, count = total + sign * amount, count + sign
+            if count:
+                table[key] = (total, count)
+            else:
+                table.pop(key, None)
+
+    def add(self, row: list) -> None:
+        self._apply(row, 1)
+
+    def remove(self, row: list) -> None:
+        self._apply(row, -1)
+
+    def version(self, username: str) -> int:
+        return self._versions.get(username, self._created)
+
+    def _tables(self, username: str, trip: str = None) -> list:
+        trips = self._data.get(username, {})
+        if trip:
+            return [trips[trip]] if trip in trips else []
+        return list(trips.values())
+
+    def category_totals(self, username: str, trip: str = None) -> pd.DataFrame:
+        """``category, amount, count`` for one trip (or all of the user's trips)."""
+        totals = {}
+        for tables in self._tables(username, trip):
+            for category, (total, count) in tables["categories"].items():
+                prev_total, prev_count = totals.get(category, (0.0, 0))
+                totals[category] = (prev_total + total, prev_count + count)
+        return pd.DataFrame(
+            [(c, round(t, 2), n) for c, (t, n) in sorted(totals.items())],
+            columns=["category", "amount", "count"],
+        )
+
+    def daily_totals(self, username: str, trip: str = None) -> pd.DataFrame:
+        """``date, category, amount, count`` with ``date`` as datetime64."""
+        totals = {}
+        for tables in self._tables(username, trip):
+            for key, (total, count) in tables["days"].items():
+                prev_total, prev_count = totals.get(key, (0.0, 0))
+                totals[key] = (prev_total + total, prev_count + count)
+        df = pd.DataFrame(
+            [(d, c, round(t, 2), n) for (d, c), (t, n) in sorted(totals.items())],
+            columns=["date", "category", "amount", "count"],
+        )
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        return df
+
+
+def frame_category_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """``ExpenseAggregates.category_totals`` from a typed frame holding ``category`` and ``amount``."""
+    grouped = df.groupby(df["category"].astype(str), sort=True)["amount"].agg(["sum", "count"])
+    return pd.DataFrame(
+        [(c, round(float(t), 2), int(n)) for c, t, n in zip(grouped.index, grouped["sum"], grouped["count"])],
+        columns=["category", "amount", "count"],
+    )
+
+
+def frame_daily_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """``ExpenseAggregates.daily_totals`` from a typed frame holding ``date``, ``category`` and ``amount``."""
+    days = df["date"].dt.strftime("%Y-%m-%d").fillna("")
+    grouped = df.groupby([days, df["category"].astype(str)], sort=True)["amount"].agg(["sum", "count"])
+    totals = pd.DataFrame(
+        [(d, c, round(float(t), 2), int(n)) for (d, c), t, n in zip(grouped.index, grouped["sum"], grouped["count"])],
+        columns=["date", "category", "amount", "count"],
+    )
+    totals["date"] = pd.to_datetime(totals["date"], errors="coerce")
+    return totals
@@ -0,0 +1,139 @@
+import math
+
+import pandas as pd
+
+# Need this many past expenses in a scope before its statistics are trusted.
+MIN_SAMPLES = 5
+Z_HIGH = 2.0
+Z_LOW = -1.0
+
+
+class RunningStats:
+    """Count, mean and variance of a stream, via Welford's update (and its inverse)."""
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x: float) -> None:
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.count -= 1
+        self.mean = (old_mean * (self.count + 1) - x) / self.count
+        self.m2 = max(self.m2 - (x - old_mean) * (x - self.mean), 0.0)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def zscore(self, x: float) -> float:
+        std = self.std
+        if std == 0:
+            return 0.0 if x == self.mean else math.copysign(math.inf, x - self.mean)
+        return (x - self.mean) / std
+
+
+def percentile(z: float) -> float:
+    """Normal-approximation percentile (0-100) of a z-score."""
+    return 50.0 * (1.0 + math.erf(z / math.sqrt(2.0)))
+
+
+class SpendingStats:
+    """Running amount statistics per user x category, and per trip and location within that.
+
+    Fed ledger rows (lists of cell values located through ``header``) as they
+    are written or removed, so scoring a new expense never rescans the ledger.
+    """
+
+    def __init__(self, header: list):
+        self._cols = {name: header.index(name) for name in ("username", "category", "amount", "trip", "location")
+                      if name in header}
+        self._stats = {}
+
+    def _cell(self, row: list, name: str) -> str:
+        idx = self._cols.get(name)
+        return row[idx] if idx is not None and idx < len(row) else ""
+
+    @staticmethod
+    def _keys(username, category, trip, location) -> list:
+        """Scopes for an expense, most specific first."""
+        keys = []
+        if trip:
+            keys.append(("trip", username, category, trip))
+        if location:
+            keys.append(("location", username, category, location))
+        keys.append(("user", username, category))
+        return keys
+
+    def _apply(self, row: list, add: bool) -> None:
+        try:
+            amount = float(self._cell(row, "amount"))
+        except ValueError:
+            return
+        keys = self._keys(self._cell(row, "username"), self._cell(row, "category"),
+                          self._cell(row, "trip"), self._cell(row, "location"))
+        for key in keys:
+            stats = self._stats.get(key)
+            if stats is None:
+                if not add:
+                    continue
+                stats = self._stats[key] = RunningStats()
+            if add:
+                stats.add(amount)
+            else:
+                stats.remove(amount)
+                if not stats.count:
+                    del self._stats[key]
+
+    def add(self, row: list) -> None:
+        self._apply(row, True)
+
+    def remove(self, row: list) -> None:
+        self._apply(row, False)
+
+    def score(self, username: str, category: str, amount: float, trip: str = None, location: str = None):
+        """Score ``amount`` against the most specific scope with enough history.
+
+        Returns a dict with ``z``, ``percentile``, ``mean``, ``count`` and
+        ``scope`` ("trip", "location" or "user"), or None without history.
+        """
+        for key in self._keys(username, category, trip, location):
+            stats = self._stats.get(key)
+            if stats is not None and stats.count >= MIN_SAMPLES:
+                z = stats.zscore(float(amount))
+                return {
+                    "z": z,
+                    "percentile": percentile(z) if math.isfinite(z) else (100.0 if z > 0 else 0.0),
+                    "mean": stats.mean,
+                    "count": stats.count,
+                    "scope": key[0],
+                }
+        return None
+
+
+def flag_anomalies(df: pd.DataFrame, by=("username", "category"), z_threshold: float = Z_HIGH,
+                   min_samples: int = MIN_SAMPLES) -> pd.DataFrame:
+    """Score every expense of a ledger frame against its group in one vectorized pass.
+
+    Adds ``z`` and ``is_anomaly`` columns; groups smaller than ``min_samples``
+    get a z of NaN and are never flagged.
+    """
+    amounts = pd.to_numeric(df["amount"], errors="coerce")
+    grouped = amounts.groupby([df[col] for col in by], observed=True)
+    mean = grouped.transform("mean")
+    std = grouped.transform("std")
+    count = grouped.transform("count")
+    z = (amounts - mean) / std.where(std > 0)
+    z = z.where(count >= min_samples)
+    return df.assign(z=z, is_anomaly=z.abs() >= z_threshold)
@@ -0,0 +1,37 @@
+"""Move closed trips out of the hot ledger into the yearly archive worksheets.
+
+    python archive.py [--days 90] [--dry-run]
+
+Reads the same secrets as the app (.streamlit/secrets.toml).
+"""
+import argparse
+import logging
+
+import google_sheets_utils as gsu
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=gsu.ARCHIVE_AFTER_DAYS,
+                        help="archive trips with no expense in this many days")
+    parser.add_argument("--dry-run", action="store_true", help="only list the trips that would move")
+    args = parser.parse_args(argv)
+
+    # Never touch the running app's write journal from here.
+    sheet = gsu.connect_sheet(write_behind=False)
+    trips = gsu.closed_trips(sheet, args.days)
+    for username, trip in trips:
+        print(f"{username}\t{trip}")
+    if args.dry_run or not trips:
+        print(f"{len(trips)} closed trips.")
+        return 0
+    moved = gsu.archive_trips(sheet, trips)
+    for title, rows in sorted(moved.items()):
+        print(f"{title}: {rows} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
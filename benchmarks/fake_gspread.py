@@ -0,0 +1,236 @@
+import threading
+import time
+from collections import Counter, deque
+
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+# Google's default per-user limits for the Sheets API.
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+
+
+class _QuotaResponse:
+    """Just enough of a requests.Response for gspread.exceptions.APIError."""
+
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+
+class _GridResponse:
+    """The 400 Sheets answers for a write outside the worksheet's columns."""
+
+    status_code = 400
+
+    def __init__(self, range_name: str):
+        self.text = f"Range ({range_name}) exceeds grid limits."
+
+    def json(self):
+        return {"error": {"code": 400, "message": self.text, "status": "INVALID_ARGUMENT"}}
+
+
+class ApiSimulator:
+    """Counts API calls and simulates round-trip latency and per-minute quotas.
+
+    ``latency`` is slept on every call. With ``quota`` on, a call over the
+    read or write budget of the last 60 seconds raises the same 429
+    APIError gspread would.
+    """
+
+    def __init__(self, latency: float = 0.0, quota: bool = False,
+                 reads_per_minute: int = READS_PER_MINUTE, writes_per_minute: int = WRITES_PER_MINUTE):
+        self.latency = latency
+        self.quota = quota
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute}
+        self.calls = Counter()
+        self.cells_read = 0
+        self.revision = 0
+        self._recent = {"read": deque(), "write": deque()}
+        self._lock = threading.Lock()
+
+    def call(self, method: str, kind: str) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.quota:
+                recent = self._recent[kind]
+                while recent and now - recent[0] > 60:
+                    recent.popleft()
+                if len(recent) >= self.limits[kind]:
+                    self.calls["quota_exceeded"] += 1
+                    raise gspread.exceptions.APIError(_QuotaResponse())
+                recent.append(now)
+            self.calls[method] += 1
+            if kind == "write":
+                self.revision += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def total(self) -> int:
+        return sum(n for method, n in self.calls.items() if method != "quota_exceeded")
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls.clear()
+            self.cells_read = 0
+            for recent in self._recent.values():
+                recent.clear()
+
+
+def _bounds(range_name: str, rows: list) -> tuple:
+    grid = a1_range_to_grid_range(range_name)
+    return (grid.get("startRowIndex", 0), grid.get("endRowIndex", len(rows)),
+            grid.get("startColumnIndex", 0), grid.get("endColumnIndex"))
+
+
+class FakeWorksheet:
+    """In-memory worksheet with the subset of the gspread API the app uses.
+
+    Values are stored as strings, the way Sheets renders them back.
+    """
+
+    def __init__(self, spreadsheet: "FakeSpreadsheet", title: str, sheet_id: int, rows: list = None, cols: int = 26):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows = [[str(v) for v in row] for row in rows or []]
+        self.col_count = max([cols] + [len(row) for row in self.rows])
+
+    @property
+    def _api(self) -> ApiSimulator:
+        return self.spreadsheet.api
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows)
+
+    def _read(self, range_name: str) -> list:
+        start_row, end_row, start_col, end_col = _bounds(range_name, self.rows)
+        values = []
+        for row in self.rows[start_row:end_row]:
+            cells = row[start_col:end_col]
+            while cells and cells[-1] == "":
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        self._api.cells_read += sum(len(row) for row in values)
+        return values
+
+    def _write(self, range_name: str, values: list) -> None:
+        start_row, _, start_col, _ = _bounds(range_name, self.rows)
+        if start_col + max((len(row) for row in values), default=0) > self.col_count:
+            # Like Sheets, updates never add columns; add_cols must come first.
+            raise gspread.exceptions.APIError(_GridResponse(range_name))
+        for r, row in enumerate(values, start=start_row):
+            while len(self.rows) <= r:
+                self.rows.append([])
+            target = self.rows[r]
+            for c, value in enumerate(row, start=start_col):
+                while len(target) <= c:
+                    target.append("")
+                target[c] = str(value)
+
+    # --- reads ---
+
+    def get_all_values(self, **kwargs) -> list:
+        self._api.call("get_all_values", "read")
+        self._api.cells_read += sum(len(row) for row in self.rows)
+        return [list(row) for row in self.rows]
+
+    def get_all_records(self, head: int = 1, **kwargs) -> list:
+        self._api.call("get_all_records", "read")
+        self._api.cells_read += sum(len(row) for row in self.rows)
+        if len(self.rows) < head:
+            return []
+        keys = self.rows[head - 1]
+        return [dict(zip(keys, row + [""] * (len(keys) - len(row)))) for row in self.rows[head:]]
+
+    def get(self, range_name: str = None, **kwargs) -> list:
+        self._api.call("get", "read")
+        return self._read(range_name or "A1:ZZ")
+
+    def batch_get(self, ranges: list, **kwargs) -> list:
+        self._api.call("batch_get", "read")
+        return [self._read(r) for r in ranges]
+
+    # --- writes ---
+
+    def append_row(self, values: list, **kwargs) -> dict:
+        self._api.call("append_row", "write")
+        self.rows.append([str(v) for v in values])
+        return {}
+
+    def append_rows(self, values: list, **kwargs) -> dict:
+        self._api.call("append_rows", "write")
+        self.rows.extend([str(v) for v in row] for row in values)
+        return {}
+
+    def update(self, range_name, values=None, **kwargs) -> dict:
+        self._api.call("update", "write")
+        if values is None or isinstance(range_name, list):
+            # gspread also accepts update(values, range_name).
+            range_name, values = values or "A1", range_name
+        self._write(range_name, values)
+        return {}
+
+    def batch_update(self, data: list, **kwargs) -> dict:
+        self._api.call("batch_update", "write")
+        for block in data:
+            self._write(block["range"], block["values"])
+        return {}
+
+    def delete_rows(self, start_index: int, end_index: int = None) -> dict:
+        self._api.call("delete_rows", "write")
+        del self.rows[start_index - 1:end_index or start_index]
+        return {}
+
+    def add_cols(self, cols: int) -> dict:
+        self._api.call("add_cols", "write")
+        self.col_count += cols
+        return {}
+
+
+class FakeSpreadsheet:
+    """In-memory stand-in for gspread.Spreadsheet; every call is counted on ``api``."""
+
+    def __init__(self, sheets: dict = None, api: ApiSimulator = None, spreadsheet_id: str = "benchmark"):
+        self.id = spreadsheet_id
+        self.api = api or ApiSimulator()
+        self._worksheets = {}
+        for title, rows in (sheets or {}).items():
+            self._worksheets[title] = FakeWorksheet(self, title, len(self._worksheets), rows)
+
+    @property
+    def lastUpdateTime(self) -> str:
+        return str(self.api.revision)
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.api.call("worksheet", "read")
+        if title not in self._worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self) -> list:
+        self.api.call("worksheets", "read")
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title: str, rows=1, cols=26, **kwargs) -> FakeWorksheet:
+        self.api.call("add_worksheet", "write")
+        ws = FakeWorksheet(self, title, len(self._worksheets), cols=int(cols))
+        self._worksheets[title] = ws
+        return ws
+
+    def batch_update(self, body: dict) -> dict:
+        """Applies the deleteDimension requests the app sends; other requests are ignored."""
+        self.api.call("spreadsheet_batch_update", "write")
+        by_id = {ws.id: ws for ws in self._worksheets.values()}
+        for request in body.get("requests", []):
+            delete = request.get("deleteDimension")
+            if delete and delete["range"].get("dimension") == "ROWS":
+                grid = delete["range"]
+                del by_id[grid["sheetId"]].rows[grid["startIndex"]:grid["endIndex"]]
+        return {}
@@ -0,0 +1,68 @@
+import datetime
+import random
+
+from google_sheets_utils import BUDGET_HEADER
+from storage import EXPENSE_COLUMNS
+
+# The choices offered by the expense form in script.py.
+CATEGORIES = [
+    "Flights", "Hotels", "Food", "Transport", "Miscellaneous",
+    "Shopping", "Entertainment", "Fuel", "Medical", "Groceries", "Sightseeing",
+]
+# Rough share of expenses and typical amount (in rupees) per category.
+CATEGORY_PROFILE = {
+    "Flights": (0.03, 9000), "Hotels": (0.08, 4000), "Food": (0.30, 450), "Transport": (0.15, 300),
+    "Miscellaneous": (0.05, 250), "Shopping": (0.08, 1500), "Entertainment": (0.05, 800),
+    "Fuel": (0.06, 1200), "Medical": (0.02, 600), "Groceries": (0.10, 700), "Sightseeing": (0.08, 500),
+}
+LOCATIONS = ["Goa", "Jaipur", "Manali", "Kochi", "Mumbai", "Delhi", "Paris", "Bangkok", "Dubai", "Bali"]
+SHARED_FRACTION = 0.2
+
+
+def generate_ledger(n_rows: int, n_users: int = 50, n_trips: int = 5, seed: int = 0,
+                    start: datetime.date = datetime.date(2024, 1, 1)) -> list:
+    """A Sheet1 value matrix (header first) of ``n_rows`` plausible expenses.
+
+    Each user has ``n_trips`` trips with a home location and a date window;
+    amounts are log-normal around a per-category typical value, and about a
+    fifth of the expenses are shared with one to three other users.
+    """
+    rng = random.Random(seed)
+    users = [f"user{i:04d}@example.com" for i in range(n_users)]
+    trips = {}
+    for user in users:
+        for t in range(n_trips):
+            begin = start + datetime.timedelta(days=rng.randrange(365))
+            trips[(user, t)] = (f"Trip {t + 1}", rng.choice(LOCATIONS), begin, rng.randint(3, 21))
+    weights = [CATEGORY_PROFILE[c][0] for c in CATEGORIES]
+
+    rows = [list(EXPENSE_COLUMNS)]
+    for _ in range(n_rows):
+        user = rng.choice(users)
+        trip, location, begin, days = trips[(user, rng.randrange(n_trips))]
+        category = rng.choices(CATEGORIES, weights)[0]
+        amount = round(rng.lognormvariate(0, 0.6) * CATEGORY_PROFILE[category][1], 2)
+        shared_with, split = "", amount
+        if rng.random() < SHARED_FRACTION:
+            others = rng.sample(users, rng.randint(1, min(3, n_users - 1)) if n_users > 1 else 0)
+            others = [u for u in others if u != user]
+            if others:
+                shared_with, split = ",".join(others), round(amount / (len(others) + 1), 2)
+        date = begin + datetime.timedelta(days=rng.randrange(days))
+        rows.append([
+            user, date.isoformat(), category, f"{category} in {location}", str(amount),
+            location, trip, shared_with, str(split), f"{rng.getrandbits(48):012x}",
+        ])
+    return rows
+
+
+def generate_budgets(ledger: list, seed: int = 0) -> list:
+    """A Budget sheet with an overall and a per-trip budget for every user in ``ledger``."""
+    rng = random.Random(seed)
+    rows = [list(BUDGET_HEADER)]
+    trips = sorted({(row[0], row[6]) for row in ledger[1:]})
+    for user in sorted({user for user, _ in trips}):
+        rows.append([user, str(rng.randrange(50, 500) * 1000), ""])
+    for user, trip in trips:
+        rows.append([user, str(rng.randrange(10, 100) * 1000), trip])
+    return rows
@@ -0,0 +1,175 @@
+"""Benchmark the Sheets-backed store against an in-memory spreadsheet.
+
+    python -m benchmarks.run --rows 1000,100000,1000000 [--latency 0.2] [--json out.json]
+
+Each benchmark reports wall time, Sheets API calls (total and by method),
+cells read and peak Python memory.
+"""
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+import google_sheets_utils as gsu
+from storage import SheetsStore
+
+from benchmarks.fake_gspread import ApiSimulator, FakeSpreadsheet
+from benchmarks.ledger import generate_budgets, generate_ledger
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+def _reset_caches() -> None:
+    gsu.invalidate_ledger()
+    gsu._budgets.invalidate()
+    # Every fake has the same spreadsheet id, which keys the worksheet handles as well as the ledger.
+    gsu._connection.reset()
+
+
+class Context:
+    """One fake spreadsheet and the store and user the benchmarks act on."""
+
+    def __init__(self, n_rows: int, n_users: int, n_trips: int, api: ApiSimulator):
+        ledger = generate_ledger(n_rows, n_users=n_users, n_trips=n_trips)
+        self.sheet = FakeSpreadsheet({gsu.SHEET_NAME: ledger, gsu.BUDGET_SHEET: generate_budgets(ledger)}, api=api)
+        self.store = SheetsStore(self.sheet)
+        self.username = ledger[1][0]
+        self.trip = ledger[1][6]
+        self.victim = None
+
+
+# --- setups ---
+
+def cold(ctx: Context) -> None:
+    _reset_caches()
+
+
+def warm(ctx: Context) -> None:
+    _reset_caches()
+    ctx.store.load_expenses(ctx.username)
+    ctx.store.get_budget(ctx.username, trip=ctx.trip)
+
+
+def warm_with_victim(ctx: Context) -> None:
+    warm(ctx)
+    ctx.victim = ctx.store.load_expenses(ctx.username, trip=ctx.trip)["id"].iloc[-1]
+
+
+# --- benchmarks ---
+
+def rerun(ctx: Context) -> None:
+    """What script.py reads on one rerun: trips, budget, ledger, summary."""
+    store = ctx.store
+    store.list_trips(ctx.username)
+    store.get_budget(ctx.username, trip=ctx.trip)
+    store.load_expenses(ctx.username, trip=ctx.trip)
+    store.load_expenses(ctx.username, trip=ctx.trip)
+    store.category_totals(ctx.username, ctx.trip)
+    store.daily_totals(ctx.username, ctx.trip)
+
+
+def add_expense(ctx: Context) -> None:
+    store = ctx.store
+    store.score_expense(ctx.username, "Food", 500.0, trip=ctx.trip, location="Goa")
+    store.add_expense(ctx.username, "2024-06-01", "Food", "benchmark", 500.0, "Goa", trip=ctx.trip)
+    store.load_expenses(ctx.username, trip=ctx.trip)
+
+
+def delete_expense(ctx: Context) -> None:
+    ctx.store.delete_expenses([ctx.victim])
+    ctx.store.load_expenses(ctx.username, trip=ctx.trip)
+
+
+def list_trips(ctx: Context) -> None:
+    ctx.store.list_trips(ctx.username)
+
+
+def dashboard(ctx: Context) -> None:
+    ctx.store.category_totals(ctx.username, ctx.trip)
+    ctx.store.daily_totals(ctx.username, ctx.trip)
+    ctx.store.category_totals(ctx.username)
+    ctx.store.daily_totals(ctx.username)
+
+
+BENCHMARKS = [
+    ("rerun_cold", cold, rerun),
+    ("rerun_warm", warm, rerun),
+    ("add_expense", warm, add_expense),
+    ("delete_expense", warm_with_victim, delete_expense),
+    ("list_trips", warm, list_trips),
+    ("dashboard", warm, dashboard),
+]
+
+
+def measure(ctx: Context, setup, func) -> dict:
+    """Time one call of ``func`` and count its API calls, then repeat it under tracemalloc for peak memory."""
+    api = ctx.sheet.api
+    setup(ctx)
+    api.reset()
+    start = time.perf_counter()
+    func(ctx)
+    wall = time.perf_counter() - start
+    calls, cells_read = dict(api.calls), api.cells_read
+
+    setup(ctx)
+    tracemalloc.start()
+    try:
+        func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "wall_ms": round(wall * 1000, 2),
+        "api_calls": sum(calls.values()),
+        "calls": calls,
+        "cells_read": cells_read,
+        "peak_mib": round(peak / 2 ** 20, 2),
+    }
+
+
+def run(sizes: list, n_users: int = 50, n_trips: int = 5, latency: float = 0.0, quota: bool = False,
+        only: list = None) -> list:
+    # Snapshots would turn every cold run into a disk read of the previous size.
+    snapshot_dir, gsu._ledger.snapshot_dir = gsu._ledger.snapshot_dir, None
+    results = []
+    try:
+        for n_rows in sizes:
+            ctx = Context(n_rows, n_users, n_trips, ApiSimulator(latency=latency, quota=quota))
+            for name, setup, func in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                result = dict(benchmark=name, rows=n_rows, **measure(ctx, setup, func))
+                results.append(result)
+                print(f"{name:<15} {n_rows:>9,} rows  {result['wall_ms']:>10.1f} ms  "
+                      f"{result['api_calls']:>3} calls  {result['cells_read']:>10,} cells  "
+                      f"{result['peak_mib']:>8.1f} MiB  {result['calls']}")
+            del ctx
+            _reset_caches()
+    finally:
+        gsu._ledger.snapshot_dir = snapshot_dir
+    return results
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated ledger sizes")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--trips", type=int, default=5, help="trips per user")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per API call")
+    parser.add_argument("--quota", action="store_true", help="enforce the per-minute Sheets quota")
+    parser.add_argument("--only", help="comma-separated benchmark names")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run([int(n) for n in args.rows.split(",")], n_users=args.users, n_trips=args.trips,
+                  latency=args.latency, quota=args.quota, only=args.only.split(",") if args.only else None)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import csv
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Ledger amounts, budgets and summaries are all kept in this currency.
+BASE_CURRENCY = "INR"
+RATE_CACHE_TTL = 6 * 3600
+SYMBOLS = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "CNY": "¥"}
+
+# Indicative quotes (1 unit of the first currency in the second); the
+# engine derives every other pair from them.
+DEFAULT_RATES = {
+    ("INR", "USD"): 0.012, ("INR", "EUR"): 0.011, ("INR", "GBP"): 0.0098,
+    ("INR", "JPY"): 1.57, ("INR", "AUD"): 0.018, ("INR", "CAD"): 0.016, ("INR", "CNY"): 0.083,
+    ("USD", "INR"): 82.5, ("EUR", "INR"): 88.5, ("GBP", "INR"): 102.0,
+    ("JPY", "INR"): 0.64, ("AUD", "INR"): 56.0, ("CAD", "INR"): 61.5, ("CNY", "INR"): 12.0,
+    ("EUR", "USD"): 1.1, ("USD", "EUR"): 0.91, ("GBP", "USD"): 1.3,
+    ("USD", "GBP"): 0.77, ("JPY", "USD"): 0.007, ("USD", "JPY"): 140,
+    ("AUD", "USD"): 0.67, ("USD", "AUD"): 1.5, ("CAD", "USD"): 0.74,
+    ("USD", "CAD"): 1.35, ("CNY", "USD"): 0.14, ("USD", "CNY"): 7.1,
+}
+
+
+class CurrencyError(Exception):
+    """No rate is known for a currency pair."""
+
+
+class StaticRateProvider:
+    """Rates from a ``{(from, to): rate}`` dict."""
+
+    def __init__(self, rates: dict = None):
+        self._rates = dict(DEFAULT_RATES if rates is None else rates)
+
+    def rates(self) -> dict:
+        return dict(self._rates)
+
+
+class FileRateProvider:
+    """Rates from a local file, re-read whenever the engine refreshes.
+
+    ``.csv`` files have ``from,to,rate`` rows. JSON files hold
+    ``{"base": "USD", "rates": {"EUR": 0.91, ...}}`` (1 base = rate units),
+    a ``{"pairs": [["EUR", "JPY", 162.3], ...]}`` list, or both.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def rates(self) -> dict:
+        rates = {}
+        if self.path.lower().endswith(".csv"):
+            with open(self.path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    rates[(row["from"].strip().upper(), row["to"].strip().upper())] = float(row["rate"])
+            return rates
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        base = str(data.get("base", BASE_CURRENCY)).upper()
+        for code, rate in data.get("rates", {}).items():
+            rates[(base, code.upper())] = float(rate)
+        for src, dst, rate in data.get("pairs", []):
+            rates[(src.upper(), dst.upper())] = float(rate)
+        return rates
+
+
+class RateEngine:
+    """Every cross rate between the provider's currencies, computed once per refresh.
+
+    The quotes form a graph; one breadth-first walk per connected component
+    values each currency in the component's root currency, so any pair is
+    ``value[a] / value[b]`` (EUR -> JPY goes through INR or USD without a
+    quote of its own). Direct quotes win over derived ones. The result is a
+    dense matrix, so converting a column is a single gather.
+    """
+
+    def __init__(self, provider=None, ttl: float = RATE_CACHE_TTL):
+        self.provider = provider or StaticRateProvider()
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._matrix = np.ones((0, 0))
+        self._built_at = None
+
+    def _build(self) -> None:
+        quotes = {(a.upper(), b.upper()): float(r) for (a, b), r in self.provider.rates().items() if float(r) > 0}
+        graph = {}
+        for (a, b), rate in quotes.items():
+            graph.setdefault(a, {})[b] = rate
+            graph.setdefault(b, {}).setdefault(a, 1.0 / rate)
+        currencies = sorted(graph)
+        codes = {c: i for i, c in enumerate(currencies)}
+        value = np.full(len(currencies), np.nan)
+        component = np.full(len(currencies), -1)
+        for root in currencies:
+            if component[codes[root]] >= 0:
+                continue
+            value[codes[root]], component[codes[root]] = 1.0, codes[root]
+            queue = deque([root])
+            while queue:
+                cur = queue.popleft()
+                for nxt, rate in graph[cur].items():
+                    if component[codes[nxt]] < 0:
+                        # 1 cur = rate nxt, so nxt is worth value[cur] / rate root units.
+                        value[codes[nxt]] = value[codes[cur]] / rate
+                        component[codes[nxt]] = codes[root]
+                        queue.append(nxt)
+        matrix = value[:, None] / value[None, :]
+        matrix[component[:, None] != component[None, :]] = np.nan
+        for (a, b), rate in quotes.items():
+            matrix[codes[a], codes[b]] = rate
+            if (b, a) not in quotes:
+                matrix[codes[b], codes[a]] = 1.0 / rate
+        np.fill_diagonal(matrix, 1.0)
+        self._codes, self._matrix = codes, matrix
+        self._built_at = time.time()
+        logger.info("Built %dx%d currency rate matrix.", len(currencies), len(currencies))
+
+    def _current(self) -> tuple:
+        with self._lock:
+            if self._built_at is None or time.time() - self._built_at > self.ttl:
+                self._build()
+            return self._codes, self._matrix
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._build()
+
+    def currencies(self) -> list:
+        return list(self._current()[0])
+
+    def rate(self, from_currency: str, to_currency: str) -> float:
+        codes, matrix = self._current()
+        src, dst = str(from_currency).upper(), str(to_currency).upper()
+        if src == dst:
+            return 1.0
+        if src not in codes or dst not in codes or np.isnan(matrix[codes[src], codes[dst]]):
+            raise CurrencyError(f"No rate from {src} to {dst}.")
+        return float(matrix[codes[src], codes[dst]])
+
+    def convert(self, amount: float, from_currency: str, to_currency: str) -> float:
+        return float(amount) * self.rate(from_currency, to_currency)
+
+    def convert_array(self, amounts, currencies, to_currency: str) -> np.ndarray:
+        """Convert each amount from its own currency; unknown currencies give NaN."""
+        codes, matrix = self._current()
+        dst = str(to_currency).upper()
+        amounts = np.asarray(amounts, dtype="float64")
+        if dst not in codes:
+            raise CurrencyError(f"Unknown currency {dst}.")
+        categories = list(codes)
+        src = pd.Categorical(pd.Series(currencies, dtype=object).str.upper(), categories=categories).codes
+        rates = np.where(src >= 0, matrix[src, codes[dst]], np.nan)
+        return amounts * rates
+
+
+def convert_frame(df: pd.DataFrame, to_currency: str, engine: RateEngine = None,
+                  columns=("amount", "split_amount"), currency_column: str = None,
+                  base: str = BASE_CURRENCY) -> pd.DataFrame:
+    """Copy of ``df`` with ``columns`` converted to ``to_currency`` in one vectorized pass.
+
+    Amounts are in ``base`` unless ``currency_column`` names a per-row
+    currency (blank meaning ``base``).
+    """
+    engine = engine or get_rate_engine()
+    out = df.copy()
+    present = [col for col in columns if col in out.columns]
+    if currency_column and currency_column in out.columns:
+        sources = out[currency_column].astype(object).where(out[currency_column].astype(str).str.strip() != "", base)
+        for col in present:
+            out[col] = engine.convert_array(out[col], sources.fillna(base), to_currency).round(2)
+    else:
+        factor = engine.rate(base, to_currency)
+        for col in present:
+            out[col] = (out[col].astype("float64") * factor).round(2)
+    return out
+
+
+def format_money(amount: float, currency: str = BASE_CURRENCY) -> str:
+    symbol = SYMBOLS.get(currency)
+    return f"{symbol}{amount:,.2f}" if symbol else f"{amount:,.2f} {currency}"
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_rate_engine() -> RateEngine:
+    """Process-wide engine; ``fx_rates_path`` points it at a rates file instead of the built-in quotes."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            path = get_setting("fx_rates_path")
+            _engine = RateEngine(FileRateProvider(path) if path else StaticRateProvider())
+        return _engine
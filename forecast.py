@@ -0,0 +1,182 @@
+import datetime
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import record_cache
+
+logger = logging.getLogger(__name__)
+
+# Trailing window of the plain daily run rate, and half-life of the weighted
+# one the forecast uses (recent days count most).
+BURN_WINDOW_DAYS = 7
+EWM_HALFLIFE_DAYS = 3
+# The dashboard warns when the budget is projected to run out this soon.
+FORECAST_WARNING_DAYS = 7
+# Projections further out than this get no exhaustion date.
+FORECAST_HORIZON_DAYS = 3650
+KEYS = ["username", "trip"]
+
+
+def daily_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """``username, trip, date, category, amount`` per day from an expense frame."""
+    days = df.assign(date=df["date"].dt.normalize())
+    return (days.groupby(KEYS + ["date", "category"], observed=True)["amount"].sum().reset_index()
+            .astype({"username": str, "trip": str, "category": str}))
+
+
+def _rates(daily: pd.DataFrame, spans: pd.DataFrame, keys: list, window: int, halflife: float) -> pd.DataFrame:
+    """Total spent, weighted (``burn_rate``) and plain (``run_rate``) daily rates per group as of its span's end.
+
+    These are ``ewm(halflife=...).mean()`` and ``rolling(window,
+    min_periods=1).mean()`` of the zero-filled daily series on its last
+    day, in closed form, so quiet days need no rows.
+    """
+    rows = daily.merge(spans, on=KEYS)
+    age = (rows["end"] - rows["date"]).dt.days.to_numpy()
+    decay = 0.5 ** (1 / halflife)
+    rows = rows.assign(weighted=rows["amount"] * decay ** age, recent=rows["amount"].where(age < window, 0.0))
+    out = rows.groupby(keys, sort=False)[["amount", "weighted", "recent"]].sum().reset_index().merge(spans, on=KEYS)
+    days = (out["end"] - out["start"]).dt.days + 1
+    out["burn_rate"] = out["weighted"] * (1 - decay) / (1 - decay ** days)
+    out["run_rate"] = out["recent"] / days.clip(upper=window)
+    return out.rename(columns={"amount": "spent"})[keys + ["spent", "burn_rate", "run_rate"]]
+
+
+def _budgets_for(trips: pd.DataFrame, budgets: pd.DataFrame) -> pd.Series:
+    """Each trip's budget, falling back to the user's overall one (blank trip) like the dashboard."""
+    budgets = budgets.astype({"username": str, "trip": str, "budget": "float64"})
+    own = trips[KEYS].merge(budgets, on=KEYS, how="left")["budget"]
+    overall = budgets[budgets["trip"] == ""].set_index("username")["budget"]
+    return own.fillna(trips["username"].map(overall)).fillna(0.0).to_numpy()
+
+
+def forecast_frame(daily: pd.DataFrame, budgets: pd.DataFrame, today: datetime.date = None,
+                   window: int = BURN_WINDOW_DAYS, halflife: float = EWM_HALFLIFE_DAYS) -> tuple:
+    """Burn rates and budget exhaustion for every user and trip in ``daily``, in one vectorized pass.
+
+    ``daily`` has ``username, trip, date, category, amount`` (see
+    daily_totals). Each trip's days run from its first expense to today (or
+    its last expense, if later), quiet days counting as zero, so a trip
+    that has gone quiet stops burning. ``burn_rate`` is the exponentially
+    weighted daily spend; ``days_left`` and ``exhaustion_date`` project it
+    over the remaining budget (for an exhausted budget, the day it ran
+    out). Returns ``(trips, categories)``; the second has each category's
+    rates.
+    """
+    trip_columns = KEYS + ["start", "end", "spent", "budget", "remaining", "burn_rate", "run_rate", "days_left",
+                           "exhaustion_date"]
+    category_columns = KEYS + ["category", "spent", "burn_rate", "run_rate"]
+    daily = daily.dropna(subset=["date"])
+    if daily.empty:
+        return pd.DataFrame(columns=trip_columns), pd.DataFrame(columns=category_columns)
+    daily = daily.astype({"username": str, "trip": str, "category": str})
+    daily["date"] = pd.to_datetime(daily["date"]).dt.normalize()
+    today = pd.Timestamp(today or datetime.date.today())
+
+    spans = daily.groupby(KEYS)["date"].agg(start="min", end="max").reset_index()
+    spans["end"] = spans["end"].where(spans["end"] > today, today)
+    trips = spans.merge(_rates(daily, spans, KEYS, window, halflife), on=KEYS)
+    by_category = _rates(daily, spans, KEYS + ["category"], window, halflife)
+    trips["budget"] = _budgets_for(trips, budgets)
+    trips["remaining"] = trips["budget"] - trips["spent"]
+    for frame in (trips, by_category):
+        frame[["spent", "burn_rate", "run_rate"]] = frame[["spent", "burn_rate", "run_rate"]].round(2)
+    trips["remaining"] = trips["remaining"].round(2)
+
+    burning = trips["burn_rate"] > 0
+    left = trips["remaining"] / trips["burn_rate"].where(burning)
+    trips["days_left"] = np.select(
+        [trips["budget"] <= 0, trips["remaining"] <= 0, burning], [np.nan, 0.0, left], default=np.inf)
+    ahead = (trips["days_left"] <= FORECAST_HORIZON_DAYS) & (trips["remaining"] > 0)
+    projected = trips["end"] + pd.to_timedelta(np.floor(trips["days_left"].where(ahead)), unit="D")
+    # Already exhausted: the first day the running total reached the budget.
+    days = daily.groupby(KEYS + ["date"])["amount"].sum().reset_index().merge(trips[KEYS + ["budget"]], on=KEYS)
+    days["spent"] = days.groupby(KEYS, sort=False)["amount"].cumsum()
+    crossed = days[(days["budget"] > 0) & (days["spent"] >= days["budget"])].groupby(KEYS)["date"].min()
+    ran_out = trips[KEYS].merge(crossed.rename("date").reset_index(), on=KEYS, how="left")["date"]
+    trips["exhaustion_date"] = projected.where(ahead, ran_out.to_numpy())
+    return trips[trip_columns], by_category[category_columns].reset_index(drop=True)
+
+
+def forecast_trip(daily: pd.DataFrame, budget: float, today: datetime.date = None,
+                  window: int = BURN_WINDOW_DAYS, halflife: float = EWM_HALFLIFE_DAYS) -> dict:
+    """Forecast for one user's trip from its ``date, category, amount`` daily totals.
+
+    Same fields as a ``forecast_frame`` row, plus ``categories`` (the
+    per-category rates, fastest first).
+    """
+    daily = daily.assign(username="", trip="")
+    budgets = pd.DataFrame([("", "", float(budget))], columns=["username", "trip", "budget"])
+    trips, categories = forecast_frame(daily, budgets, today, window, halflife)
+    if trips.empty:
+        result = {"spent": 0.0, "budget": float(budget), "remaining": float(budget), "burn_rate": 0.0,
+                  "run_rate": 0.0, "days_left": np.inf if budget > 0 else np.nan, "exhaustion_date": None}
+    else:
+        result = trips.drop(columns=KEYS).iloc[0].to_dict()
+        if pd.isna(result["exhaustion_date"]):
+            result["exhaustion_date"] = None
+    result["categories"] = (categories.drop(columns=KEYS).sort_values("burn_rate", ascending=False)
+                            .reset_index(drop=True))
+    return result
+
+
+class ForecastEngine:
+    """Per-trip forecasts over a store, each kept until the next write.
+
+    The store's daily totals are already maintained on every expense write
+    (ExpenseAggregates on Sheets, triggers on SQLite). A forecast is cached
+    with the user's ``data_version``, the budget and the date, and is only
+    recomputed when one of them changes.
+    """
+
+    def __init__(self, window_days: int = BURN_WINDOW_DAYS, halflife_days: float = EWM_HALFLIFE_DAYS):
+        self.window_days = window_days
+        self.halflife_days = halflife_days
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def forecast(self, store, username: str, trip: str = None, budget: float = None,
+                 today: datetime.date = None) -> dict:
+        today = today or datetime.date.today()
+        if budget is None:
+            budget = store.get_budget(username, trip=trip)
+        stamp = (store.data_version(username), float(budget), today)
+        key = (username, trip or "")
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit is not None and hit[0] == stamp:
+            record_cache("forecast", "hit")
+            return hit[1]
+        record_cache("forecast", "miss")
+        result = forecast_trip(store.daily_totals(username, trip), float(budget), today,
+                               self.window_days, self.halflife_days)
+        with self._lock:
+            self._cache[key] = (stamp, result)
+        return result
+
+    def backfill(self, store, today: datetime.date = None) -> tuple:
+        """Forecast every user's trips in one batch pass; returns ``forecast_frame``'s ``(trips, categories)``."""
+        df = store.load_all_expenses()
+        trips, categories = forecast_frame(daily_totals(df), store.load_budgets(), today,
+                                           self.window_days, self.halflife_days)
+        logger.info("Forecast %d trips for %d users.", len(trips), trips["username"].nunique())
+        return trips, categories
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_forecast_engine() -> ForecastEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ForecastEngine()
+        return _engine
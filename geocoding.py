@@ -0,0 +1,202 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import record_cache, timed
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+USER_AGENT = "travel-expense-tracker-app (your-email@example.com)"
+GEOCODE_CACHE_PATH = "geocode_cache.db"
+# Nominatim's usage policy allows one request per second per application.
+REQUESTS_PER_SECOND = 1.0
+MEMORY_CACHE_SIZE = 512
+DISK_CACHE_TTL = 30 * 24 * 3600
+REQUEST_TIMEOUT = 10
+
+
+class GeocodingError(Exception):
+    """The provider could not answer a search."""
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query or "").strip().lower()
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every session in the process."""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class NominatimProvider:
+    """Nominatim search over a pooled keep-alive session.
+
+    ``base_url`` can point at a local stub server that speaks the same API.
+    """
+
+    def __init__(self, base_url: str = NOMINATIM_URL, limiter: TokenBucket = None):
+        self.base_url = base_url
+        self.limiter = limiter or TokenBucket()
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+    def search(self, query: str, limit: int = 5) -> list:
+        params = {
+            "q": query,
+            "format": "json",
+            "addressdetails": 1,
+            "limit": limit,
+            "accept-language": "en",
+        }
+        self.limiter.acquire()
+        with timed("http", "nominatim.search") as call:
+            try:
+                resp = self.session.get(self.base_url, params=params, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                raise GeocodingError(f"API error: {e}") from e
+            call["bytes"] = len(resp.content or b"")
+            if resp.status_code != 200:
+                call["error"] = str(resp.status_code)
+                raise GeocodingError(f"Nominatim API error: {resp.status_code}")
+            return resp.json()
+
+
+class DiskCache:
+    """Geocoding results persisted in SQLite so they survive restarts."""
+
+    def __init__(self, path: str = GEOCODE_CACHE_PATH, ttl: float = DISK_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, results TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT results, fetched_at FROM geocode WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, results: list) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, results, fetched_at) VALUES (?, ?, ?)",
+                (key, json.dumps(results), time.time()),
+            )
+            self._conn.commit()
+
+
+class GeocodingService:
+    """Location search with memory and disk caches in front of a rate-limited provider.
+
+    Streamlit reruns the script on every widget interaction, so the same query
+    arrives many times; only the first one reaches the provider. A query that
+    extends an earlier one ("Pari" -> "Paris") is answered by filtering the
+    earlier results when any of them still match.
+    """
+
+    def __init__(self, provider=None, disk_cache: DiskCache = None, memory_size: int = MEMORY_CACHE_SIZE):
+        self.provider = provider or NominatimProvider()
+        self.disk_cache = disk_cache
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query: str, trip: str, limit: int) -> str:
+        return json.dumps([normalize_query(query), normalize_query(trip), limit])
+
+    def _remember(self, key: str, results: list) -> None:
+        with self._lock:
+            self._memory[key] = results
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _from_prefix(self, query: str, trip: str, limit: int):
+        norm = normalize_query(query)
+        words = norm.split()
+        with self._lock:
+            candidates = list(self._memory.items())
+        for key, results in reversed(candidates):
+            prev_query, prev_trip, prev_limit = json.loads(key)
+            if prev_trip != normalize_query(trip) or prev_limit != limit:
+                continue
+            if not prev_query or prev_query == norm or not norm.startswith(prev_query):
+                continue
+            matches = [r for r in results if all(w in r.get("display_name", "").lower() for w in words)]
+            if matches:
+                return matches
+        return None
+
+    def search(self, query: str, trip: str = None, limit: int = 5) -> list:
+        key = self._key(query, trip, limit)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                record_cache("geocode", "memory")
+                return self._memory[key]
+
+        results = self.disk_cache.get(key) if self.disk_cache else None
+        if results is None:
+            results = self._from_prefix(query, trip, limit)
+            if results is not None:
+                record_cache("geocode", "prefix")
+                self._remember(key, results)
+                return results
+            record_cache("geocode", "miss")
+            full_query = f"{query}, {trip}" if trip else query
+            results = self.provider.search(full_query, limit=limit)
+            if self.disk_cache:
+                self.disk_cache.put(key, results)
+        else:
+            record_cache("geocode", "disk")
+        self._remember(key, results)
+        return results
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_geocoder() -> GeocodingService:
+    """Process-wide geocoder; ``geocoder_url`` points it at another Nominatim-compatible server."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            provider = NominatimProvider(base_url=get_setting("geocoder_url", NOMINATIM_URL))
+            disk_cache = DiskCache(get_setting("geocode_cache_path", GEOCODE_CACHE_PATH))
+            _service = GeocodingService(provider, disk_cache)
+        return _service
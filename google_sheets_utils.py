@@ -1,8 +1,23 @@
+import contextlib
+import datetime
+import functools
+import os
+import threading
+import time
+import uuid
+import warnings
+import zlib
 import gspread
 import pandas as pd
 import logging
 import streamlit as st
 from oauth2client.service_account import ServiceAccountCredentials
+from aggregates import ExpenseAggregates, frame_category_totals, frame_daily_totals
+from anomaly import SpendingStats
+from instrumentation import InstrumentedHTTPClient, record_cache
+from schema import NUMERIC_COLUMNS, build_expense_frame, concat_expense_frames, normalize_header, split_participants
+from snapshot import SNAPSHOT_DIR, LedgerSnapshot
+from write_queue import JournalLockedError, WriteBehindQueue, backoff_delay, is_retryable
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,103 +27,1124 @@ logger = logging.getLogger(__name__)
 
 SHEET_NAME = "Sheet1"
 BUDGET_SHEET = "Budget"
+BUDGET_HEADER = ["username", "Budget", "trip"]
+# Persistent per-expense id, stored after the original Sheet1 columns.
+ID_COLUMN = "id"
+# Columns B..G, the ones an expense update may change.
+EDITABLE_COLUMNS = ["date", "category", "description", "amount", "location", "trip"]
+# Columns query_expenses can sort by, and its default page size.
+QUERY_SORT_KEYS = ("date", "amount", "category", "location", "description")
+QUERY_PAGE_SIZE = 50
+# What a foreign-currency expense was entered as; added to the header the
+# first time one is recorded. ``amount`` itself is always in rupees.
+CURRENCY_COLUMNS = ["currency", "original amount"]
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+# Service account tokens live for an hour; rebuild the client a bit before that.
+TOKEN_LIFETIME = 55 * 60
+# Seconds a downloaded copy of the ledger is served before it is fetched again.
+LEDGER_CACHE_TTL = 60
+# Refresh by reading only rows appended since the last sync, with a periodic
+# full download to pick up edits made outside the app.
+LEDGER_INCREMENTAL_SYNC = True
+LEDGER_FULL_SYNC_INTERVAL = 15 * 60
+# Keep a columnar copy of the ledger on disk so a restart skips the full
+# download; None disables it. Tail syncs refresh it at most this often.
+LEDGER_SNAPSHOT_DIR = SNAPSHOT_DIR
+LEDGER_SNAPSHOT_INTERVAL = 5 * 60
+# Trips moved out of the hot ledger go to one worksheet per year of their
+# last expense; the catalog sheet records which trip went where.
+ARCHIVE_PREFIX = "Archive_"
+ARCHIVE_AFTER_DAYS = 90
+CATALOG_SHEET = "Catalog"
+CATALOG_HEADER = ["partition", "username", "trip", "rows", "first_date", "last_date", "archived_at"]
+# Attempts per bulk append before giving up on retryable errors (429, 5xx).
+BULK_APPEND_ATTEMPTS = 5
+# Journal writes locally and send them from a background thread (see write_queue).
+WRITE_BEHIND = True
+
 def get_secrets():
     sheet_key = st.secrets["sheet_key"]
     service_account_info = st.secrets["gcp_service_account"]
     return sheet_key, service_account_info
 
-def connect_sheet():
-    sheet_key, service_account_info = get_secrets()
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(service_account_info, scope)
-    client = gspread.authorize(creds)
-    logger.info("Successfully connected to the Google Sheet.")
-    return client.open_by_key(sheet_key)
+class SheetConnection:
+    """Process-wide cache of the authorized client, spreadsheet and worksheet handles.
 
-def load_ex_gsheet(sheet: gspread.Spreadsheet, username: str) -> pd.DataFrame:
-    ws = sheet.worksheet(SHEET_NAME)
-    raw_data = ws.get_all_values()
+    Streamlit re-executes the script on every interaction, but imported modules
+    survive, so keeping the handles here saves the auth, open_by_key and
+    worksheet metadata round trips on each rerun.
+    """
 
-    if not raw_data or len(raw_data) < 2:
-        raise ValueError("Sheet is empty or does not have enough rows.")
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._expires_at = 0.0
+        # False for processes (the CLIs) that write synchronously and leave the app's journal alone.
+        self.write_behind = WRITE_BEHIND
+
+    def spreadsheet(self) -> gspread.Spreadsheet:
+        with self._lock:
+            if self._spreadsheet is None or time.time() >= self._expires_at:
+                self._connect()
+            return self._spreadsheet
+
+    def _connect(self) -> None:
+        sheet_key, service_account_info = get_secrets()
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(service_account_info, SCOPE)
+        client = gspread.authorize(creds, http_client=InstrumentedHTTPClient)
+        self._spreadsheet = client.open_by_key(sheet_key)
+        self._worksheets = {}
+        self._expires_at = time.time() + TOKEN_LIFETIME
+        logger.info("Successfully connected to the Google Sheet.")
+
+    def owns(self, sheet) -> bool:
+        return sheet is not None and sheet is self._spreadsheet
+
+    def worksheet(self, sheet: gspread.Spreadsheet, title: str) -> gspread.Worksheet:
+        key = (sheet.id, title)
+        with self._lock:
+            ws = self._worksheets.get(key)
+        record_cache("worksheets", "hit" if ws is not None else "miss")
+        if ws is None:
+            ws = sheet.worksheet(title)
+            self.remember(sheet, ws)
+        return ws
+
+    def remember(self, sheet: gspread.Spreadsheet, ws: gspread.Worksheet) -> None:
+        with self._lock:
+            self._worksheets[(sheet.id, ws.title)] = ws
+
+    def forget(self, sheet: gspread.Spreadsheet, title: str) -> None:
+        with self._lock:
+            self._worksheets.pop((sheet.id, title), None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spreadsheet = None
+            self._worksheets = {}
+            self._expires_at = 0.0
+
+
+_connection = SheetConnection()
+
+
+def connect_sheet(write_behind: bool = WRITE_BEHIND):
+    """The shared spreadsheet handle.
+
+    Batch jobs pass ``write_behind=False``: their writes then go straight to
+    Sheets and they never open, replay or compact the app's write journal.
+    """
+    _connection.write_behind = write_behind
+    sheet = _connection.spreadsheet()
+    if write_behind:
+        # Creating the queue replays anything a previous process left journaled.
+        get_write_queue()
+    return sheet
+
+def get_worksheet(sheet: gspread.Spreadsheet, title: str = SHEET_NAME) -> gspread.Worksheet:
+    return _connection.worksheet(sheet, title)
+
+def _is_auth_error(e: gspread.exceptions.APIError) -> bool:
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None) == 401
+
+def _reconnect_on_auth_error(func):
+    """Retry once against a fresh connection when the token was rejected."""
+    @functools.wraps(func)
+    def wrapper(sheet, *args, **kwargs):
+        try:
+            return func(sheet, *args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            if not _is_auth_error(e) or not _connection.owns(sheet):
+                raise
+            logger.warning("Sheets rejected our credentials, reconnecting: %s", e)
+            _connection.reset()
+            return func(_connection.spreadsheet(), *args, **kwargs)
+    return wrapper
+
+_write_queue = None
+_write_queue_locked = False
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """The process's write-behind queue, or None if another process owns the journal."""
+    global _write_queue, _write_queue_locked
+    with _write_queue_lock:
+        if _write_queue is None and not _write_queue_locked:
+            try:
+                _write_queue = WriteBehindQueue(
+                    lambda title: get_worksheet(_connection.spreadsheet(), title),
+                    on_auth_error=_connection.reset,
+                    on_drop=_forget_dropped,
+                    locate=_locate_queued,
+                ).start()
+            except JournalLockedError as e:
+                logger.warning("%s Writing to Sheets directly.", e)
+                _write_queue_locked = True
+        return _write_queue
+
+def _uses_write_queue(sheet) -> bool:
+    return (WRITE_BEHIND and _connection.write_behind and _connection.owns(sheet)
+            and get_write_queue() is not None)
+
+def _append_row(sheet, title: str, values: list, expense_id: str = None) -> None:
+    if _uses_write_queue(sheet):
+        get_write_queue().submit("append", title, values, expense_id=expense_id)
+    else:
+        get_worksheet(sheet, title).append_row(values)
+
+def _update_range(sheet, title: str, range_name: str, values: list) -> None:
+    _update_ranges(sheet, title, [(range_name, values)])
+
+def _update_ranges(sheet, title: str, updates: list) -> None:
+    """Write several ``(range, values)`` blocks; they reach Sheets as one batch_update."""
+    if _uses_write_queue(sheet):
+        queue = get_write_queue()
+        for range_name, values in updates:
+            queue.submit("update", title, values, range_name=range_name)
+    else:
+        get_worksheet(sheet, title).batch_update([{"range": r, "values": v} for r, v in updates])
+
+def _forget_dropped(batch: list, error: Exception) -> None:
+    """Sheets refused these writes for good, so the cached copies they were patched into are wrong."""
+    for title in {op["worksheet"] for op in batch}:
+        if title == BUDGET_SHEET:
+            _budgets.invalidate()
+        elif title == CATALOG_SHEET:
+            _catalog.invalidate()
+        else:
+            _partition_ledger(title).invalidate()
+
+def _locate_queued(title: str, expense_ids: list) -> dict:
+    """Current rows of ``expense_ids`` in ``title``, for queued updates that name their expense."""
+    sheet = _connection.spreadsheet()
+    ledger = _partition_ledger(title)
+    try:
+        return _resolve_rows(sheet, expense_ids, ledger)
+    except ValueError:
+        # Some were deleted or archived meanwhile; the queue drops (and reports) their edits.
+        found = list(ledger.rows_for_ids(sheet, expense_ids))
+        return _resolve_rows(sheet, found, ledger) if found else {}
+
+def dropped_writes(since: int = 0) -> list:
+    """Queued writes that were lost to a permanent error (see WriteBehindQueue.dropped)."""
+    return _write_queue.dropped(since) if _write_queue is not None else []
+
+def _update_expense_cells(sheet, title: str, edits: list, rows: dict) -> None:
+    """Write ``(expense_id, first_col, values)`` blocks (one row each, ``first_col`` 0-based) as one batch.
+
+    Queued blocks carry the expense id, not the row number, and are located
+    again when they are sent: rows move when others are deleted or archived.
+    ``rows`` are the current row numbers, used when writing directly.
+    """
+    ranges = [(expense_id, f"{_col_letter(first_col)}{{row}}:{_col_letter(first_col + len(values) - 1)}{{row}}",
+               values) for expense_id, first_col, values in edits]
+    if _uses_write_queue(sheet):
+        queue = get_write_queue()
+        for expense_id, template, values in ranges:
+            queue.submit("update", title, [values], range_name=template, expense_id=expense_id)
+    else:
+        _update_ranges(sheet, title, [(template.format(row=rows[expense_id]), [values])
+                                      for expense_id, template, values in ranges])
+
+def flush_writes(sheet, title: str = None) -> None:
+    """Wait for queued writes so a following read or row delete sees them."""
+    if _write_queue is not None and _uses_write_queue(sheet):
+        if not _write_queue.flush(title):
+            logger.warning("Timed out waiting for queued writes to %s.", title or "the spreadsheet")
+
+@contextlib.contextmanager
+def _reading(cache, sheet):
+    """Hold ``cache``'s lock for a read, first waiting for queued writes if its copy is due a refresh.
+
+    The wait happens outside the lock, so a write stuck in backoff does not
+    stall readers that the cached copy can still serve.
+    """
+    with cache._lock:
+        entry = cache._entries.get(sheet.id)
+        stale = entry is None or time.time() - entry["fetched_at"] > cache.ttl
+    if stale:
+        flush_writes(sheet, cache.title)
+    with cache._lock:
+        yield
+
+def _col_letter(col: int) -> str:
+    """Sheet column letter for a 0-based column index."""
+    return gspread.utils.rowcol_to_a1(1, col + 1).rstrip("0123456789")
+
+def new_expense_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+def _row_checksum(values: list) -> int:
+    """CRC of a row that ignores how Sheets rendered numbers and trailing blanks."""
+    cells = []
+    for v in values:
+        text = str(v).strip().lower()
+        try:
+            text = repr(float(text))
+        except ValueError:
+            pass
+        cells.append(text)
+    while cells and not cells[-1]:
+        cells.pop()
+    return zlib.crc32("\x1f".join(cells).encode("utf-8"))
+
+class LedgerCache:
+    """Read-through copy of the expense ledger, shared by every read helper.
+
+    The sheet is downloaded once per TTL and indexed by username and by
+    expense id, so loading a user's expenses only touches that user's rows and
+    an id resolves to its sheet row without a scan. The write helpers patch the
+    copy in place, renumbering after deletes, so a rerun after a submit does
+    not have to download the sheet again. Summary totals and spending
+    statistics are kept alongside and updated by the same row deltas.
+
+    A process starting cold opens the on-disk snapshot and only syncs what
+    changed since it was saved. Until something needs the decoded rows (a
+    write, an id lookup, a batch job), per-user frames and totals are read
+    straight from the snapshot's columns.
+
+    One cache covers one worksheet, ``title``: the hot ledger or an archive
+    partition.
+    """
+
+    def __init__(self, ttl: float = LEDGER_CACHE_TTL, incremental: bool = LEDGER_INCREMENTAL_SYNC,
+                 full_sync_interval: float = LEDGER_FULL_SYNC_INTERVAL, snapshot_dir: str = LEDGER_SNAPSHOT_DIR,
+                 title: str = SHEET_NAME):
+        self.title = title
+        self.ttl = ttl
+        self.incremental = incremental
+        self.full_sync_interval = full_sync_interval
+        self.snapshot_dir = snapshot_dir
+        self._lock = threading.RLock()
+        self._entries = {}
+
+    def _entry(self, sheet: gspread.Spreadsheet) -> dict:
+        key = sheet.id
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is not None and now - entry["fetched_at"] > self.ttl:
+                if (self.incremental and now - entry["full_sync_at"] <= self.full_sync_interval
+                        and self._sync_tail(sheet, entry)):
+                    entry["fetched_at"] = now
+                    record_cache("ledger", "tail_sync")
+                else:
+                    entry = None
+            elif entry is not None:
+                record_cache("ledger", "hit")
+            if entry is None and key not in self._entries:
+                entry = self._from_snapshot(sheet)
+                if entry is not None:
+                    record_cache("ledger", "snapshot")
+            if entry is None:
+                entry = self._fetch(sheet)
+                record_cache("ledger", "fetch")
+            self._entries[key] = entry
+            return entry
+
+    @staticmethod
+    def _new_entry(header: list) -> dict:
+        now = time.time()
+        return {
+            "header": header,
+            "id_col": header.index(ID_COLUMN) if ID_COLUMN in header else None,
+            "shared_col": header.index("shared_with") if "shared_with" in header else None,
+            "rows": [],
+            # A LedgerSnapshot standing in for rows and indexes until _materialize decodes it.
+            "snapshot": None,
+            "by_user": {},
+            "by_id": {},
+            "by_participant": {},
+            # False while any row lacks an id; ensure_ids gives them one.
+            "ids_complete": ID_COLUMN in header,
+            "aggregates": ExpenseAggregates(header),
+            "stats": SpendingStats(header),
+            "fetched_at": now,
+            "full_sync_at": now,
+            "snapshot_at": 0.0,
+        }
+
+    def _loaded(self, sheet: gspread.Spreadsheet) -> dict:
+        return self._materialize(self._entry(sheet))
+
+    def _materialize(self, entry: dict) -> dict:
+        """Decode a snapshot-backed entry into rows and indexes; a no-op once it has been."""
+        snap = entry["snapshot"]
+        if snap is None:
+            return entry
+        entry["snapshot"] = None
+        entry["by_user"] = {user: positions.tolist() for user, positions in snap.user_positions().items()
+                            if len(positions)}
+        for values in snap.rows():
+            self._add_row(entry, values, by_user=False)
+        return entry
+
+    def _lazy(self, entry: dict, names: list):
+        """The entry's snapshot if ``names`` can be read from it as they are, else None (after decoding it)."""
+        snap = entry["snapshot"]
+        if snap is not None and set(names) <= set(normalize_header(snap.header)):
+            return snap
+        self._materialize(entry)
+        return None
+
+    def _fetch(self, sheet: gspread.Spreadsheet) -> dict:
+        previous = self._entries.get(sheet.id)
+        saved_at = previous["snapshot_at"] if previous is not None else 0.0
+        due = self._snapshot_due(saved_at)
+        # Read before the download, so the snapshot never claims a revision newer than its rows.
+        revision = self._revision(sheet) if due else None
+        raw_data = get_worksheet(sheet, self.title).get_all_values()
+        header = [col.strip().lower() for col in raw_data[0]] if raw_data else []
+        entry = self._new_entry(header)
+        entry["snapshot_at"] = saved_at
+        for values in raw_data[1:]:
+            self._add_row(entry, values)
+        logger.info("Fetched %d rows from %s.", len(entry["rows"]), self.title)
+        if due:
+            self._save_snapshot(sheet, entry, revision)
+        return entry
+
+    # --- on-disk snapshot ---
+
+    def _snapshot_root(self, sheet: gspread.Spreadsheet) -> str:
+        if self.title == SHEET_NAME:
+            return os.path.join(self.snapshot_dir, sheet.id)
+        return os.path.join(self.snapshot_dir, f"{sheet.id}.{self.title}")
+
+    def _snapshot_due(self, saved_at: float) -> bool:
+        return bool(self.snapshot_dir) and time.time() - saved_at > LEDGER_SNAPSHOT_INTERVAL
+
+    def _revision(self, sheet: gspread.Spreadsheet):
+        """The spreadsheet's last-modified time, if snapshots are on and Drive tells us.
+
+        This is a Drive metadata request, so it is only made when a snapshot
+        is about to be written or checked.
+        """
+        if not self.snapshot_dir:
+            return None
+        try:
+            getter = getattr(sheet, "get_lastUpdateTime", None)
+            return getter() if getter else getattr(sheet, "lastUpdateTime", None)
+        except Exception as e:
+            logger.warning("Could not read the spreadsheet revision: %s", e)
+            return None
+
+    def _save_snapshot(self, sheet: gspread.Spreadsheet, entry: dict, revision) -> None:
+        if not self.snapshot_dir or not entry["header"]:
+            return
+        try:
+            LedgerSnapshot.save(self._snapshot_root(sheet), entry["header"], entry["rows"], revision=revision)
+            entry["snapshot_at"] = time.time()
+        except OSError as e:
+            logger.warning("Could not save the ledger snapshot: %s", e)
+
+    def _from_snapshot(self, sheet: gspread.Spreadsheet):
+        """Seed an entry from disk, validated against the live sheet; None means fetch it all."""
+        if not self.snapshot_dir:
+            return None
+        snap = LedgerSnapshot.open(self._snapshot_root(sheet))
+        if snap is None:
+            return None
+        revision = self._revision(sheet)
+        entry = self._new_entry(list(snap.header))
+        entry["snapshot"] = snap
+        if entry["id_col"] is not None:
+            entry["ids_complete"] = "" not in snap.distinct(entry["id_col"])
+        entry["snapshot_at"] = snap.meta["saved_at"]
+        logger.info("Loaded ledger snapshot v%d (%d rows).", snap.meta["version"], snap.row_count)
+        if revision is not None and revision == snap.meta.get("revision"):
+            return entry
+        # The sheet moved on since the snapshot; catch up like a stale cache would.
+        entry["full_sync_at"] = snap.meta["saved_at"]
+        if (self.incremental and time.time() - entry["full_sync_at"] <= self.full_sync_interval
+                and entry["id_col"] is not None and self._sync_tail(sheet, entry, revision)):
+            return entry
+        return None
+
+    def _sync_tail(self, sheet: gspread.Spreadsheet, entry: dict, revision=None) -> bool:
+        """Append rows added since the last sync; False means a full resync is needed.
+
+        The range read starts at the last row we already hold. If that row no
+        longer matches our checksum, something above it was deleted or edited.
+        ``revision`` is the spreadsheet's, if the caller has already read it.
+        """
+        header = entry["header"]
+        if not header:
+            return False
+        due = self._snapshot_due(entry["snapshot_at"])
+        if due and revision is None:
+            revision = self._revision(sheet)
+        snap = entry["snapshot"]
+        count = snap.row_count if snap is not None else len(entry["rows"])
+        last_row = count + 1
+        last_col = _col_letter(len(header) - 1)
+        values = get_worksheet(sheet, self.title).get(f"A{last_row}:{last_col}")
+        if not count:
+            anchor = header
+        else:
+            anchor = snap.row(count - 1) if snap is not None else entry["rows"][-1]
+        if not values or _row_checksum(values[0]) != _row_checksum(anchor):
+            logger.info("Ledger changed above row %d, doing a full resync.", last_row)
+            return False
+        if len(values) > 1:
+            self._materialize(entry)
+        for row in values[1:]:
+            self._add_row(entry, row)
+        logger.info("Synced %d new ledger rows.", len(values) - 1)
+        if due:
+            if len(values) > 1:
+                self._save_snapshot(sheet, entry, revision)
+            else:
+                # Nothing new to save; look again next interval rather than on every sync.
+                entry["snapshot_at"] = time.time()
+        return True
+
+    @staticmethod
+    def _add_row(entry: dict, values: list, aggregate: bool = True, by_user: bool = True) -> None:
+        width = len(entry["header"])
+        values = [str(v) for v in values[:width]] + [""] * (width - len(values))
+        entry["rows"].append(values)
+        if aggregate:
+            entry["aggregates"].add(values)
+            entry["stats"].add(values)
+        position = len(entry["rows"]) - 1
+        if width and by_user:
+            entry["by_user"].setdefault(values[0], []).append(position)
+        if entry["id_col"] is not None and values[entry["id_col"]]:
+            entry["by_id"][values[entry["id_col"]]] = position
+        else:
+            entry["ids_complete"] = False
+        if entry["shared_col"] is not None and values[entry["shared_col"]]:
+            for participant in split_participants(values[entry["shared_col"]]):
+                entry["by_participant"].setdefault(participant, []).append(position)
+
+    def ensure_columns(self, sheet: gspread.Spreadsheet, names: list):
+        """Indexes of ``names`` in the ledger header, appending any that are missing."""
+        with _reading(self, sheet):
+            entry = self._loaded(sheet)
+            header = entry["header"]
+            if not header:
+                return None
+            missing = [name for name in names if name not in header]
+            if missing:
+                ws = get_worksheet(sheet, self.title)
+                width = len(header) + len(missing)
+                if ws.col_count < width:
+                    ws.add_cols(width - ws.col_count)
+                _update_range(sheet, self.title, f"{_col_letter(len(header))}1", [missing])
+                header.extend(missing)
+                for row in entry["rows"]:
+                    row.extend([""] * len(missing))
+            return [header.index(name) for name in names]
+
+    def ensure_ids(self, sheet: gspread.Spreadsheet) -> None:
+        """Give rows written before ids existed an id, adding the id column if needed, in one column write.
+
+        This changes the spreadsheet, so only write paths and migrate_ledger
+        call it; read-only jobs see such rows with a blank id.
+        """
+        with _reading(self, sheet):
+            entry = self._entry(sheet)
+            if entry["ids_complete"] or not entry["header"]:
+                return
+            self._materialize(entry)
+            if entry["id_col"] is None:
+                entry["id_col"] = self.ensure_columns(sheet, [ID_COLUMN])[0]
+            rows, id_col = entry["rows"], entry["id_col"]
+            missing = [i for i, row in enumerate(rows) if not row[id_col]]
+            for i in missing:
+                rows[i][id_col] = new_expense_id()
+                entry["by_id"][rows[i][id_col]] = i
+            if missing:
+                letter = _col_letter(id_col)
+                _update_range(sheet, self.title, f"{letter}2:{letter}{len(rows) + 1}", [[row[id_col]] for row in rows])
+                logger.info("Assigned ids to %d %s rows.", len(missing), self.title)
+            entry["ids_complete"] = True
+
+    def user_rows(self, sheet: gspread.Spreadsheet, username: str, trip: str = None) -> tuple:
+        """Return the header, copies of ``username``'s rows (on ``trip``) and their sheet row numbers."""
+        with _reading(self, sheet):
+            entry = self._loaded(sheet)
+            positions = entry["by_user"].get(username, [])
+            if trip and "trip" in entry["header"]:
+                trip_col = entry["header"].index("trip")
+                positions = [i for i in positions if entry["rows"][i][trip_col] == trip]
+            rows = [list(entry["rows"][i]) for i in positions]
+            return list(entry["header"]), rows, [i + 2 for i in positions]
+
+    def user_frame(self, sheet: gspread.Spreadsheet, username: str, trip: str = None,
+                   columns: list = None) -> pd.DataFrame:
+        """``username``'s expenses (on ``trip``) as a typed frame with sheet ``Row`` numbers.
+
+        ``columns`` limits the frame to those (plus the columns derived from
+        them); while the entry is still the snapshot only they are read.
+        """
+        with _reading(self, sheet):
+            snap = self._lazy(self._entry(sheet), ["username"] + (["trip"] if trip else []))
+            if snap is not None:
+                return snap.frame(columns, username=username, trip=trip, row_numbers=True)
+        df = build_expense_frame(*self.user_rows(sheet, username, trip=trip))
+        if columns is None:
+            return df
+        keep = set(columns) | {"Row"}
+        keep |= {"split_amount"} if "amount" in keep else set()
+        keep |= {"shared_list"} if "shared_with" in keep else set()
+        return df[[name for name in df.columns if name in keep]]
+
+    def select(self, sheet: gspread.Spreadsheet, username: str, trip: str = None, start: str = None, end: str = None,
+               categories=None, location: str = None, shared: bool = None) -> tuple:
+        """Like ``user_rows``, keeping only the rows that pass the filters.
+
+        Walks the user's row index and copies only the matches. ``start`` and
+        ``end`` are inclusive ISO dates, ``location`` a case-insensitive
+        substring, ``shared`` True/False for split/unsplit expenses.
+        """
+        with _reading(self, sheet):
+            entry = self._loaded(sheet)
+            header, rows = entry["header"], entry["rows"]
+            cols = {name: header.index(name) for name in ("date", "category", "location", "trip") if name in header}
+            shared_col = entry["shared_col"]
+            categories = set(categories) if categories else None
+            location = location.lower() if location else None
+            matches, row_numbers = [], []
+            for i in entry["by_user"].get(username, []):
+                row = rows[i]
+                day = row[cols["date"]][:10]
+                if ((trip and row[cols["trip"]] != trip)
+                        or (start and day < start) or (end and day > end)
+                        or (categories is not None and row[cols["category"]] not in categories)
+                        or (location and location not in row[cols["location"]].lower())
+                        or (shared is not None and bool(shared_col is not None and row[shared_col]) != shared)):
+                    continue
+                matches.append(list(row))
+                row_numbers.append(i + 2)
+            return list(header), matches, row_numbers
+
+    def shared_rows(self, sheet: gspread.Spreadsheet, username: str, trip: str = None) -> tuple:
+        """Like ``user_rows``, for the shared expenses ``username`` paid or takes part in."""
+        with _reading(self, sheet):
+            entry = self._loaded(sheet)
+            shared_col = entry["shared_col"]
+            if shared_col is None:
+                return list(entry["header"]), [], []
+            rows = entry["rows"]
+            paid = [i for i in entry["by_user"].get(username, []) if rows[i][shared_col]]
+            positions = sorted(set(paid).union(entry["by_participant"].get(username, [])))
+            if trip and "trip" in entry["header"]:
+                trip_col = entry["header"].index("trip")
+                positions = [i for i in positions if rows[i][trip_col] == trip]
+            return list(entry["header"]), [list(rows[i]) for i in positions], [i + 2 for i in positions]
+
+    def all_rows(self, sheet: gspread.Spreadsheet) -> tuple:
+        """The header, every row and their sheet row numbers, for batch jobs reading the whole worksheet."""
+        with _reading(self, sheet):
+            entry = self._loaded(sheet)
+            return list(entry["header"]), list(entry["rows"]), list(range(2, len(entry["rows"]) + 2))
+
+    def columns(self, sheet: gspread.Spreadsheet) -> list:
+        with _reading(self, sheet):
+            return list(self._entry(sheet)["header"])
+
+    def id_column(self, sheet: gspread.Spreadsheet):
+        with _reading(self, sheet):
+            return self._entry(sheet)["id_col"]
+
+    def rows_for_ids(self, sheet: gspread.Spreadsheet, expense_ids: list) -> dict:
+        """Map the known ``expense_ids`` to their sheet row numbers."""
+        with _reading(self, sheet):
+            by_id = self._loaded(sheet)["by_id"]
+            return {eid: by_id[eid] + 2 for eid in expense_ids if eid in by_id}
+
+    def trip_spans(self, sheet: gspread.Spreadsheet) -> dict:
+        """``(username, trip) -> (first date, last date, rows)`` for every trip in the worksheet."""
+        with _reading(self, sheet):
+            entry = self._loaded(sheet)
+            header = entry["header"]
+            if "trip" not in header or "date" not in header:
+                return {}
+            trip_col, date_col = header.index("trip"), header.index("date")
+            spans = {}
+            for row in entry["rows"]:
+                key, day = (row[0], row[trip_col]), row[date_col][:10]
+                first, last, count = spans.get(key, (day, day, 0))
+                spans[key] = (min(first, day), max(last, day), count + 1)
+            return spans
+
+    def version(self, sheet: gspread.Spreadsheet, username: str) -> int:
+        with _reading(self, sheet):
+            return self._entry(sheet)["aggregates"].version(username)
+
+    def category_totals(self, sheet: gspread.Spreadsheet, username: str, trip: str = None) -> pd.DataFrame:
+        with _reading(self, sheet):
+            entry = self._entry(sheet)
+            snap = self._lazy(entry, ["username", "trip", "category", "amount"])
+            if snap is not None:
+                return frame_category_totals(snap.frame(["category", "amount"], username=username, trip=trip))
+            return entry["aggregates"].category_totals(username, trip)
+
+    def daily_totals(self, sheet: gspread.Spreadsheet, username: str, trip: str = None) -> pd.DataFrame:
+        with _reading(self, sheet):
+            entry = self._entry(sheet)
+            snap = self._lazy(entry, ["username", "trip", "date", "category", "amount"])
+            if snap is not None:
+                return frame_daily_totals(snap.frame(["date", "category", "amount"], username=username, trip=trip))
+            return entry["aggregates"].daily_totals(username, trip)
+
+    def score(self, sheet: gspread.Spreadsheet, username: str, category: str, amount: float,
+              trip: str = None, location: str = None):
+        with _reading(self, sheet):
+            return self._loaded(sheet)["stats"].score(username, category, amount, trip=trip, location=location)
+
+    def row(self, sheet: gspread.Spreadsheet, row_number: int) -> list:
+        with _reading(self, sheet):
+            return list(self._loaded(sheet)["rows"][row_number - 2])
+
+    def append(self, sheet: gspread.Spreadsheet, values: list) -> None:
+        with self._lock:
+            entry = self._entries.get(sheet.id)
+            if entry is not None:
+                self._add_row(self._materialize(entry), values)
+
+    def patch(self, sheet: gspread.Spreadsheet, row_number: int, first_col: int, values: list) -> None:
+        """Overwrite cells of a cached row; ``first_col`` is 0-based like the sheet's A column."""
+        with self._lock:
+            entry = self._entries.get(sheet.id)
+            if entry is None:
+                return
+            self._materialize(entry)
+            idx = row_number - 2
+            if not 0 <= idx < len(entry["rows"]) or first_col == 0:
+                # Unknown row, or the username itself moved: rebuild on next read.
+                self._entries.pop(sheet.id, None)
+                return
+            row = entry["rows"][idx]
+            entry["aggregates"].remove(row)
+            entry["stats"].remove(row)
+            for offset, value in enumerate(values):
+                if first_col + offset < len(row):
+                    row[first_col + offset] = str(value)
+            entry["aggregates"].add(row)
+            entry["stats"].add(row)
+
+    def remove_rows(self, sheet: gspread.Spreadsheet, row_numbers) -> None:
+        """Drop deleted rows and renumber the ones below them, as the sheet does."""
+        with self._lock:
+            entry = self._entries.get(sheet.id)
+            if entry is None:
+                return
+            self._materialize(entry)
+            drop = {r - 2 for r in row_numbers}
+            if any(not 0 <= i < len(entry["rows"]) for i in drop):
+                self._entries.pop(sheet.id, None)
+                return
+            for i in drop:
+                entry["aggregates"].remove(entry["rows"][i])
+                entry["stats"].remove(entry["rows"][i])
+            rows = [row for i, row in enumerate(entry["rows"]) if i not in drop]
+            entry["rows"], entry["by_user"], entry["by_id"], entry["by_participant"] = [], {}, {}, {}
+            for row in rows:
+                self._add_row(entry, row, aggregate=False)
+
+    def invalidate(self, sheet: gspread.Spreadsheet = None) -> None:
+        with self._lock:
+            if sheet is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sheet.id, None)
 
-    header = [col.strip().lower() for col in raw_data[0]]
-    data_rows = raw_data[1:]
 
-    df = pd.DataFrame(data_rows, columns=header)
+_ledger = LedgerCache()
+_partitions = {SHEET_NAME: _ledger}
+_partitions_lock = threading.Lock()
 
-    if "username" not in df.columns:
-        raise ValueError(f"Column 'username' not found. Columns: {df.columns.tolist()}")
 
-    df = df[df["username"] == username]
+def _partition_ledger(title: str) -> LedgerCache:
+    """The cache for one ledger worksheet; archive partitions share the hot ledger's settings."""
+    with _partitions_lock:
+        if title not in _partitions:
+            _partitions[title] = LedgerCache(_ledger.ttl, _ledger.incremental, _ledger.full_sync_interval,
+                                             _ledger.snapshot_dir, title=title)
+        return _partitions[title]
 
-    # Optional: Convert numeric column(s)
-    if "amount" in df.columns:
-        df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
 
-    # Add row numbers (for Google Sheets indexing)
-    df["Row"] = list(range(2, 2 + len(df)))
+def invalidate_ledger(sheet: gspread.Spreadsheet = None) -> None:
+    with _partitions_lock:
+        ledgers = list(_partitions.values())
+    for ledger in ledgers:
+        ledger.invalidate(sheet)
+    _catalog.invalidate(sheet)
 
-    return df
+def _with_new_id(sheet: gspread.Spreadsheet, values: list, ledger: LedgerCache = _ledger) -> list:
+    """Return ``values`` with a fresh expense id in the id column."""
+    ledger.ensure_ids(sheet)
+    id_col = ledger.id_column(sheet)
+    if id_col is None:
+        # Header-less sheet; nothing to line the id up with.
+        return values
+    row = list(values) + [""] * max(0, id_col + 1 - len(values))
+    row[id_col] = new_expense_id()
+    return row
 
+def _resolve_rows(sheet: gspread.Spreadsheet, expense_ids: list, ledger: LedgerCache = _ledger) -> dict:
+    """Map expense ids to their current rows in ``ledger``'s worksheet.
+
+    The id cells are read back (one batch_get) before we trust the mapping, and
+    the ledger is re-read once if another writer moved rows under us.
+    """
+    ledger.ensure_ids(sheet)
+    flush_writes(sheet, ledger.title)
+    wanted = set(expense_ids)
+    for _ in range(2):
+        rows = ledger.rows_for_ids(sheet, expense_ids)
+        if set(rows) == wanted:
+            letter = _col_letter(ledger.id_column(sheet))
+            found = get_worksheet(sheet, ledger.title).batch_get([f"{letter}{r}" for r in rows.values()])
+            if all((cells[0][0] if cells and cells[0] else "") == eid for cells, eid in zip(found, rows)):
+                return rows
+        ledger.invalidate(sheet)
+    missing = sorted(wanted - set(rows)) or sorted(wanted)
+    raise ValueError(f"Could not locate expenses {missing} in the ledger.")
+
+def _row_runs(row_numbers: list) -> list:
+    """Group rows into ``(first, last)`` runs of consecutive rows, bottom-most run first."""
+    runs = []
+    for r in sorted(row_numbers, reverse=True):
+        if runs and runs[-1][0] == r + 1:
+            runs[-1] = (r, runs[-1][1])
+        else:
+            runs.append((r, r))
+    return runs
+
+def _warn_row_based(name: str, replacement: str) -> None:
+    # Row numbers only address SHEET_NAME; an archived expense has no row there.
+    warnings.warn(f"{name} addresses hot-ledger rows only; use {replacement} with expense ids",
+                  DeprecationWarning, stacklevel=3)
+
+@_reconnect_on_auth_error
+def load_ex_gsheet(sheet: gspread.Spreadsheet, username: str) -> pd.DataFrame:
+    header = _ledger.columns(sheet)
+
+    if not header:
+        raise ValueError("Sheet is empty or does not have enough rows.")
+
+    if "username" not in header:
+        raise ValueError(f"Column 'username' not found. Columns: {header}")
+
+    # Typed columns, plus row numbers (for Google Sheets indexing)
+    return _ledger.user_frame(sheet, username)
+
+@_reconnect_on_auth_error
 def add_ex_gsheet(sheet: gspread.Spreadsheet, username: str, date: str, category: str, description: str, amount: float, location: str) -> None:
-    ws = sheet.worksheet(SHEET_NAME)
-    ws.append_row([username, date, category, description, float(amount), location])
+    values = _with_new_id(sheet, [username, date, category, description, float(amount), location])
+    id_col = _ledger.id_column(sheet)
+    _append_row(sheet, SHEET_NAME, values, expense_id=values[id_col] if id_col is not None else None)
+    _ledger.append(sheet, values)
     logger.info("Expense added for user %s: %s | %s | %s | %.2f | %s", username, date, category, description, amount, location)
 
 
 
+@_reconnect_on_auth_error
 def delete_expense(sheet: gspread.Spreadsheet, row_number: int) -> None:
+    """Delete a row of the hot ledger. Deprecated: use delete_expenses, which finds archived expenses too."""
+    _warn_row_based("delete_expense", "delete_expenses")
     try:
-        ws = sheet.worksheet(SHEET_NAME)
+        # Queued appends and updates must land before row numbers shift.
+        flush_writes(sheet, SHEET_NAME)
+        ws = get_worksheet(sheet)
         ws.delete_rows(row_number)
+        _ledger.remove_rows(sheet, [row_number])
         logger.info("Deleted row %d.", row_number)
     except gspread.exceptions.APIError as e:
+        if _is_auth_error(e):
+            raise
         logger.error("Failed to delete row %d: %s", row_number, e)
 
+@_reconnect_on_auth_error
 def update_expense(sheet: gspread.Spreadsheet, row_number: int, date: str, category: str, description: str, amount: float, location: str) -> None:
+    """Overwrite a row of the hot ledger. Deprecated: use update_expenses."""
+    _warn_row_based("update_expense", "update_expenses")
     try:
-        ws = sheet.worksheet(SHEET_NAME)
-        ws.update(f"A{row_number}", [[date, category, description, float(amount), location]])
+        values = [date, category, description, float(amount), location]
+        _update_range(sheet, SHEET_NAME, f"A{row_number}", [values])
+        _ledger.patch(sheet, row_number, 0, values)
         logger.info("Updated row %d.", row_number)
     except gspread.exceptions.APIError as e:
+        if _is_auth_error(e):
+            raise
         logger.error("Failed to update row %d: %s", row_number, e)
 
 def get_budget_worksheet(sheet: gspread.Spreadsheet) -> gspread.Worksheet:
     try:
-        return sheet.worksheet(BUDGET_SHEET)
+        return get_worksheet(sheet, BUDGET_SHEET)
     except gspread.exceptions.WorksheetNotFound:
         logger.warning("Budget sheet not found. Creating new one.")
-        return sheet.add_worksheet(title=BUDGET_SHEET, rows="1", cols="2")
-
-def set_budget(sheet: gspread.Spreadsheet, username: str, amount: float) -> None:
-    ws = get_budget_worksheet(sheet)
-    data = ws.get_all_records()
-    for idx, row in enumerate(data, start=2):
-        if row["username"] == username:
-            ws.update(f"B{idx}", [[float(amount)]])
-            return
-    # If not found, append new row
-    ws.append_row([username, float(amount)])
+        ws = sheet.add_worksheet(title=BUDGET_SHEET, rows="1", cols="3")
+        ws.update("A1", [BUDGET_HEADER])
+        _connection.remember(sheet, ws)
+        return ws
 
+class BudgetIndex:
+    """``(username, trip) -> (row, amount)`` index over the Budget sheet.
 
-def get_budget(sheet: gspread.Spreadsheet, username: str) -> float:
-    ws = get_budget_worksheet(sheet)
-    data = ws.get_all_records()
-    for row in data:
-        if row["username"] == username:
+    The sheet is read once per TTL; lookups are dict hits and ``set`` writes a
+    single cell (or appends one row) and updates the index in place. A blank
+    trip is the user's overall budget.
+    """
+
+    def __init__(self, ttl: float = LEDGER_CACHE_TTL):
+        self.title = BUDGET_SHEET
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = {}
+
+    def _entry(self, sheet: gspread.Spreadsheet) -> dict:
+        with self._lock:
+            entry = self._entries.get(sheet.id)
+            if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+                entry = self._fetch(sheet)
+                self._entries[sheet.id] = entry
+                record_cache("budgets", "fetch")
+            else:
+                record_cache("budgets", "hit")
+            return entry
+
+    def _fetch(self, sheet: gspread.Spreadsheet) -> dict:
+        ws = get_budget_worksheet(sheet)
+        values = ws.get_all_values()
+        if not values:
+            ws.update("A1", [BUDGET_HEADER])
+            values = [BUDGET_HEADER]
+        header = [col.strip().lower() for col in values[0]]
+        entry = {
+            "user_col": header.index("username") if "username" in header else 0,
+            "budget_col": header.index("budget") if "budget" in header else 1,
+            "trip_col": header.index("trip") if "trip" in header else None,
+            "width": len(header),
+            "index": {},
+            "next_row": len(values) + 1,
+            "fetched_at": time.time(),
+        }
+        for row_number, row in enumerate(values[1:], start=2):
+            row = row + [""] * (entry["width"] - len(row))
+            trip = row[entry["trip_col"]].strip() if entry["trip_col"] is not None else ""
             try:
-                return float(row["Budget"])
+                amount = float(row[entry["budget_col"]])
             except ValueError:
-                return 0.0
-    return 0.0  # default if not foun
-def add_expense_with_trip(sheet, username, date, category, description, amount, location, trip="General", shared_with=None):
-    ws = sheet.worksheet(SHEET_NAME)
+                amount = 0.0
+            entry["index"][(row[entry["user_col"]], trip)] = (row_number, amount)
+        return entry
+
+    def _ensure_trip_column(self, sheet: gspread.Spreadsheet, entry: dict) -> None:
+        ws = get_budget_worksheet(sheet)
+        col = entry["width"]
+        if ws.col_count <= col:
+            ws.add_cols(col + 1 - ws.col_count)
+        ws.update(f"{_col_letter(col)}1", [["trip"]])
+        entry["trip_col"] = col
+        entry["width"] = col + 1
+
+    def get(self, sheet: gspread.Spreadsheet, username: str, trip: str = None) -> float:
+        with _reading(self, sheet):
+            index = self._entry(sheet)["index"]
+            if trip and (username, trip) in index:
+                return index[(username, trip)][1]
+            return index.get((username, ""), (None, 0.0))[1]
+
+    def frame(self, sheet: gspread.Spreadsheet) -> pd.DataFrame:
+        """Every budget as ``username, trip, budget``; a blank trip is the overall budget."""
+        with _reading(self, sheet):
+            index = self._entry(sheet)["index"]
+            return pd.DataFrame([(user, trip, amount) for (user, trip), (_, amount) in index.items()],
+                                columns=["username", "trip", "budget"])
+
+    def set(self, sheet: gspread.Spreadsheet, username: str, amount: float, trip: str = None) -> None:
+        key = (username, trip or "")
+        with _reading(self, sheet):
+            entry = self._entry(sheet)
+            if key in entry["index"]:
+                row_number = entry["index"][key][0]
+                _update_range(sheet, BUDGET_SHEET, f"{_col_letter(entry['budget_col'])}{row_number}", [[float(amount)]])
+            else:
+                if trip and entry["trip_col"] is None:
+                    self._ensure_trip_column(sheet, entry)
+                values = [""] * entry["width"]
+                values[entry["user_col"]] = username
+                values[entry["budget_col"]] = float(amount)
+                if trip:
+                    values[entry["trip_col"]] = trip
+                _append_row(sheet, BUDGET_SHEET, values)
+                row_number = entry["next_row"]
+                entry["next_row"] += 1
+            entry["index"][key] = (row_number, float(amount))
+
+    def invalidate(self, sheet: gspread.Spreadsheet = None) -> None:
+        with self._lock:
+            if sheet is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sheet.id, None)
+
+
+_budgets = BudgetIndex()
+
+
+@_reconnect_on_auth_error
+def set_budget(sheet: gspread.Spreadsheet, username: str, amount: float, trip: str = None) -> None:
+    _budgets.set(sheet, username, amount, trip=trip)
+
+
+@_reconnect_on_auth_error
+def get_budget(sheet: gspread.Spreadsheet, username: str, trip: str = None) -> float:
+    """Return the budget for ``trip``, falling back to the user's overall budget."""
+    return _budgets.get(sheet, username, trip=trip)
+
+@_reconnect_on_auth_error
+def load_budgets(sheet: gspread.Spreadsheet) -> pd.DataFrame:
+    return _budgets.frame(sheet)
+
+def _ensure_worksheet(sheet: gspread.Spreadsheet, title: str, header: list) -> gspread.Worksheet:
+    try:
+        return get_worksheet(sheet, title)
+    except gspread.exceptions.WorksheetNotFound:
+        logger.info("Creating worksheet %s.", title)
+        ws = sheet.add_worksheet(title=title, rows="1", cols=str(len(header)))
+        ws.update("A1", [header])
+        _connection.remember(sheet, ws)
+        return ws
+
+class PartitionCatalog:
+    """``(username, trip) -> worksheet`` map of the trips moved out of the hot ledger.
+
+    Read once per TTL like the budgets. A trip that is not listed lives in
+    SHEET_NAME; a missing Catalog sheet just means nothing is archived yet.
+    That answer is kept past the TTL, until ``record`` (the first archival)
+    creates the sheet or the cache is invalidated.
+    """
+
+    def __init__(self, ttl: float = LEDGER_CACHE_TTL):
+        self.title = CATALOG_SHEET
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = {}
+
+    def _entry(self, sheet: gspread.Spreadsheet) -> dict:
+        with self._lock:
+            entry = self._entries.get(sheet.id)
+            if entry is None or (not entry["missing"] and time.time() - entry["fetched_at"] > self.ttl):
+                entry = self._fetch(sheet)
+                self._entries[sheet.id] = entry
+                record_cache("catalog", "fetch")
+            else:
+                record_cache("catalog", "hit")
+            return entry
+
+    def _fetch(self, sheet: gspread.Spreadsheet) -> dict:
+        entry = {"index": {}, "fetched_at": time.time(), "missing": False}
+        try:
+            values = get_worksheet(sheet, CATALOG_SHEET).get_all_values()
+        except gspread.exceptions.WorksheetNotFound:
+            values, entry["missing"] = [], True
+        header = [col.strip().lower() for col in values[0]] if values else []
+        for row in values[1:]:
+            record = dict(zip(header, row))
+            if record.get("partition"):
+                entry["index"][(record.get("username", ""), record.get("trip", ""))] = record["partition"]
+        return entry
+
+    def partition(self, sheet: gspread.Spreadsheet, username: str, trip: str) -> str:
+        with _reading(self, sheet):
+            return self._entry(sheet)["index"].get((username, trip or ""), SHEET_NAME)
+
+    def partitions(self, sheet: gspread.Spreadsheet, username: str = None, trip: str = None) -> list:
+        """Archive worksheets holding any of ``username``'s (or ``trip``'s) expenses; all of them by default."""
+        with _reading(self, sheet):
+            index = self._entry(sheet)["index"]
+            return sorted({title for (user, name), title in index.items()
+                           if (username is None or user == username) and (not trip or name == trip)})
+
+    def trips(self, sheet: gspread.Spreadsheet, username: str) -> list:
+        with _reading(self, sheet):
+            return sorted(name for user, name in self._entry(sheet)["index"] if user == username)
+
+    def record(self, sheet: gspread.Spreadsheet, records: list) -> None:
+        """Append catalog rows (dicts keyed by CATALOG_HEADER) in one call."""
+        if not records:
+            return
+        with _reading(self, sheet):
+            entry = self._entry(sheet)
+            ws = _ensure_worksheet(sheet, CATALOG_SHEET, CATALOG_HEADER)
+            entry["missing"] = False
+            ws.append_rows([[record.get(col, "") for col in CATALOG_HEADER] for record in records])
+            for record in records:
+                entry["index"][(record["username"], record["trip"])] = record["partition"]
+
+    def invalidate(self, sheet: gspread.Spreadsheet = None) -> None:
+        with self._lock:
+            if sheet is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sheet.id, None)
+
+
+_catalog = PartitionCatalog()
 
+
+def _ledger_for(sheet, username, trip) -> LedgerCache:
+    """The partition that holds ``username``'s expenses on ``trip``."""
+    return _partition_ledger(_catalog.partition(sheet, username, trip)) if trip else _ledger
+
+def _user_ledgers(sheet, username, trip=None) -> list:
+    """Partitions to read for one trip, or for all of a user's trips."""
+    if trip:
+        return [_ledger_for(sheet, username, trip)]
+    return [_ledger] + [_partition_ledger(title) for title in _catalog.partitions(sheet, username=username)]
+
+def _locate_ids(sheet, expense_ids: list) -> dict:
+    """Group expense ids by the partition holding them, looking in the hot ledger first.
+
+    Ids found nowhere are left with the hot ledger, whose resolve re-reads it
+    and reports them.
+    """
+    remaining = list(expense_ids)
+    located = {}
+    for title in [SHEET_NAME] + _catalog.partitions(sheet):
+        if not remaining:
+            break
+        rows = _partition_ledger(title).rows_for_ids(sheet, remaining)
+        if rows:
+            located[title] = list(rows)
+            remaining = [eid for eid in remaining if eid not in rows]
+    if remaining:
+        located.setdefault(SHEET_NAME, []).extend(remaining)
+    return located
+
+@_reconnect_on_auth_error
+def add_expense_with_trip(sheet, username, date, category, description, amount, location, trip="General", shared_with=None,
+                          currency=None, original_amount=None):
+    """Append an expense (``amount`` in rupees) to its trip's partition and return its id.
+
+    ``currency``/``original_amount`` record what a foreign-currency expense
+    was entered as.
+    """
+    ledger = _ledger_for(sheet, username, trip)
+    values = _expense_values(sheet, username, date, category, description, amount, location, trip,
+                             shared_with, currency, original_amount, ledger=ledger)
+    id_col = ledger.id_column(sheet)
+    expense_id = values[id_col] if id_col is not None else None
+    _append_row(sheet, ledger.title, values, expense_id=expense_id)
+    ledger.append(sheet, values)
+    return expense_id
+
+def _expense_values(sheet, username, date, category, description, amount, location, trip="General",
+                    shared_with=None, currency=None, original_amount=None, ledger=_ledger) -> list:
+    """The ledger row for an expense, with a fresh id."""
     if shared_with:
         shared_str = ",".join(shared_with)
         total_people = len(shared_with) + 1  # including payer
@@ -117,7 +1153,7 @@ def add_expense_with_trip(sheet, username, date, category, description, amount,
         shared_str = ""
         split_amt = float(amount)
 
-    ws.append_row([
+    values = _with_new_id(sheet, [
         username,
         date,
         category,
@@ -127,37 +1163,336 @@ def add_expense_with_trip(sheet, username, date, category, description, amount,
         trip,
         shared_str,
         split_amt
-    ])
+    ], ledger)
+    if currency:
+        columns = ledger.ensure_columns(sheet, CURRENCY_COLUMNS)
+        if columns:
+            values += [""] * (max(columns) + 1 - len(values))
+            values[columns[0]] = currency
+            values[columns[1]] = float(original_amount) if original_amount is not None else ""
+    return values
+
+def _append_rows(sheet, title: str, rows: list) -> None:
+    """One append_rows call, bypassing the write-behind queue (after flushing it, to keep row order).
+
+    Quota and server errors are retried with backoff.
+    """
+    flush_writes(sheet, title)
+    for attempt in range(BULK_APPEND_ATTEMPTS):
+        try:
+            get_worksheet(sheet, title).append_rows(rows)
+            return
+        except gspread.exceptions.APIError as e:
+            if _is_auth_error(e) or not is_retryable(e) or attempt == BULK_APPEND_ATTEMPTS - 1:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("Bulk append failed (%s), retrying in %.1fs.", e, delay)
+            time.sleep(delay)
 
+@_reconnect_on_auth_error
+def add_expenses(sheet, expenses: list) -> list:
+    """Append many expenses with one append_rows call per partition and return their ids.
 
+    Each expense is a dict of ``add_expense_with_trip`` keyword arguments.
+    """
+    if not expenses:
+        return []
+    ledgers = [_ledger_for(sheet, e["username"], e.get("trip", "General")) for e in expenses]
+    rows = [_expense_values(sheet, ledger=ledger, **expense) for ledger, expense in zip(ledgers, expenses)]
+    groups = {}
+    for ledger, values in zip(ledgers, rows):
+        groups.setdefault(ledger.title, []).append(values)
+    for title, group in groups.items():
+        _append_rows(sheet, title, group)
+        ledger = _partition_ledger(title)
+        for values in group:
+            ledger.append(sheet, values)
+    logger.info("Appended %d expenses.", len(rows))
+    ids = []
+    for ledger, values in zip(ledgers, rows):
+        id_col = ledger.id_column(sheet)
+        ids.append(values[id_col] if id_col is not None else None)
+    return ids
+
+
+@_reconnect_on_auth_error
 def load_expense_with_trip(sheet, username, trip=None):
-    ws = sheet.worksheet(SHEET_NAME)
-    raw_data = ws.get_all_values()
-    header = [col.strip().lower() for col in raw_data[0]]
-    data_rows = raw_data[1:]
-    df = pd.DataFrame(data_rows, columns=header)
-    df = df[df["username"] == username]
-    df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
-    df["Row"] = list(range(2, 2 + len(df)))
-    if trip:
-        df = df[df["trip"] == trip]
-    return df
+    """A user's expenses on ``trip`` (read from that trip's partition only), or on all trips.
+
+    ``Row`` numbers are only meaningful within a partition; use the ids to
+    edit or delete.
+    """
+    return concat_expense_frames([ledger.user_frame(sheet, username, trip=trip)
+                                  for ledger in _user_ledgers(sheet, username, trip)])
+
+def _sort_key(header: list, sort_by: str):
+    col = header.index(sort_by) if sort_by in header else None
+    if col is None:
+        return lambda row: ""
+    if sort_by == "amount":
+        def amount(row):
+            try:
+                return float(row[col])
+            except ValueError:
+                return 0.0
+        return amount
+    if sort_by == "date":
+        return lambda row: row[col][:10]
+    return lambda row: row[col].lower()
+
+@_reconnect_on_auth_error
+def query_expenses(sheet, username, trip=None, start=None, end=None, categories=None, location=None, shared=None,
+                   sort_by="date", descending=False, offset=0, limit=QUERY_PAGE_SIZE) -> tuple:
+    """One page of a user's expenses matching the filters, and how many match in total.
+
+    Filters are as in ``LedgerCache.select``; ``sort_by`` is one of
+    QUERY_SORT_KEYS (ties keep ledger order). Only the page is built into a
+    frame, so the cost of rendering it does not grow with the trip.
+    Returns ``(frame, total)``.
+    """
+    if sort_by not in QUERY_SORT_KEYS:
+        raise ValueError(f"Cannot sort by {sort_by!r}; use one of {QUERY_SORT_KEYS}.")
+    start = str(start)[:10] if start else None
+    end = str(end)[:10] if end else None
+    selected = [ledger.select(sheet, username, trip, start, end, categories, location, shared)
+                for ledger in _user_ledgers(sheet, username, trip)]
+    # Archives may lack columns the hot ledger has gained; line rows up on the union of headers.
+    header = []
+    for part_header, _, _ in selected:
+        header += [col for col in part_header if col not in header]
+    matches = []
+    for part_header, rows, row_numbers in selected:
+        if part_header != header:
+            index = [part_header.index(col) if col in part_header else None for col in header]
+            rows = [[row[i] if i is not None else "" for i in index] for row in rows]
+        matches += zip(rows, row_numbers)
+    key = _sort_key(header, sort_by)
+    matches.sort(key=lambda match: key(match[0]), reverse=descending)
+    page = matches[offset:offset + limit]
+    return build_expense_frame(header, [row for row, _ in page], [number for _, number in page]), len(matches)
+
+@_reconnect_on_auth_error
+def load_all_expenses(sheet):
+    """Every user's expenses, hot ledger and archives, for reports over the whole ledger."""
+    return concat_expense_frames([build_expense_frame(*_partition_ledger(title).all_rows(sheet))
+                                  for title in [SHEET_NAME] + _catalog.partitions(sheet)])
 
+@_reconnect_on_auth_error
+def load_shared_expenses(sheet, username, trip=None):
+    """Shared expenses ``username`` paid or was split into, from every payer in the ledger."""
+    # Other payers may have archived the trip already, so look in their partitions too.
+    titles = [SHEET_NAME] + _catalog.partitions(sheet, trip=trip)
+    return concat_expense_frames([build_expense_frame(*_partition_ledger(title).shared_rows(sheet, username, trip=trip))
+                                  for title in titles])
+
+@_reconnect_on_auth_error
 def update_expense_with_trip(sheet, row_number, date, category, description, amount, location, trip="General"):
-    ws = sheet.worksheet(SHEET_NAME)
-    ws.update(f"B{row_number}:F{row_number}", [[date, category, description, float(amount), location]])
-    ws.update(f"G{row_number}", [[trip]])  # Note the double brackets here
+    """Overwrite a row of the hot ledger. Deprecated: use update_expenses, which finds archived expenses too."""
+    _warn_row_based("update_expense_with_trip", "update_expenses")
+    _update_range(sheet, SHEET_NAME, f"B{row_number}:G{row_number}",
+                  [[date, category, description, float(amount), location, trip]])
+    _ledger.patch(sheet, row_number, 1, [date, category, description, float(amount), location, trip])
+
+@_reconnect_on_auth_error
+def update_expenses(sheet, updates: dict) -> None:
+    """Apply ``{expense_id: {column: value}}`` edits to columns B..G, one batch per partition.
+
+    Columns not named for an expense keep their current value. An expense
+    stays in its partition even if its trip changes; the next archival run
+    moves stragglers left in the hot ledger.
+    """
+    if not updates:
+        return
+    located = {title: _resolve_rows(sheet, ids, _partition_ledger(title))
+               for title, ids in _locate_ids(sheet, list(updates)).items()}
+    amount_col = EDITABLE_COLUMNS.index("amount")
+    for title, rows in located.items():
+        ledger = _partition_ledger(title)
+        header = ledger.columns(sheet)
+        split_col = header.index("split amount") if "split amount" in header else None
+        shared_col = header.index("shared_with") if "shared_with" in header else None
+        edits = []
+        for expense_id, row_number in rows.items():
+            fields = updates[expense_id]
+            current = ledger.row(sheet, row_number)
+            values = [fields.get(col, current[i + 1]) for i, col in enumerate(EDITABLE_COLUMNS)]
+            values[amount_col] = float(values[amount_col])
+            edits.append((expense_id, 1, values))
+            ledger.patch(sheet, row_number, 1, values)
+            if split_col is not None and "amount" in fields:
+                # Each participant's share follows the new amount, as when the expense was added.
+                shared = split_participants(current[shared_col]) if shared_col is not None else []
+                split = round(values[amount_col] / (len(shared) + 1), 2)
+                edits.append((expense_id, split_col, [split]))
+                ledger.patch(sheet, row_number, split_col, [split])
+        _update_expense_cells(sheet, title, edits, rows)
+    logger.info("Updated %d expenses.", len(updates))
+
+def _delete_requests(ws: gspread.Worksheet, row_numbers) -> list:
+    """deleteDimension requests for ``row_numbers``, bottom-up so each one's indexes are still valid."""
+    return [
+        {"deleteDimension": {"range": {
+            "sheetId": ws.id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last,
+        }}}
+        for first, last in _row_runs(list(row_numbers))
+    ]
+
+@_reconnect_on_auth_error
+def delete_expenses(sheet, expense_ids: list) -> None:
+    """Delete many expenses, from whichever partitions hold them, with one batch_update."""
+    if not expense_ids:
+        return
+    located = {title: _resolve_rows(sheet, ids, _partition_ledger(title))
+               for title, ids in _locate_ids(sheet, list(expense_ids)).items()}
+    requests = []
+    for title, rows in located.items():
+        requests += _delete_requests(get_worksheet(sheet, title), rows.values())
+    sheet.batch_update({"requests": requests})
+    for title, rows in located.items():
+        _partition_ledger(title).remove_rows(sheet, rows.values())
+    logger.info("Deleted %d expenses.", sum(len(rows) for rows in located.values()))
+
+
+def _merge_totals(frames: list, keys: list) -> pd.DataFrame:
+    frames = [df for df in frames if not df.empty]
+    if len(frames) < 2:
+        return frames[0] if frames else None
+    totals = pd.concat(frames, ignore_index=True).groupby(keys, as_index=False, sort=True)[["amount", "count"]].sum()
+    totals["amount"] = totals["amount"].round(2)
+    return totals
+
+@_reconnect_on_auth_error
+def get_category_totals(sheet, username, trip=None) -> pd.DataFrame:
+    frames = [ledger.category_totals(sheet, username, trip) for ledger in _user_ledgers(sheet, username, trip)]
+    merged = _merge_totals(frames, ["category"])
+    return merged if merged is not None else frames[0]
+
+@_reconnect_on_auth_error
+def get_daily_totals(sheet, username, trip=None) -> pd.DataFrame:
+    frames = [ledger.daily_totals(sheet, username, trip) for ledger in _user_ledgers(sheet, username, trip)]
+    merged = _merge_totals(frames, ["date", "category"])
+    return merged if merged is not None else frames[0]
+
+@_reconnect_on_auth_error
+def data_version(sheet, username) -> tuple:
+    """Changes whenever any of ``username``'s expenses, in any partition, is written."""
+    return tuple(ledger.version(sheet, username) for ledger in _user_ledgers(sheet, username))
+
+@_reconnect_on_auth_error
+def score_expense(sheet, username, category, amount, trip=None, location=None):
+    """z-score/percentile of ``amount`` against the user's recent (hot ledger) spending (see anomaly.SpendingStats)."""
+    return _ledger.score(sheet, username, category, amount, trip=trip, location=location)
 
-    
 def get_user_trips(sheet, username):
     try:
-        df = load_ex_gsheet(sheet, username)
+        df = _ledger.user_frame(sheet, username, columns=["trip"])
+        trips = set(_catalog.trips(sheet, username))
         if not df.empty and "trip" in df.columns:
-            trips = df["trip"].dropna().unique().tolist()
-            return sorted(list(set(trips)))
+            trips.update(df["trip"].dropna().unique().tolist())
+        if trips:
+            return sorted(trips)
     except Exception as e:
-        print("Error in get_user_trips:", e)
+        logger.warning("Could not list trips for %s: %s", username, e)
     return ["General"]
 
 
+@_reconnect_on_auth_error
+def migrate_ledger(sheet) -> None:
+    """Give expenses written before ids existed an id, in the hot ledger and every archive partition."""
+    for title in [SHEET_NAME] + _catalog.partitions(sheet):
+        _partition_ledger(title).ensure_ids(sheet)
+
+def closed_trips(sheet, older_than_days: int = ARCHIVE_AFTER_DAYS, today: datetime.date = None) -> list:
+    """``(username, trip)`` pairs in the hot ledger with no expense in the last ``older_than_days``.
+
+    A user's most recent trip is never closed, however old it is.
+    """
+    cutoff = ((today or datetime.date.today()) - datetime.timedelta(days=older_than_days)).isoformat()
+    spans = _ledger.trip_spans(sheet)
+    latest = {}
+    for (username, trip), (_, last, _) in spans.items():
+        if username not in latest or last > latest[username][0]:
+            latest[username] = (last, trip)
+    return sorted(key for key, (_, last, _) in spans.items() if last < cutoff and latest[key[0]][1] != key[1])
+
+def _archive_title(last_date: str) -> str:
+    year = last_date[:4]
+    return ARCHIVE_PREFIX + (year if year.isdigit() else "undated")
+
+@_reconnect_on_auth_error
+def archive_trips(sheet, trips: list) -> dict:
+    """Move ``(username, trip)`` pairs out of the hot ledger into yearly archive worksheets.
+
+    Each archive worksheet gets one append_rows, the catalog one more, and
+    the hot ledger loses the rows in a single batch_update located by a
+    fresh read of its id column. Copies are written before anything is
+    deleted and rows whose id an archive already holds are not copied
+    again, so a run that dies part way can simply be repeated.
+    Returns ``{partition: rows moved}``.
+    """
+    flush_writes(sheet, SHEET_NAME)
+    spans = _ledger.trip_spans(sheet)
+    id_col = _ledger.id_column(sheet)
+    moves = {}
+    for key in trips:
+        if key in spans and id_col is not None:
+            moves.setdefault(_archive_title(spans[key][1]), []).append(key)
+    if not moves:
+        return {}
+    archived_at = datetime.datetime.now().isoformat(timespec="seconds")
+    records, moved_ids, counts = [], set(), {}
+    for title, keys in moves.items():
+        ledger = _partition_ledger(title)
+        header = None
+        rows = []
+        for username, trip in keys:
+            header, trip_rows, _ = _ledger.user_rows(sheet, username, trip)
+            rows += trip_rows
+            first, last, count = spans[(username, trip)]
+            records.append({"partition": title, "username": username, "trip": trip, "rows": count,
+                            "first_date": first, "last_date": last, "archived_at": archived_at})
+        _ensure_worksheet(sheet, title, header)
+        # The archive may predate columns the hot ledger has gained since.
+        columns = ledger.ensure_columns(sheet, header)
+        if not columns:
+            raise ValueError(f"Archive worksheet {title} has no header row.")
+        present = ledger.rows_for_ids(sheet, [row[id_col] for row in rows])
+        numeric = {i for i, name in enumerate(normalize_header(header)) if name in NUMERIC_COLUMNS}
+        copies = []
+        for row in rows:
+            moved_ids.add(row[id_col])
+            if row[id_col] in present:
+                continue
+            values = [""] * (max(columns) + 1)
+            for src, dst in enumerate(columns):
+                values[dst] = _sheet_value(row[src]) if src in numeric else row[src]
+            copies.append(values)
+        if copies:
+            _append_rows(sheet, title, copies)
+            for values in copies:
+                ledger.append(sheet, values)
+        counts[title] = len(rows)
+    _catalog.record(sheet, records)
+
+    ws = get_worksheet(sheet)
+    letter = _col_letter(id_col)
+    live = ws.get(f"{letter}2:{letter}")
+    doomed = [i + 2 for i, cells in enumerate(live) if cells and cells[0] in moved_ids]
+    if doomed:
+        sheet.batch_update({"requests": _delete_requests(ws, doomed)})
+    if sorted(doomed) == sorted(_ledger.rows_for_ids(sheet, list(moved_ids)).values()):
+        _ledger.remove_rows(sheet, doomed)
+    else:
+        _ledger.invalidate(sheet)
+    logger.info("Archived %d trips (%d rows) into %s.", len(records), len(doomed), ", ".join(sorted(counts)))
+    return counts
+
+def _sheet_value(text: str):
+    """A cached cell as Sheets should store it: numbers as numbers, not text."""
+    try:
+        return float(text)
+    except ValueError:
+        return text
 
+def archive_closed_trips(sheet, older_than_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    return archive_trips(sheet, closed_trips(sheet, older_than_days))
@@ -0,0 +1,240 @@
+import csv
+import datetime
+import hashlib
+import io
+import logging
+import re
+
+from currency import BASE_CURRENCY, CurrencyError, get_rate_engine
+
+logger = logging.getLogger(__name__)
+
+# Rows per append_rows call: 10k expenses go out in 5 writes, well inside the
+# 60 writes/minute quota, and each request stays far below the payload limit.
+IMPORT_CHUNK_ROWS = 2000
+MAX_REPORTED_ERRORS = 200
+DEFAULT_CATEGORY = "Miscellaneous"
+
+# Statement header spellings (lower-cased) mapped to expense fields.
+FIELD_ALIASES = {
+    "date": ("date", "transaction date", "txn date", "value date", "posting date", "booking date"),
+    "description": ("description", "narration", "details", "particulars", "remarks", "memo", "merchant", "payee"),
+    "amount": ("amount", "debit", "withdrawal", "withdrawal amt.", "withdrawal amount", "debit amount", "amount (inr)"),
+    # Money in: a separate credit column, or a Dr/Cr marker next to a single amount column.
+    "credit": ("credit", "deposit", "deposit amt.", "deposit amount", "credit amount"),
+    "direction": ("dr/cr", "cr/dr", "debit/credit", "transaction type", "txn type"),
+    "category": ("category", "type"),
+    "location": ("location", "city", "place"),
+    "trip": ("trip",),
+    "currency": ("currency", "ccy"),
+    "shared_with": ("shared_with", "shared with", "split with"),
+}
+CREDIT_MARKERS = ("cr", "credit", "c")
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%d-%m-%y", "%d %b %Y", "%d-%b-%Y", "%d %B %Y",
+                "%m/%d/%Y", "%Y/%m/%d")
+
+
+# One number in an amount cell: optional sign or parentheses, digits with "," grouping, "." decimals.
+AMOUNT_TOKEN = re.compile(r"\(?-?\d[\d,]*(?:\.\d+)?\)?")
+
+
+class SkippedRow(ValueError):
+    """A statement row that is not an expense (money in, or no debit); counted as skipped, not failed."""
+
+
+def read_statement(stream, encoding: str = "utf-8-sig"):
+    """Yield ``(line_number, record)`` for each data row of a CSV export, one row at a time.
+
+    ``stream`` may be a path, a text stream or a binary upload (decoded
+    with ``encoding``). The delimiter is sniffed from the first line.
+    """
+    if isinstance(stream, str):
+        with open(stream, newline="", encoding=encoding) as f:
+            yield from read_statement(f)
+        return
+    if isinstance(stream, io.TextIOBase):
+        yield from _read_csv(stream)
+        return
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        yield from _read_csv(text)
+    finally:
+        # Hand the binary stream back open; closing the wrapper would close it too.
+        text.detach()
+
+
+def _read_csv(stream):
+    first = stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(first, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(_chain_line(first, stream), dialect)
+    header = [h.strip().lower() for h in next(reader, [])]
+    for record in reader:
+        if any(cell.strip() for cell in record):
+            yield reader.line_num, dict(zip(header, record))
+
+
+def _chain_line(first: str, stream):
+    yield first
+    yield from stream
+
+
+def column_mapping(header) -> dict:
+    """Expense field -> statement column, for the fields the header has."""
+    header = [h.strip().lower() for h in header]
+    mapping = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if alias in header:
+                mapping[field] = alias
+                break
+    return mapping
+
+
+def parse_date(value: str) -> str:
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date {value!r}")
+
+
+def parse_amount(value: str) -> float:
+    """A statement amount, negative for money in: ``-300``, ``(300)`` and ``300 CR`` all give -300.
+
+    Currency text around the number (``Rs. 300``, ``INR 1,200.50``) is
+    ignored. Raises ValueError unless the cell holds exactly one number with
+    ``,`` thousands separators and ``.`` decimals (so ``1.200,50`` is refused
+    rather than misread).
+    """
+    raw = value.strip()
+    tokens = AMOUNT_TOKEN.findall(raw)
+    if len(tokens) != 1:
+        raise ValueError(f"unrecognised amount {value!r}")
+    token = tokens[0]
+    digits = token.strip("()").lstrip("-")
+    if "," in digits and len(digits.split(".")[0].rsplit(",", 1)[1]) != 3:
+        raise ValueError(f"unrecognised amount {value!r}")
+    negative = (token.startswith("-") or raw.startswith("-") or (token.startswith("(") and token.endswith(")"))
+                or raw.lower().endswith("cr"))
+    amount = float(digits.replace(",", ""))
+    return -amount if negative else amount
+
+
+def dedup_key(username: str, date: str, amount: float, description: str) -> bytes:
+    """Hash of what makes two expenses the same: user, day, amount (in paise) and description."""
+    text = "\x1f".join([username, str(date)[:10], str(int(round(float(amount) * 100))),
+                        " ".join(str(description).lower().split())])
+    return hashlib.blake2b(text.encode(), digest_size=8).digest()
+
+
+def build_dedup_index(df) -> set:
+    """Keys of every expense already in an expense frame."""
+    if df.empty:
+        return set()
+    dates = df["date"].dt.strftime("%Y-%m-%d").fillna("").to_numpy()
+    amounts = df["amount"].to_numpy()
+    return {
+        dedup_key(user, date, amount, description)
+        for user, date, amount, description in zip(df["username"].astype(str), dates, amounts,
+                                                   df["description"].astype(str))
+    }
+
+
+def to_expense(record: dict, mapping: dict, username: str, trip: str, engine=None) -> dict:
+    """Map one statement record to ``add_expense`` arguments.
+
+    Raises SkippedRow for credits (a negative amount, a Dr/Cr marker saying
+    credit, or only a credit column filled in) and ValueError on bad data.
+    """
+    def cell(field, default=""):
+        column = mapping.get(field)
+        value = record.get(column) if column else None
+        return value.strip() if value and value.strip() else default
+
+    if "date" not in mapping or "amount" not in mapping:
+        raise ValueError("the file needs a date and an amount column")
+    if not cell("amount"):
+        raise SkippedRow("credit" if cell("credit") else "no amount")
+    amount = parse_amount(cell("amount"))
+    if amount < 0 or cell("direction").lower() in CREDIT_MARKERS:
+        raise SkippedRow("credit")
+    if amount == 0:
+        raise ValueError("amount is zero")
+    expense = {
+        "username": username,
+        "date": parse_date(cell("date")),
+        "category": cell("category", DEFAULT_CATEGORY),
+        "description": cell("description"),
+        "amount": amount,
+        "location": cell("location"),
+        "trip": cell("trip", trip),
+        "shared_with": [p.strip() for p in cell("shared_with").split(",") if p.strip()] or None,
+    }
+    currency = cell("currency", BASE_CURRENCY).upper()
+    if currency != BASE_CURRENCY:
+        try:
+            expense["amount"] = round((engine or get_rate_engine()).convert(amount, currency, BASE_CURRENCY), 2)
+        except CurrencyError as e:
+            raise ValueError(str(e)) from e
+        expense["currency"], expense["original_amount"] = currency, amount
+    return expense
+
+
+def import_expenses(store, username: str, stream, trip: str = "General", chunk_size: int = IMPORT_CHUNK_ROWS,
+                    progress=None) -> dict:
+    """Stream a statement into ``store``, skipping rows that are already in the ledger.
+
+    Rows are read, mapped and checked against a hash index of the user's
+    existing expenses (and of earlier rows in the file) one at a time, and
+    written ``chunk_size`` at a time through ``store.add_expenses``.
+    ``progress(rows_read, rows_written)`` is called after every chunk.
+    Returns counts plus ``errors`` and ``skipped_rows``, lists of ``(line,
+    message)`` for rows that failed and for rows that are not expenses.
+    """
+    seen = build_dedup_index(store.load_expenses(username))
+    report = {"read": 0, "imported": 0, "duplicates": 0, "skipped": 0, "failed": 0, "errors": [], "skipped_rows": [],
+              "ids": []}
+    mapping = None
+    chunk = []
+
+    def flush():
+        if chunk:
+            report["ids"].extend(store.add_expenses(chunk))
+            report["imported"] += len(chunk)
+            chunk.clear()
+        if progress:
+            progress(report["read"], report["imported"])
+
+    for line, record in read_statement(stream):
+        if mapping is None:
+            mapping = column_mapping(record.keys())
+        report["read"] += 1
+        try:
+            expense = to_expense(record, mapping, username, trip)
+        except SkippedRow as e:
+            report["skipped"] += 1
+            if len(report["skipped_rows"]) < MAX_REPORTED_ERRORS:
+                report["skipped_rows"].append((line, str(e)))
+            continue
+        except ValueError as e:
+            report["failed"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append((line, str(e)))
+            continue
+        key = dedup_key(username, expense["date"], expense["amount"], expense["description"])
+        if key in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(key)
+        chunk.append(expense)
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    logger.info("Imported %d of %d rows for %s (%d duplicates, %d credits or blank, %d errors).", report["imported"],
+                report["read"], username, report["duplicates"], report["skipped"], report["failed"])
+    return report
@@ -0,0 +1,234 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+logger = logging.getLogger(__name__)
+
+METRICS_PATH = "metrics.prom"
+METRIC_PREFIX = "expense_tracker"
+QUOTA_STATUS = 429
+# Calls made outside a rerun, e.g. by the write-behind worker thread.
+BACKGROUND_USER = "-"
+
+
+class RerunMetrics:
+    """Every API call and cache lookup made during one script rerun."""
+
+    def __init__(self, username: str = BACKGROUND_USER):
+        self.username = username
+        self.started = time.time()
+        self.seconds = 0.0
+        self.calls = []
+        self.cache = Counter()
+
+    def summary(self) -> list:
+        """One dict per ``(api, method)``: count, total/max ms, bytes, errors, quota errors."""
+        rows = {}
+        for call in self.calls:
+            row = rows.setdefault((call["api"], call["method"]), {
+                "api": call["api"], "method": call["method"], "count": 0, "ms": 0.0, "max_ms": 0.0,
+                "bytes": 0, "errors": 0, "quota_errors": 0,
+            })
+            ms = call["seconds"] * 1000
+            row["count"] += 1
+            row["ms"] = round(row["ms"] + ms, 2)
+            row["max_ms"] = round(max(row["max_ms"], ms), 2)
+            row["bytes"] += call["bytes"]
+            row["errors"] += call["error"] is not None
+            row["quota_errors"] += call["error"] == str(QUOTA_STATUS)
+        return sorted(rows.values(), key=lambda r: -r["ms"])
+
+    def as_dict(self) -> dict:
+        return {
+            "event": "rerun",
+            "user": self.username,
+            "started": self.started,
+            "seconds": round(self.seconds, 4),
+            "api_calls": len(self.calls),
+            "api_ms": round(sum(c["seconds"] for c in self.calls) * 1000, 2),
+            "calls": self.summary(),
+            "cache": dict(self.cache),
+        }
+
+
+class MetricsRegistry:
+    """Process-wide totals, labelled by user, for the Prometheus/JSON dump."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(lambda: {"count": 0, "seconds": 0.0, "bytes": 0, "errors": 0, "quota_errors": 0})
+        self.cache = Counter()
+        self.reruns = Counter()
+        self.rerun_seconds = Counter()
+
+    def add_call(self, username: str, call: dict) -> None:
+        with self._lock:
+            totals = self.calls[(username, call["api"], call["method"])]
+            totals["count"] += 1
+            totals["seconds"] += call["seconds"]
+            totals["bytes"] += call["bytes"]
+            totals["errors"] += call["error"] is not None
+            totals["quota_errors"] += call["error"] == str(QUOTA_STATUS)
+
+    def add_cache(self, username: str, cache: str, outcome: str) -> None:
+        with self._lock:
+            self.cache[(username, cache, outcome)] += 1
+
+    def add_rerun(self, run: RerunMetrics) -> None:
+        with self._lock:
+            self.reruns[run.username] += 1
+            self.rerun_seconds[run.username] += run.seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "calls": [dict(user=u, api=a, method=m, **t) for (u, a, m), t in sorted(self.calls.items())],
+                "cache": [{"user": u, "cache": c, "outcome": o, "count": n} for (u, c, o), n in sorted(self.cache.items())],
+                "reruns": [{"user": u, "count": n, "seconds": self.rerun_seconds[u]} for u, n in sorted(self.reruns.items())],
+            }
+
+    def prometheus(self) -> str:
+        data = self.as_dict()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+
+        calls = [({"user": c["user"], "api": c["api"], "method": c["method"]}, c) for c in data["calls"]]
+        metric("api_calls_total", "counter", "API calls made.", [(l, c["count"]) for l, c in calls])
+        metric("api_seconds_total", "counter", "Time spent in API calls.", [(l, round(c["seconds"], 6)) for l, c in calls])
+        metric("api_response_bytes_total", "counter", "Response payload bytes.", [(l, c["bytes"]) for l, c in calls])
+        metric("api_errors_total", "counter", "API calls that failed.", [(l, c["errors"]) for l, c in calls])
+        metric("api_quota_errors_total", "counter", "API calls rejected by quota (429).",
+               [(l, c["quota_errors"]) for l, c in calls])
+        metric("cache_events_total", "counter", "Cache lookups by outcome.",
+               [({"user": c["user"], "cache": c["cache"], "outcome": c["outcome"]}, c["count"]) for c in data["cache"]])
+        metric("reruns_total", "counter", "Completed script reruns.", [({"user": r["user"]}, r["count"]) for r in data["reruns"]])
+        metric("rerun_seconds_total", "counter", "Wall time of completed reruns.",
+               [({"user": r["user"]}, round(r["seconds"], 6)) for r in data["reruns"]])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+_current = contextvars.ContextVar("rerun_metrics", default=None)
+
+
+def current_rerun():
+    return _current.get()
+
+
+@contextmanager
+def metered_rerun(username: str, path: str = METRICS_PATH):
+    """Collect the enclosed rerun's calls; on completion log it as one JSON line and rewrite the metrics file.
+
+    The run is unset however the block exits, so a rerun cut short by
+    st.rerun()/st.stop() or an exception leaves nothing behind for a later
+    fragment rerun to attach to. Its calls are still in the totals, only the
+    per-rerun line is lost.
+    """
+    run = RerunMetrics(username)
+    token = _current.set(run)
+    try:
+        yield run
+    finally:
+        _current.reset(token)
+    run.seconds = time.time() - run.started
+    registry.add_rerun(run)
+    logger.info(json.dumps(run.as_dict()))
+    if path:
+        write_metrics(path)
+
+
+def write_metrics(path: str = METRICS_PATH) -> None:
+    """Dump the totals for scraping: JSON if ``path`` ends in .json, else Prometheus text."""
+    text = json.dumps(registry.as_dict(), indent=2) if path.endswith(".json") else registry.prometheus()
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Could not write metrics to %s: %s", path, e)
+
+
+def record_call(api: str, method: str, seconds: float, size: int = 0, error: str = None) -> None:
+    run = _current.get()
+    call = {"api": api, "method": method, "seconds": seconds, "bytes": size, "error": error}
+    if run is not None:
+        run.calls.append(call)
+    registry.add_call(run.username if run is not None else BACKGROUND_USER, call)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(dict(call, event="api_call", user=run.username if run else BACKGROUND_USER)))
+
+
+def record_cache(cache: str, outcome: str) -> None:
+    """Count a cache lookup, e.g. ``record_cache("ledger", "hit")``."""
+    run = _current.get()
+    if run is not None:
+        run.cache[f"{cache}.{outcome}"] += 1
+    registry.add_cache(run.username if run is not None else BACKGROUND_USER, cache, outcome)
+
+
+@contextmanager
+def timed(api: str, method: str):
+    """Time the enclosed call; set ``bytes`` and ``error`` on the yielded dict as they become known."""
+    call = {"bytes": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call["error"] = call["error"] or type(e).__name__
+        raise
+    finally:
+        record_call(api, method, time.perf_counter() - start, call["bytes"], call["error"])
+
+
+def _gspread_caller() -> str:
+    """Name of the outermost public gspread method on the stack, e.g. ``get_all_values``."""
+    name = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("gspread."):
+            code_name = frame.f_code.co_name
+            if not code_name.startswith("_") and code_name != "wrapper":
+                name = code_name
+        elif name is not None:
+            break
+        frame = frame.f_back
+    return name or "request"
+
+
+class InstrumentedHTTPClient(HTTPClient):
+    """gspread HTTP client that records every request, labelled with the gspread method that made it.
+
+    Pass it to ``gspread.authorize(creds, http_client=InstrumentedHTTPClient)``.
+    """
+
+    def request(self, method, endpoint, *args, **kwargs):
+        with timed("sheets", _gspread_caller()) as call:
+            try:
+                response = super().request(method, endpoint, *args, **kwargs)
+            except APIError as e:
+                call["error"] = str(getattr(e.response, "status_code", e.code))
+                call["bytes"] = len(getattr(e.response, "content", b"") or b"")
+                raise
+            call["bytes"] = len(response.content or b"")
+            return response
@@ -0,0 +1,82 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_WORKERS = 8
+# How long the location box waits for the geocoder before rendering without it.
+GEOCODE_TIMEOUT = 2.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Process-wide pool shared by every session's prefetches."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+        return _executor
+
+
+def _script_context():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        return None
+
+
+def _run_in(script_ctx, var_ctx, func, args, kwargs):
+    if script_ctx is not None:
+        # Lets st.secrets and friends work in the worker like in the script thread.
+        from streamlit.runtime.scriptrunner import add_script_run_ctx
+        add_script_run_ctx(threading.current_thread(), script_ctx)
+    return var_ctx.run(func, *args, **kwargs)
+
+
+class Prefetch:
+    """Independent reads started together at the top of a rerun, consumed by name later.
+
+    ``submit`` starts a call on the shared pool (carrying over the rerun's
+    context, so instrumentation still attributes it). ``result`` waits for
+    it: a call submitted with a ``timeout`` that has not finished by then
+    yields ``default`` and keeps running in the background (warming the
+    caches for the next rerun). A call that failed, or was never submitted,
+    runs ``fallback`` in the script thread instead, so one broken source
+    degrades to the old sequential behaviour rather than breaking the page.
+
+    Each result is handed out once. A fragment rerun still holds the
+    Prefetch of the last full run, so asking for the same name again runs
+    ``fallback`` (a fresh read) instead of returning that run's old value.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor = None):
+        self.executor = executor or get_executor()
+        self.errors = {}
+        self._futures = {}
+
+    def submit(self, name: str, func, *args, timeout: float = None, **kwargs):
+        future = self.executor.submit(_run_in, _script_context(), contextvars.copy_context(), func, args, kwargs)
+        self._futures[name] = (future, timeout)
+        return future
+
+    def result(self, name: str, fallback=None, default=None):
+        self.errors.pop(name, None)
+        if name not in self._futures:
+            return fallback() if fallback else default
+        future, timeout = self._futures.pop(name)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            logger.warning("Prefetch %s not ready after %.1fs; rendering without it.", name, timeout)
+            self.errors[name] = "timeout"
+            return default
+        except Exception as e:
+            logger.warning("Prefetch %s failed: %s", name, e)
+            self.errors[name] = e
+            return fallback() if fallback else default
@@ -0,0 +1,47 @@
+"""Nightly reports over every user: category totals, daily trends, budget utilization and forecasts.
+
+    python report.py [--format csv|json|html] [--out DIR] [--only category_totals,daily_trends]
+
+Reads the ledger and the budgets once from the configured store (the same
+secrets and storage_backend setting as the app) and writes one file per
+report to DIR, or everything to stdout.
+"""
+import argparse
+import logging
+import sys
+import time
+
+import reporting
+from storage import open_store
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--format", choices=sorted(reporting.FORMATS), default="csv",
+                        help="json writes JSON Lines")
+    parser.add_argument("--out", help="directory for the report files (default: stdout)")
+    parser.add_argument("--only", default=",".join(reporting.REPORTS),
+                        help=f"comma-separated subset of {', '.join(reporting.REPORTS)}")
+    args = parser.parse_args(argv)
+    only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = sorted(set(only) - set(reporting.REPORTS))
+    if unknown:
+        parser.error(f"unknown reports: {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    store = open_store(write_behind=False)
+    df = store.load_all_expenses()
+    budgets = store.load_budgets()
+    logger.info("Loaded %d expenses and %d budgets in %.1fs.", len(df), len(budgets), time.perf_counter() - start)
+    for name, frame in reporting.build_reports(df, budgets, only):
+        path = reporting.write_report(name, frame, args.format, out_dir=args.out, stream=sys.stdout)
+        if path:
+            print(path, file=sys.stderr)
+    logger.info("Reports done in %.1fs.", time.perf_counter() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
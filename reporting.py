@@ -0,0 +1,128 @@
+import html
+import logging
+import os
+
+import pandas as pd
+
+import forecast
+
+logger = logging.getLogger(__name__)
+
+REPORTS = ("category_totals", "daily_trends", "budget_utilization", "budget_forecast", "category_run_rates")
+# json is written as JSON Lines, one record per line, so large reports stream.
+FORMATS = {"csv": "csv", "json": "jsonl", "html": "html"}
+# Trailing calendar window for the daily trend's moving total.
+TREND_WINDOW = "7D"
+# Trip label of a user's spending across all trips (and of their overall budget).
+ALL_TRIPS = ""
+
+
+def category_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """``username, trip, category, amount, count`` for every user and trip, in one group-by."""
+    columns = ["username", "trip", "category", "amount", "count"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    out = (df.groupby(["username", "trip", "category"], observed=True, sort=True)["amount"]
+           .agg(amount="sum", count="size").reset_index())
+    out["amount"] = out["amount"].round(2)
+    return out[columns]
+
+
+def daily_trends(df: pd.DataFrame) -> pd.DataFrame:
+    """Spend per user, trip and day, with the running total and the trailing 7-day total."""
+    columns = ["username", "trip", "date", "amount", "count", "cumulative", "last_7_days"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    keys = ["username", "trip"]
+    days = (df.assign(date=df["date"].dt.normalize())
+            .groupby(keys + ["date"], observed=True, sort=True)["amount"]
+            .agg(amount="sum", count="size").reset_index())
+    groups = days.groupby(keys, observed=True, sort=True)
+    days["cumulative"] = groups["amount"].cumsum().round(2)
+    # groupby().rolling() returns the groups in the same sorted order as ``days``.
+    days["last_7_days"] = groups.rolling(TREND_WINDOW, on="date")["amount"].sum().round(2).to_numpy()
+    days["amount"] = days["amount"].round(2)
+    return days[columns]
+
+
+def budget_utilization(df: pd.DataFrame, budgets: pd.DataFrame) -> pd.DataFrame:
+    """Spent vs budget per user and trip, plus one all-trips row per user (trip ``""``).
+
+    A trip without its own budget is measured against the user's overall
+    budget, as the dashboard does. ``utilization`` is NaN where there is no
+    budget at all.
+    """
+    keys = ["username", "trip"]
+    spent = (df.groupby(keys, observed=True)["amount"].sum().reset_index()
+             .astype({"username": str, "trip": str}) if not df.empty
+             else pd.DataFrame(columns=keys + ["amount"]))
+    overall = spent.groupby("username", as_index=False)["amount"].sum().assign(trip=ALL_TRIPS)
+    spent = pd.concat([spent, overall], ignore_index=True).rename(columns={"amount": "spent"})
+    budgets = budgets.astype({"username": str, "trip": str, "budget": "float64"})
+    out = spent.merge(budgets, on=keys, how="outer")
+    overall_budget = budgets[budgets["trip"] == ALL_TRIPS].set_index("username")["budget"]
+    out["budget"] = out["budget"].fillna(out["username"].map(overall_budget)).fillna(0.0)
+    out["spent"] = out["spent"].fillna(0.0).astype("float64").round(2)
+    out["remaining"] = (out["budget"] - out["spent"]).round(2)
+    out["utilization"] = (out["spent"] / out["budget"].where(out["budget"] > 0)).round(4)
+    out["over_budget"] = out["spent"] > out["budget"]
+    out.loc[out["budget"] <= 0, "over_budget"] = False
+    return out.sort_values(keys, kind="stable").reset_index(drop=True)[
+        keys + ["spent", "budget", "remaining", "utilization", "over_budget"]]
+
+
+def build_reports(df: pd.DataFrame, budgets: pd.DataFrame, only=REPORTS):
+    """Yield ``(name, frame)`` for each requested report, computing each one only when it is consumed."""
+    forecasts = None
+    for name in only:
+        if name in ("budget_forecast", "category_run_rates") and forecasts is None:
+            # Both come out of the same batch pass over every user's trips.
+            forecasts = forecast.forecast_frame(forecast.daily_totals(df), budgets)
+        if name == "category_totals":
+            yield name, category_totals(df)
+        elif name == "daily_trends":
+            yield name, daily_trends(df)
+        elif name == "budget_utilization":
+            yield name, budget_utilization(df, budgets)
+        elif name == "budget_forecast":
+            yield name, forecasts[0]
+        elif name == "category_run_rates":
+            yield name, forecasts[1]
+        else:
+            raise ValueError(f"Unknown report: {name}")
+
+
+def write_report(name: str, frame: pd.DataFrame, fmt: str, out_dir: str = None, stream=None) -> str:
+    """Write one report to ``out_dir/<name>.<ext>``, or append it to ``stream`` with a heading.
+
+    Returns the file written, if any.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"{name}.{FORMATS[fmt]}")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            _write(frame, fmt, f)
+        logger.info("Wrote %d rows to %s.", len(frame), path)
+        return path
+    if fmt == "csv":
+        stream.write(f"# {name}\n")
+    elif fmt == "html":
+        stream.write(f"<h2>{html.escape(name)}</h2>\n")
+    else:
+        frame = frame.assign(report=name)
+    _write(frame, fmt, stream)
+    return None
+
+
+def _write(frame: pd.DataFrame, fmt: str, f) -> None:
+    if fmt == "csv":
+        frame.to_csv(f, index=False)
+    elif fmt == "json":
+        if not frame.empty:
+            text = frame.to_json(orient="records", lines=True, date_format="iso")
+            f.write(text if text.endswith("\n") else text + "\n")
+    else:
+        frame.to_html(f, index=False, na_rep="")
+        f.write("\n")
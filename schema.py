@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+# Low-cardinality text columns stored as pandas categoricals.
+CATEGORICAL_COLUMNS = ("username", "category", "trip", "location", "currency")
+NUMERIC_COLUMNS = ("amount", "split_amount", "original_amount")
+DATE_COLUMNS = ("date",)
+# Sheet header spellings mapped to frame column names.
+COLUMN_ALIASES = {"split amount": "split_amount", "split_amt": "split_amount", "original amount": "original_amount"}
+
+
+def normalize_header(header: list) -> list:
+    names = [col.strip().lower() for col in header]
+    return [COLUMN_ALIASES.get(name, name) for name in names]
+
+
+def _typed(name: str, values):
+    if name in CATEGORICAL_COLUMNS:
+        return pd.Categorical(values)
+    if name in NUMERIC_COLUMNS:
+        return pd.to_numeric(pd.Series(np.asarray(values, dtype=object)), errors="coerce").to_numpy("float64")
+    if name in DATE_COLUMNS:
+        return pd.to_datetime(pd.Series(np.asarray(values, dtype=object)), errors="coerce").to_numpy()
+    return np.asarray(values, dtype=object)
+
+
+def split_participants(shared_with: str) -> list:
+    return [p.strip() for p in str(shared_with or "").split(",") if p.strip()]
+
+
+def finish_expense_columns(data: dict) -> dict:
+    """Fill in the derived columns of typed expense columns (name -> array), in place.
+
+    Blank amounts become 0, ``split_amount`` falls back to ``amount`` and
+    ``shared_list`` is added next to ``shared_with``.
+    """
+    if "amount" in data:
+        data["amount"] = np.nan_to_num(data["amount"], nan=0.0)
+        split = data.get("split_amount")
+        data["split_amount"] = data["amount"].copy() if split is None else np.where(np.isnan(split), data["amount"], split)
+    if "shared_with" in data:
+        shared = [str(v or "") for v in data["shared_with"]]
+        data["shared_with"] = np.asarray(shared, dtype=object)
+        shared_list = np.empty(len(shared), dtype=object)
+        for i, value in enumerate(shared):
+            shared_list[i] = split_participants(value)
+        data["shared_list"] = shared_list
+    return data
+
+
+def build_expense_frame(header: list, rows: list, row_numbers: list = None) -> pd.DataFrame:
+    """Build a typed expense frame straight from a raw value matrix.
+
+    Each column is parsed exactly once: categoricals for ``username``,
+    ``category``, ``trip`` and ``location``, float64 ``amount`` and
+    ``split_amount``, datetime64 ``date``, plus ``shared_list`` holding
+    ``shared_with`` already split into participants. ``split_amount`` falls
+    back to ``amount`` where it is blank (rows that were not shared).
+    """
+    names = normalize_header(header)
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    data = {}
+    for name, values in zip(names, columns):
+        if name and name not in data:
+            data[name] = _typed(name, values)
+    data = finish_expense_columns(data)
+    df = pd.DataFrame(data, columns=list(data))
+    if row_numbers is not None:
+        df["Row"] = np.asarray(row_numbers, dtype="int64")
+    return df
+
+
+def concat_expense_frames(frames: list) -> pd.DataFrame:
+    """Stack expense frames (e.g. one per ledger partition), keeping the categorical columns."""
+    frames = [df for df in frames if not df.empty] or frames[:1]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    for name in CATEGORICAL_COLUMNS:
+        if name in df.columns and not isinstance(df[name].dtype, pd.CategoricalDtype):
+            df[name] = df[name].astype("category")
+    return df
+
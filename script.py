@@ -1,45 +1,42 @@
+import functools
+import math
+import time
 import streamlit as st
 import pandas as pd
-import requests
 import random
-from google_sheets_utils import (
-    connect_sheet,
-    add_expense_with_trip,
-    load_expense_with_trip,
-    get_user_trips,
-    get_budget,
-    set_budget,
-    update_expense_with_trip,
-    delete_expense
-)
+from storage import EDITABLE_COLUMNS, QUERY_PAGE_SIZE, QUERY_SORT_KEYS, open_store
+from geocoding import GeocodingError, get_geocoder
+from anomaly import Z_HIGH, Z_LOW, flag_anomalies
+from importer import import_expenses
+from prefetch import GEOCODE_TIMEOUT, Prefetch
+from settlement import expense_shares, net_balances, settle
+from forecast import FORECAST_WARNING_DAYS, get_forecast_engine
+from currency import BASE_CURRENCY, CurrencyError, convert_frame, format_money, get_rate_engine
+from instrumentation import METRICS_PATH, current_rerun, metered_rerun
+from settings import get_setting
 
 # --- Location API ---
-def nominatim_search(query, limit=5):
-    import time
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        "q": query,
-        "format": "json",
-        "addressdetails": 1,
-        "limit": limit,
-        "accept-language": "en",
-    }
-    headers = {
-        "User-Agent": "travel-expense-tracker-app (your-email@example.com)"
-    }
+def nominatim_search(query, trip=None, limit=5):
+    key = f"locations:{query}:{trip}"
     try:
-        time.sleep(1)
-        resp = requests.get(url, params=params, headers=headers)
-        if resp.status_code == 200:
-            return resp.json()
-        else:
-            st.warning(f"Nominatim API error: {resp.status_code}")
+        # Waits at most GEOCODE_TIMEOUT: a slow geocoder renders the box without suggestions,
+        # and the lookup keeps running to warm its cache for the next keystroke.
+        prefetch.submit(key, get_geocoder().search, query, trip=trip, limit=limit, timeout=GEOCODE_TIMEOUT)
+        results = prefetch.result(key)
+        error = prefetch.errors.get(key)
+        if error == "timeout":
+            st.info("Location search is slow right now; suggestions will show up on your next input.")
+        elif error is not None:
+            raise error
+        return results or []
+    except GeocodingError as e:
+        st.warning(str(e))
     except Exception as e:
         st.error(f"API error: {e}")
     return []
 
 # --- AI Suggestion Logic ---
-def ai_suggestion(df, category, amount, total_spent, budget):
+def ai_suggestion(score, category, total_spent, budget):
     def color_wrap(text):
         return f"<span style='color:white;'>{text}</span>"
 
@@ -72,18 +69,17 @@ def ai_suggestion(df, category, amount, total_spent, budget):
         ]
         return color_wrap(random.choice(warnings)), True
 
-    # Normal spending suggestions
-    cat_exp = df[df["category"] == category]["amount"].sum()
-    avg_cat_exp = cat_exp / max(len(df[df["category"] == category]), 1)
+    # Normal spending suggestions, from the z-score against past spending in this category
+    z = score["z"] if score else 0.0
 
-    if amount > avg_cat_exp * 1.5:
+    if z >= Z_HIGH:
         suggestion = random.choice([
             f"🚀 Wow! That's a big spend on `{category}` compared to usual. Keep an eye!",
             f"⚠️ High expense alert for `{category}`! Make sure it's worth it.",
             f"🔥 `{category}` spending spike detected. Budget wisely!",
             f"💡 You splurged on `{category}` today. Monitor those costs!"
         ])
-    elif amount < avg_cat_exp * 0.5:
+    elif z <= Z_LOW:
         suggestion = random.choice([
             f"🎉 Nice! You're spending less than usual on `{category}`—smart move.",
             f"✅ Keeping `{category}` costs low, great job!",
@@ -100,13 +96,6 @@ def ai_suggestion(df, category, amount, total_spent, budget):
 
     return color_wrap(suggestion), False
 
-    if amount > avg_cat_exp * 1.5:
-        return random.choice(high_spend_msgs), False
-    elif amount < avg_cat_exp * 0.5:
-        return random.choice(low_spend_msgs), False
-    else:
-        return random.choice(normal_spend_msgs), False
-
 # --- Sound beep helper ---
 def play_beep():
     st.markdown(
@@ -118,6 +107,77 @@ def play_beep():
         unsafe_allow_html=True,
     )
 
+# --- Fragments ---
+# Each part of the page is an st.fragment: using a widget inside one reruns
+# only that function. Whatever else the page shows depends on the trip, the
+# budget or the ledger, so a change to those goes through st.rerun() (see
+# ledger_changed) and every fragment is drawn again with its new arguments.
+
+# Data a fragment loaded, reused until the ledger version moves on (or it gets this old).
+DATA_TTL = 60
+
+def metered_fragment(func):
+    """st.fragment that counts its own reruns; a fragment rerun never enters the metered_rerun block below."""
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        if current_rerun() is not None:
+            return func(*args, **kwargs)
+        with metered_rerun(username, get_setting("metrics_path", METRICS_PATH)):
+            return func(*args, **kwargs)
+    return st.fragment(run)
+
+def is_fresh(key):
+    entry = st.session_state.data_cache.get(key)
+    return (entry is not None and entry[0] == st.session_state.ledger_version
+            and time.time() - entry[1] < DATA_TTL)
+
+def cached(key, load):
+    """``load()``, remembered for this session under ``key`` and the current ledger version."""
+    if not is_fresh(key):
+        st.session_state.data_cache[key] = (st.session_state.ledger_version, time.time(), load())
+    return st.session_state.data_cache[key][2]
+
+STALE_ROWS_MESSAGE = ("Some of those expenses were changed or deleted elsewhere, so nothing was saved. "
+                      "The list has been reloaded; please try again.")
+
+def ledger_changed(*messages):
+    """After a write: show ``messages`` (kind, text) on the next run and redraw the whole page."""
+    st.session_state.flash.extend(messages)
+    st.session_state.ledger_version += 1
+    st.rerun()
+
+def load_trips():
+    return cached(("trips",), lambda: prefetch.result("trips", fallback=lambda: store.list_trips(username)))
+
+def load_budget(trip):
+    budget = cached(("budget", trip), lambda: prefetch.result(
+        f"budget:{trip}", fallback=lambda: store.get_budget(username, trip=trip)))
+    try:
+        return float(budget)
+    except:
+        return 0.0
+
+def load_forecast(trip, budget):
+    return cached(("forecast", trip), lambda: forecaster.forecast(store, username, trip, budget=budget))
+
+def load_category_totals(trip):
+    return cached(("category_totals", trip), lambda: prefetch.result(
+        f"category_totals:{trip}", fallback=lambda: store.category_totals(username, trip)))
+
+# Expense editor columns edited as plain strings.
+TEXT_EDIT_COLUMNS = ["date", "category", "description", "location", "trip"]
+
+def as_text(frame):
+    """``frame`` with TEXT_EDIT_COLUMNS as strings, blank cells (NaT/NaN/None) as "" rather than "NaT"/"nan"."""
+    columns = {}
+    for name in TEXT_EDIT_COLUMNS:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            columns[name] = column.dt.strftime("%Y-%m-%d").fillna("")
+        else:
+            columns[name] = column.astype(object).where(column.notna(), "").astype(str)
+    return frame.assign(**columns)
+
 # --- Streamlit Setup ---
 st.set_page_config(page_title="Travel Expense Tracker", layout="wide")
 params = st.query_params
@@ -127,294 +187,474 @@ if not username:
     st.error("⚠️ You are logged out. Please log in.")
     st.stop()
 
-# --- Connect Google Sheet ---
-gsheet = connect_sheet()
-
-# --- Session State initialization ---
-if "active_trip" not in st.session_state:
-    st.session_state.active_trip = None
-if "viewing_trip" not in st.session_state:
-    st.session_state.viewing_trip = None
-if "last_ai_msg" not in st.session_state:
-    st.session_state.last_ai_msg = ""
-
-# --- Sidebar: Trip Manager and Budget ---
-with st.sidebar:
-    st.image("https://cdn-icons-png.flaticon.com/512/4712/4712102.png", width=80)
-    st.text(f"Hello {username}!")
-    # Pop-up style greeting in chat area, so skip sidebar greeting here.
-
-    st.title("📂 Travel Expense Tracker")
-    st.markdown("---")
-
-    # Trip manager
-    user_trips = get_user_trips(gsheet, username)
-    default_trips = ["General"]
-    all_trips = sorted(set(user_trips + default_trips))
-
-    trip_input = st.text_input("➕ Start New Trip:", key="trip_input")
-    existing_trip = st.selectbox("📂 View Previous Trips:", options=all_trips, key="trip_select")
-
-    # Initialize active trip if None
-    if st.session_state.active_trip is None:
-        if trip_input.strip():
+# Count this rerun's Sheets/HTTP calls and cache hits (see instrumentation.py). The block
+# unsets the run however the rerun ends, so fragment reruns never report into a dead one.
+with metered_rerun(username, get_setting("metrics_path", METRICS_PATH)) as rerun_metrics:
+
+    # --- Connect storage backend (Google Sheets or local SQLite) ---
+    store = open_store()
+    # One-off upgrades of older data (e.g. ids for legacy Sheets rows); a no-op once done.
+    store.migrate()
+    fx = get_rate_engine()
+    forecaster = get_forecast_engine()
+    currencies = fx.currencies()
+
+    # --- Session State initialization ---
+    if "active_trip" not in st.session_state:
+        st.session_state.active_trip = None
+    if "viewing_trip" not in st.session_state:
+        st.session_state.viewing_trip = None
+    if "last_ai_msg" not in st.session_state:
+        st.session_state.last_ai_msg = ""
+    if "ledger_version" not in st.session_state:
+        st.session_state.ledger_version = 0
+    if "data_cache" not in st.session_state:
+        st.session_state.data_cache = {}
+    if "flash" not in st.session_state:
+        st.session_state.flash = []
+    if "selected_location" not in st.session_state:
+        st.session_state.selected_location = ""
+    if "writes_seen" not in st.session_state:
+        # Only writes lost after this session started are reported to it.
+        lost = store.dropped_writes()
+        st.session_state.writes_seen = lost[-1]["seq"] if lost else 0
+
+    # Background writes that failed after the page had already reported them saved
+    lost = store.dropped_writes(since=st.session_state.writes_seen)
+    if lost:
+        st.session_state.writes_seen = lost[-1]["seq"]
+        st.session_state.ledger_version += 1
+        st.error(f"⚠️ {len(lost)} recent change(s) could not be saved to the sheet and were lost "
+                 f"({lost[-1]['error']}). The figures below are reloaded from the sheet.")
+
+    # --- Prefetch: start this rerun's independent reads together ---
+    # Only what the session does not already hold for this ledger version; the
+    # loaders above pick the results up by name.
+    prefetch = Prefetch()
+    if not is_fresh(("trips",)):
+        prefetch.submit("trips", store.list_trips, username)
+    known_trip = st.session_state.active_trip
+    if known_trip:
+        if not is_fresh(("budget", known_trip)):
+            prefetch.submit(f"budget:{known_trip}", store.get_budget, username, trip=known_trip)
+        for trip in {known_trip, st.session_state.viewing_trip or known_trip}:
+            if not is_fresh(("category_totals", trip)):
+                prefetch.submit(f"category_totals:{trip}", store.category_totals, username, trip)
+
+    # --- Sidebar: Trip Manager and Budget ---
+    @metered_fragment
+    def trip_sidebar():
+        # Trip manager
+        user_trips = load_trips()
+        default_trips = ["General"]
+        all_trips = sorted(set(user_trips + default_trips))
+
+        trip_input = st.text_input("➕ Start New Trip:", key="trip_input")
+        existing_trip = st.selectbox("📂 View Previous Trips:", options=all_trips, key="trip_select")
+
+        # Initialize active trip if None
+        if st.session_state.active_trip is None:
+            if trip_input.strip():
+                st.session_state.active_trip = trip_input.strip()
+            elif user_trips:
+                st.session_state.active_trip = sorted(user_trips)[-1]
+            else:
+                st.session_state.active_trip = "General"
+
+        # If user inputs new trip, update active trip and rerun
+        if trip_input.strip() and trip_input.strip() != st.session_state.active_trip:
             st.session_state.active_trip = trip_input.strip()
-        elif user_trips:
-            st.session_state.active_trip = sorted(user_trips)[-1]
-        else:
-            st.session_state.active_trip = "General"
-
-    # If user inputs new trip, update active trip and rerun
-    if trip_input.strip() and trip_input.strip() != st.session_state.active_trip:
-        st.session_state.active_trip = trip_input.strip()
-        st.rerun()
-
-    active_trip = st.session_state.active_trip
-
-    # Viewing trip selector
-    if st.session_state.viewing_trip is None:
-        st.session_state.viewing_trip = active_trip
-
-    if existing_trip != active_trip:
-        if st.button("📖 View Selected Trip History"):
-            st.session_state.viewing_trip = existing_trip
-
-    if st.session_state.viewing_trip != active_trip:
-        st.markdown(f"### 📂 Viewing Trip: `{st.session_state.viewing_trip}`")
-        if st.button("🔄 Return to Active Trip"):
-            st.session_state.viewing_trip = active_trip
             st.rerun()
-    else:
-        st.markdown(f"### 🗺️ Active Trip: `{active_trip}`")
 
-    st.markdown("---")
+        active_trip = st.session_state.active_trip
 
-    # Budget management
-    curr_budget = get_budget(gsheet, username)
-    try:
-        curr_budget = float(curr_budget)
-    except:
-        curr_budget = 0.0
+        # Viewing trip selector
+        if st.session_state.viewing_trip is None:
+            st.session_state.viewing_trip = active_trip
 
-    st.subheader("💰 Add Budget")
-    budget_input = st.number_input("Set Budget (₹):", min_value=0.0, value=curr_budget, step=100.0, format="%.2f")
-    if st.button("Update Budget"):
-        set_budget(gsheet, username, budget_input)
-        st.success("✅ Budget updated")
+        if existing_trip != active_trip:
+            if st.button("📖 View Selected Trip History"):
+                st.session_state.viewing_trip = existing_trip
+                st.rerun()
 
-    st.markdown("---")
-    st.sidebar.header("Currency Converter")
-    currencies = ["USD", "EUR", "INR", "GBP", "JPY", "AUD", "CAD", "CNY"]
-
-    from_currency = st.sidebar.selectbox("From", currencies, index=2)
-    to_currency = st.sidebar.selectbox("To", currencies, index=0)
-    conv_amount = st.sidebar.number_input("Amount", min_value=0.0, value=1.0, step=0.1, format="%.2f")
-
-    if st.sidebar.button("Convert"):
-       example_rates = {
-         ("INR", "USD"): 0.012, ("INR", "EUR"): 0.011, ("INR", "GBP"): 0.0098,
-         ("INR", "JPY"): 1.57, ("INR", "AUD"): 0.018, ("INR", "CAD"): 0.016, ("INR", "CNY"): 0.083,
-         ("USD", "INR"): 82.5, ("EUR", "INR"): 88.5, ("GBP", "INR"): 102.0,
-         ("JPY", "INR"): 0.64, ("AUD", "INR"): 56.0, ("CAD", "INR"): 61.5, ("CNY", "INR"): 12.0,
-         ("EUR", "USD"): 1.1, ("USD", "EUR"): 0.91, ("GBP", "USD"): 1.3,
-         ("USD", "GBP"): 0.77, ("JPY", "USD"): 0.007, ("USD", "JPY"): 140,
-         ("AUD", "USD"): 0.67, ("USD", "AUD"): 1.5, ("CAD", "USD"): 0.74,
-         ("USD", "CAD"): 1.35, ("CNY", "USD"): 0.14, ("USD", "CNY"): 7.1,
-       }
-
-       rate = example_rates.get((from_currency, to_currency), None)  # <-- Move this inside
-       if rate:
-          converted = conv_amount * rate
-          st.sidebar.success(f"{conv_amount:.2f} {from_currency} = {converted:.2f} {to_currency}")
-       else:
-          st.sidebar.error("Currency pair not supported yet.")
-
-      
-       st.sidebar.markdown("---")
-if st.sidebar.button("🚪 Logout"):
-   st.query_params.clear()
-   st.rerun()
-
-# --- Pop-up AI Greeting & Message in Chat ---
-
-def ai_chat_message(msg, is_critical=False, avatar="🤖"):
-    # Color styling for critical messages
-    color = "white" if is_critical else "#34495E"
-    with st.chat_message(avatar):
-        st.markdown(f"<span style='color:{color}; font-weight:bold;'>{msg}</span>", unsafe_allow_html=True)
-
-# Show greeting once per session
-if not st.session_state.get("greeted", False):
-    ai_chat_message(" <span style='color:white;'>👋 I'm your AI travel expense assistant. I'll help you stay on budget and give spending tips.")
-    st.session_state.greeted = True
-
-# --- Location input ---
-location_input = st.text_input("📍 Location (start typing... hit enter)", key="live_loc_input")
-selected_location = location_input
-suggestions = []
-
-if len(location_input.strip()) >= 3:
-    query = f"{location_input}, {active_trip}"
-    results = nominatim_search(query)
-    suggestions = [res['display_name'] for res in results]
-    if suggestions:
-        selected_location = st.selectbox("🔽 Suggestions", suggestions, key="location_suggestions")
-    else:
-        st.info("No matching locations found.")
-
-# --- Load expense DataFrame for active trip ---
-df = load_expense_with_trip(gsheet, username, trip=active_trip)
-df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
-total_spent = df["amount"].sum()
-remaining_budget = curr_budget - total_spent
-
-# --- Expense input form ---
-# Step 1: Let user choose sharing option BEFORE the form
-share_option = st.selectbox("Do you want to split this expense?", ["No", "Yes"])
-
-# Step 2: Capture sharing input accordingly
-shared_raw = ""
-if share_option == "Yes":
-    shared_raw = st.text_input("Enter usernames/emails (comma-separated)", key="share_input")
-
-# Step 3: Actual form for expense entry
-with st.form("add_expense_form", clear_on_submit=True):
-    date = st.date_input("Date")
-    category = st.selectbox("Category", [
-        "Flights", "Hotels", "Food", "Transport", "Miscellaneous",
-        "Shopping", "Entertainment", "Fuel", "Medical", "Groceries", "Sightseeing"
-    ])
-    description = st.text_input("Description", key="desc_input")
-    st.text(f"📍 Selected Location: {selected_location}")
-    amount = st.number_input("Amount (₹)", min_value=0.0, format="%.2f")
-    submitted = st.form_submit_button("Add Expense")
-
-# Step 4: Process the form data
-if submitted:
-    shared_with = [s.strip() for s in shared_raw.split(",") if s.strip()] if share_option == "Yes" else None
-
-    errors = []
-    if curr_budget < 1000:
-        errors.append("⚠️ Please set a valid budget of at least ₹1000 before adding expenses.")
-    if not description.strip():
-        errors.append("⚠️ Description cannot be empty.")
-    if amount <= 0:
-        errors.append("⚠️ Enter a valid amount greater than ₹0.")
-    if not selected_location or selected_location.strip() == "":
-        errors.append("⚠️ Please select a valid location.")
-
-    if errors:
-        for err in errors:
-            st.warning(err)
-        play_beep()
-    else:
-        if total_spent + amount > curr_budget:
+        if st.session_state.viewing_trip != active_trip:
+            st.markdown(f"### 📂 Viewing Trip: `{st.session_state.viewing_trip}`")
+            if st.button("🔄 Return to Active Trip"):
+                st.session_state.viewing_trip = active_trip
+                st.rerun()
+        else:
+            st.markdown(f"### 🗺️ Active Trip: `{active_trip}`")
+
+        st.markdown("---")
+
+        # Budget management
+        curr_budget = load_budget(active_trip)
+
+        st.subheader("💰 Add Budget")
+        budget_input = st.number_input("Set Budget (₹):", min_value=0.0, value=curr_budget, step=100.0, format="%.2f")
+        trip_only = st.checkbox(f"Only for `{active_trip}`", key="trip_budget_only")
+        if st.button("Update Budget"):
+            store.set_budget(username, budget_input, trip=active_trip if trip_only else None)
+            ledger_changed(("success", "✅ Budget updated"))
+
+    @metered_fragment
+    def currency_converter():
+        st.header("Currency Converter")
+        # Any pair works: the engine derives cross rates (e.g. EUR -> JPY) from the quotes it has.
+        from_currency = st.selectbox("From", currencies, index=currencies.index(BASE_CURRENCY))
+        to_currency = st.selectbox("To", currencies, index=currencies.index("USD") if "USD" in currencies else 0)
+        conv_amount = st.number_input("Amount", min_value=0.0, value=1.0, step=0.1, format="%.2f")
+
+        if st.button("Convert"):
+           try:
+              converted = fx.convert(conv_amount, from_currency, to_currency)
+              st.success(f"{conv_amount:.2f} {from_currency} = {converted:.2f} {to_currency}")
+           except CurrencyError as e:
+              st.error(str(e))
+
+    with st.sidebar:
+        st.image("https://cdn-icons-png.flaticon.com/512/4712/4712102.png", width=80)
+        st.text(f"Hello {username}!")
+        # Pop-up style greeting in chat area, so skip sidebar greeting here.
+
+        st.title("📂 Travel Expense Tracker")
+        st.markdown("---")
+
+        trip_sidebar()
+        active_trip = st.session_state.active_trip
+        curr_budget = load_budget(active_trip)
+
+        st.markdown("---")
+        currency_converter()
+        st.markdown("---")
+        # Dashboard totals, budgets and charts are shown in this currency.
+        report_currency = st.selectbox("Show amounts in", currencies, index=currencies.index(BASE_CURRENCY),
+                                       key="report_currency")
+    if st.sidebar.button("🚪 Logout"):
+       st.query_params.clear()
+       st.rerun()
+
+    # --- Pop-up AI Greeting & Message in Chat ---
+
+    def ai_chat_message(msg, is_critical=False, avatar="🤖"):
+        # Color styling for critical messages
+        color = "white" if is_critical else "#34495E"
+        with st.chat_message(avatar):
+            st.markdown(f"<span style='color:{color}; font-weight:bold;'>{msg}</span>", unsafe_allow_html=True)
+
+    # Show greeting once per session
+    if not st.session_state.get("greeted", False):
+        ai_chat_message(" <span style='color:white;'>👋 I'm your AI travel expense assistant. I'll help you stay on budget and give spending tips.")
+        st.session_state.greeted = True
+
+    # Messages from the write that caused this rerun
+    for kind, msg in st.session_state.flash:
+        if kind == "success":
+            st.success(msg)
+        elif kind == "warning":
+            st.warning(msg)
+        else:
+            ai_chat_message(msg, is_critical=kind == "critical")
+    st.session_state.flash = []
+
+    # --- Location input ---
+    @metered_fragment
+    def location_picker(trip):
+        """Typing here reruns only this fragment: one geocoder lookup, no ledger reads."""
+        location_input = st.text_input("📍 Location (start typing... hit enter)", key="live_loc_input")
+        selected_location = location_input
+
+        if len(location_input.strip()) >= 3:
+            results = nominatim_search(location_input, trip=trip)
+            suggestions = [res['display_name'] for res in results]
+            if suggestions:
+                selected_location = st.selectbox("🔽 Suggestions", suggestions, key="location_suggestions")
+            else:
+                st.info("No matching locations found.")
+        # The entry form reads it from here when it is submitted.
+        st.session_state.selected_location = selected_location
+        st.text(f"📍 Selected Location: {selected_location}")
+
+    location_picker(active_trip)
+
+    # --- Expense input form ---
+    @metered_fragment
+    def expense_form(active_trip, curr_budget):
+        # Step 1: Let user choose sharing option BEFORE the form
+        share_option = st.selectbox("Do you want to split this expense?", ["No", "Yes"])
+
+        # Step 2: Capture sharing input accordingly
+        shared_raw = ""
+        if share_option == "Yes":
+            shared_raw = st.text_input("Enter usernames/emails (comma-separated)", key="share_input")
+
+        # Step 3: Actual form for expense entry
+        with st.form("add_expense_form", clear_on_submit=True):
+            date = st.date_input("Date")
+            category = st.selectbox("Category", [
+                "Flights", "Hotels", "Food", "Transport", "Miscellaneous",
+                "Shopping", "Entertainment", "Fuel", "Medical", "Groceries", "Sightseeing"
+            ])
+            description = st.text_input("Description", key="desc_input")
+            amount = st.number_input("Amount", min_value=0.0, format="%.2f")
+            expense_currency = st.selectbox("Currency", currencies, index=currencies.index(BASE_CURRENCY))
+            submitted = st.form_submit_button("Add Expense")
+
+        # Step 4: Process the form data
+        if not submitted:
+            return
+        selected_location = st.session_state.selected_location
+        shared_with = [s.strip() for s in shared_raw.split(",") if s.strip()] if share_option == "Yes" else None
+        # The ledger is kept in rupees; a foreign amount is stored alongside as entered.
+        entered_amount = amount
+        amount = fx.convert(entered_amount, expense_currency, BASE_CURRENCY)
+        total_spent = load_category_totals(active_trip)["amount"].sum()
+
+        errors = []
+        if curr_budget < 1000:
+            errors.append("⚠️ Please set a valid budget of at least ₹1000 before adding expenses.")
+        if not description.strip():
+            errors.append("⚠️ Description cannot be empty.")
+        if amount <= 0:
+            errors.append("⚠️ Enter a valid amount greater than ₹0.")
+        if not selected_location or selected_location.strip() == "":
+            errors.append("⚠️ Please select a valid location.")
+
+        if errors:
+            for err in errors:
+                st.warning(err)
+            play_beep()
+        elif total_spent + amount > curr_budget:
             ai_chat_message(f"🚫 Cannot add expense! This would exceed your budget of ₹{curr_budget:,.2f}.", is_critical=True)
             play_beep()
         else:
-            add_expense_with_trip(
-                gsheet, username, str(date), category, description,
-                amount, selected_location, trip=active_trip, shared_with=shared_with
+            score = store.score_expense(username, category, amount, trip=active_trip, location=selected_location)
+            foreign = expense_currency != BASE_CURRENCY
+            store.add_expense(
+                username, str(date), category, description,
+                amount, selected_location, trip=active_trip, shared_with=shared_with,
+                currency=expense_currency if foreign else None, original_amount=entered_amount if foreign else None
             )
-            st.success(f"✅ Expense added to `{active_trip}`!")
-            suggestion_msg, is_critical = ai_suggestion(df, category, amount, total_spent + amount, curr_budget)
-            ai_chat_message(suggestion_msg, is_critical=is_critical)
-
-                # Reload and reprocess
-            df = load_expense_with_trip(gsheet, username, trip=active_trip)
-            df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
-            df["split_amount"] = pd.to_numeric(df.get("Split Amount", df["amount"]), errors="coerce").fillna(0)
-            df["shared_with"] = df.get("shared_with").fillna("")
-            df["is_shared"] = df["shared_with"].apply(lambda x: "✅" if str(x).strip() else "❌")
-
-            view_mode = st.radio("View Mode", ["All Expenses", "My Share Only"])
-            if view_mode == "My Share Only":
-                df = df[df["username"] == username]
-                df["amount"] = df["split_amount"]
-
-                total_spent = df["split_amount"].sum()
-                remaining_budget = curr_budget - total_spent
-
-                # AI suggestion
-                ai_msg, critical = ai_suggestion(df, category, amount, total_spent, curr_budget)
-                ai_chat_message(ai_msg, is_critical=critical)
-                if critical:
-                   play_beep()
-
-
-# --- Expense summary and management ---
-st.markdown("---")
-trip_to_display = st.session_state.viewing_trip or active_trip
-st.markdown(f"<h2 style='color:#34495E;'>📊 Expense Summary for <span style='color:#E67E22;'>{trip_to_display}</span></h2>", unsafe_allow_html=True)
-
-df_view = load_expense_with_trip(gsheet, username, trip=trip_to_display)
-if df_view.empty:
-    st.info(f"No expenses found for `{trip_to_display}`.")
-else:
-    df_view["amount"] = pd.to_numeric(df_view["amount"], errors="coerce").fillna(0)
-    total_spent_view = df_view["amount"].sum()
-    remaining_view = float(curr_budget) - total_spent_view
-
-    col1, col2, col3 = st.columns(3)
-    col1.metric("🌟 Budget", f"₹{curr_budget:,.2f}")
-    col2.metric("💸 Total Spent", f"₹{total_spent_view:,.2f}")
-    col3.metric("🎁 Remaining", f"₹{max(remaining_view, 0):,.2f}")
-
-    tabs = st.tabs(["All Expenses", "Category Breakdown", "Manage Expenses"])
-
-    with tabs[0]:
-        st.subheader("All Expenses")
-        st.dataframe(df_view, height=400)
-
-    with tabs[1]:
-         st.subheader("📊 Category Breakdown (Overall)")
-    
-         # Overall category-wise breakdown
-         summary = df_view.groupby("category")["amount"].sum().reset_index()
-         st.bar_chart(summary.rename(columns={"amount": "Amount"}).set_index("category"))
-
-         summary["% Used"] = (summary["amount"] / curr_budget * 100).round(2)
-         summary["Status"] = summary["% Used"].apply(lambda x: "OK ✅" if x <= 30 else "High ⚠️")
-         st.dataframe(summary[["category", "amount", "% Used", "Status"]])
-
-         st.markdown("---")
-         st.subheader("📅 Daily Category Breakdown")
-
-         # Convert date column to datetime
-         df_view["date"] = pd.to_datetime(df_view["date"], errors="coerce")
-
-         # Group by date and category
-         daily_breakdown = df_view.groupby(["date", "category"])["amount"].sum().reset_index()
-
-         # Pivot to get categories as columns for grouped bar chart
-         pivot_table = daily_breakdown.pivot(index="date", columns="category", values="amount").fillna(0)
-
-         st.bar_chart(pivot_table)
-         st.subheader("📈 Total Daily Spend Trend")
-         daily_total = df_view.groupby("date")["amount"].sum()
-         st.line_chart(daily_total)
-
-
-    with tabs[2]:
-        st.subheader("Delete Expense")
-        with st.expander("Delete an Expense"):
-            if not df_view.empty:
-                delete_row = st.number_input("Row Number", min_value=2, max_value=int(df_view["Row"].max()), step=1)
-                if st.button("Delete"):
-                    delete_expense(gsheet, int(delete_row))
-                    st.success(f"Deleted row: {int(delete_row)}")
-
-        st.subheader("Update Expense")
-        with st.expander("Update an Expense"):
-            if not df_view.empty:
-                update_row = st.number_input("Row to Update", min_value=2, max_value=int(df_view["Row"].max()), step=1)
-                with st.form("update_expense_form"):
-                    u_date = st.date_input("Date", key="u_date")
-                    u_cat = st.selectbox("Category", ["Flights", "Hotels", "Food", "Transport", "Miscellaneous"], key="u_cat")
-                    u_desc = st.text_input("Description", key="u_desc")
-                    u_amt = st.number_input("Amount", min_value=0.0, format="%.2f", key="u_amt")
-                    u_loc = st.text_input("Location", key="u_loc")
-                    if st.form_submit_button("Update"):
-                        update_expense_with_trip(gsheet, int(update_row), str(u_date), u_cat, u_desc, u_amt, u_loc, trip=active_trip)
-                        st.success(f"Updated expense row {int(update_row)}.")
-
+            suggestion_msg, is_critical = ai_suggestion(score, category, total_spent + amount, curr_budget)
+            ledger_changed(("success", f"✅ Expense added to `{active_trip}`!"),
+                           ("critical" if is_critical else "ai", suggestion_msg))
+
+    expense_form(active_trip, curr_budget)
+
+
+    # --- Bulk import from a bank/card statement ---
+    @metered_fragment
+    def statement_import(active_trip):
+        with st.expander("📥 Import expenses from CSV"):
+            st.caption("Needs date and amount columns; description, category, location, trip and currency are optional. "
+                       f"Rows without a trip go to `{active_trip}`, and expenses already in your ledger are skipped.")
+            upload = st.file_uploader("Statement (CSV)", type=["csv", "txt"], key="import_file")
+            if upload is not None and st.button("Import"):
+                bar = st.progress(0.0, text="Importing...")
+                total_bytes = max(upload.size, 1)
+                report = import_expenses(
+                    store, username, upload, trip=active_trip,
+                    progress=lambda read, written: bar.progress(min(upload.tell() / total_bytes, 1.0),
+                                                                text=f"{read} rows read, {written} imported"),
+                )
+                bar.progress(1.0, text="Done")
+                # Kept in the session so it is still shown after the page redraws with the new expenses.
+                st.session_state.import_report = report
+                if report["imported"]:
+                    # Score the new rows against the whole ledger in one pass, so odd ones can be checked before they
+                    # get lost in it.
+                    flagged = flag_anomalies(store.load_expenses(username))
+                    report["unusual"] = flagged[flagged["is_anomaly"] & flagged["id"].isin(report["ids"])]
+                    ledger_changed()
+            report = st.session_state.get("import_report")
+            if report:
+                st.success(f"Imported {report['imported']} of {report['read']} rows "
+                           f"({report['duplicates']} duplicates and {report['skipped']} credits or blank debits skipped).")
+                if report["errors"]:
+                    st.warning(f"{report['failed']} rows could not be imported.")
+                    st.dataframe(pd.DataFrame(report["errors"], columns=["line", "error"]), hide_index=True)
+                unusual = report.get("unusual")
+                if unusual is not None and not unusual.empty:
+                    st.warning(f"{len(unusual)} imported expenses are unusual for their category; worth a second look.")
+                    st.dataframe(unusual[["date", "description", "category", "amount", "z"]].round({"z": 1}),
+                                 hide_index=True)
+
+    statement_import(active_trip)
+
+    # --- Expense summary and management ---
+    st.markdown("---")
+    trip_to_display = st.session_state.viewing_trip or active_trip
+    st.markdown(f"<h2 style='color:#34495E;'>📊 Expense Summary for <span style='color:#E67E22;'>{trip_to_display}</span></h2>", unsafe_allow_html=True)
+
+    def expense_filters(categories):
+        """Filter and sort controls for the expense table, as query_expenses arguments."""
+        def first_page():
+            st.session_state.expense_page = 1
+
+        col1, col2, col3, col4, col5, col6 = st.columns([1, 1, 2, 2, 1, 1])
+        start = col1.date_input("From", value=None, key="filter_start", on_change=first_page)
+        end = col2.date_input("To", value=None, key="filter_end", on_change=first_page)
+        chosen = col3.multiselect("Categories", categories, key="filter_categories", on_change=first_page)
+        location = col4.text_input("Location contains", key="filter_location", on_change=first_page)
+        split = col5.selectbox("Split", ["All", "Shared", "Not shared"], key="filter_shared", on_change=first_page)
+        sort_by = col6.selectbox("Sort by", QUERY_SORT_KEYS, key="filter_sort", on_change=first_page)
+        return {
+            "start": start, "end": end, "categories": chosen, "location": location.strip() or None,
+            "shared": {"All": None, "Shared": True, "Not shared": False}[split],
+            "sort_by": sort_by, "descending": sort_by in ("date", "amount"),
+        }
+
+    @metered_fragment
+    def expense_summary(trip_to_display, active_trip, curr_budget, report_currency):
+        # Dashboard numbers come from the maintained summary tables, not the raw ledger.
+        category_totals = load_category_totals(trip_to_display)
+        if category_totals.empty:
+            st.info(f"No expenses found for `{trip_to_display}`.")
+            return
+        report_rate = fx.rate(BASE_CURRENCY, report_currency)
+        summary = convert_frame(category_totals, report_currency, fx, columns=["amount"])
+        total_spent_view = summary["amount"].sum()
+        view_budget = curr_budget if trip_to_display == active_trip else load_budget(trip_to_display)
+        outlook = load_forecast(trip_to_display, float(view_budget))
+        view_budget = float(view_budget) * report_rate
+        remaining_view = view_budget - total_spent_view
+
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("🌟 Budget", format_money(view_budget, report_currency))
+        col2.metric("💸 Total Spent", format_money(total_spent_view, report_currency))
+        col3.metric("🎁 Remaining", format_money(max(remaining_view, 0), report_currency))
+        col4.metric("🔥 Burn Rate", f"{format_money(outlook['burn_rate'] * report_rate, report_currency)}/day",
+                    help=f"Weighted toward recent days; plain 7-day average "
+                         f"{format_money(outlook['run_rate'] * report_rate, report_currency)}/day")
+        runs_out = outlook["exhaustion_date"]
+        col5.metric("⏳ Budget Runs Out", runs_out.strftime("%d %b %Y") if runs_out is not None else "—")
+        if runs_out is not None:
+            if outlook["remaining"] <= 0:
+                st.error(f"🚨 Budget ran out on {runs_out:%d %b %Y}.")
+            elif outlook["days_left"] <= FORECAST_WARNING_DAYS:
+                st.warning(f"⚠️ At this pace the budget runs out in {int(outlook['days_left'])} days ({runs_out:%d %b %Y}).")
+
+        # Only the page on screen is loaded; the table and the Manage tab both work on it.
+        filters = expense_filters(list(category_totals["category"]))
+        if "expense_page" not in st.session_state:
+            st.session_state.expense_page = 1
+        page = st.session_state.expense_page
+        df_view, total = store.query_expenses(username, trip=trip_to_display, offset=(page - 1) * QUERY_PAGE_SIZE,
+                                              limit=QUERY_PAGE_SIZE, **filters)
+        pages = max(1, math.ceil(total / QUERY_PAGE_SIZE))
+        if page > pages:
+            st.session_state.expense_page = page = pages
+            df_view, total = store.query_expenses(username, trip=trip_to_display, offset=(page - 1) * QUERY_PAGE_SIZE,
+                                                  limit=QUERY_PAGE_SIZE, **filters)
+        col1, col2 = st.columns([1, 5])
+        col1.number_input("Page", min_value=1, max_value=pages, step=1, key="expense_page")
+        col2.caption(f"{total} matching expenses, page {page} of {pages}")
+
+        tabs = st.tabs(["All Expenses", "Category Breakdown", "Manage Expenses", "Settle Up"])
+
+        with tabs[0]:
+            st.subheader("All Expenses")
+            # Editing below stays in rupees; only this view follows the reporting currency.
+            st.dataframe(convert_frame(df_view, report_currency, fx).drop(columns=["shared_list"], errors="ignore"), height=400)
+
+        with tabs[1]:
+             st.subheader("📊 Category Breakdown (Overall)")
+
+             # Overall category-wise breakdown
+             st.bar_chart(summary.rename(columns={"amount": "Amount"}).set_index("category"))
+
+             summary["% Used"] = (summary["amount"] / view_budget * 100).round(2)
+             summary["Status"] = summary["% Used"].apply(lambda x: "OK ✅" if x <= 30 else "High ⚠️")
+             st.dataframe(summary[["category", "amount", "% Used", "Status"]])
+
+             st.subheader("🔥 Category Run Rates")
+             run_rates = convert_frame(outlook["categories"], report_currency, fx, columns=["spent", "burn_rate", "run_rate"])
+             st.dataframe(run_rates.rename(columns={"burn_rate": "per day (weighted)", "run_rate": "per day (7-day avg)"}))
+
+             st.markdown("---")
+             st.subheader("📅 Daily Category Breakdown")
+
+             # Per-day, per-category totals (date already parsed)
+             daily_totals = cached(("daily_totals", trip_to_display), lambda: store.daily_totals(username, trip_to_display))
+             daily_breakdown = convert_frame(daily_totals, report_currency, fx, columns=["amount"])
+
+             # Pivot to get categories as columns for grouped bar chart
+             pivot_table = daily_breakdown.pivot(index="date", columns="category", values="amount").fillna(0)
+
+             st.bar_chart(pivot_table)
+             st.subheader("📈 Total Daily Spend Trend")
+             daily_total = daily_breakdown.groupby("date")["amount"].sum()
+             st.line_chart(daily_total)
+
+
+        with tabs[2]:
+            labels = {
+                eid: f"{str(d)[:10]} | {c} | {desc} | ₹{amt:,.2f}"
+                for eid, d, c, desc, amt in zip(df_view["id"], df_view["date"], df_view["category"],
+                                                df_view["description"], df_view["amount"])
+            }
+
+            st.subheader("Delete Expenses")
+            with st.expander("Delete Expenses"):
+                to_delete = st.multiselect("Expenses to delete", options=list(labels), format_func=labels.get)
+                if st.button("Delete") and to_delete:
+                    try:
+                        store.delete_expenses(to_delete)
+                    except ValueError:
+                        # Deleted or moved elsewhere since this page was drawn.
+                        ledger_changed(("warning", STALE_ROWS_MESSAGE))
+                    ledger_changed(("success", f"Deleted {len(to_delete)} expense(s)."))
+
+            st.subheader("Edit Expenses")
+            with st.expander("Edit Expenses"):
+                # Plain strings so edits are not limited to the loaded categories.
+                editable = as_text(df_view.set_index("id")[EDITABLE_COLUMNS])
+                # Keyed by the rows shown, so pending edits never carry over to another page.
+                edited = st.data_editor(editable, key=f"expense_editor:{hash(tuple(editable.index))}", height=400)
+                if st.button("Save Changes"):
+                    # A cell cleared in the editor comes back as None; save it as blank.
+                    edited = as_text(edited)
+                    changed = (edited.astype(str) != editable.astype(str)).any(axis=1)
+                    updates = {eid: edited.loc[eid].to_dict() for eid in edited.index[changed]}
+                    if updates:
+                        try:
+                            store.update_expenses(updates)
+                        except ValueError:
+                            ledger_changed(("warning", STALE_ROWS_MESSAGE))
+                        ledger_changed(("success", f"Updated {len(updates)} expense(s)."))
+                    else:
+                        st.info("No changes to save.")
+
+        with tabs[3]:
+            st.subheader("🤝 Settle Up")
+            # Every shared expense on this trip you paid or were split into, whoever paid it.
+            shared = cached(("shared", trip_to_display), lambda: store.load_shared_expenses(username, trip=trip_to_display))
+            shares = expense_shares(shared)
+            if shares.empty:
+                st.info("No shared expenses on this trip.")
+            else:
+                balances = net_balances(shares, by=())
+                mine = balances.loc[balances["person"] == username, "amount"].sum() * report_rate
+                if mine > 0:
+                    st.success(f"You are owed {format_money(mine, report_currency)}.")
+                elif mine < 0:
+                    st.warning(f"You owe {format_money(-mine, report_currency)}.")
+                else:
+                    st.info("You are all square.")
+                plan = settle(balances)
+                st.dataframe(
+                    plan.assign(amount=(plan["amount"] * report_rate).round(2))[["from", "to", "amount"]],
+                    hide_index=True,
+                )
+
+    expense_summary(trip_to_display, active_trip, curr_budget, report_currency)
+
+    # --- Debug panel: what this rerun cost ---
+    if get_setting("debug_panel") or params.get("debug"):
+        with st.sidebar.expander("🔧 Debug: API calls this rerun"):
+            calls = rerun_metrics.summary()
+            if calls:
+                st.dataframe(pd.DataFrame(calls), hide_index=True)
+            else:
+                st.caption("No API calls; everything came from cache.")
+            st.json(dict(rerun_metrics.cache))
@@ -0,0 +1,15 @@
+import os
+
+import streamlit as st
+
+
+def get_setting(name: str, default=None):
+    """Read ``name`` from the ``EXPENSE_<NAME>`` environment variable or Streamlit secrets."""
+    value = os.environ.get(f"EXPENSE_{name.upper()}")
+    if value:
+        return value
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        # No secrets.toml, e.g. when running offline against SQLite.
+        return default
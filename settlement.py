@@ -0,0 +1,88 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+# Money is settled in integer paise so splits always add back up to the total.
+PAISE_PER_RUPEE = 100
+
+
+def to_paise(amounts) -> np.ndarray:
+    return np.rint(np.asarray(amounts, dtype="float64") * PAISE_PER_RUPEE).astype("int64")
+
+
+def expense_shares(df: pd.DataFrame) -> pd.DataFrame:
+    """What each participant owes the payer, one row per ``(expense, participant)``.
+
+    ``df`` is an expense frame (see schema.build_expense_frame). Expenses are
+    split equally between the payer and the people in ``shared_with``, in
+    paise; the few paise that do not divide evenly go to the participants
+    (in name order), so the payer's share and these always add up to the
+    expense's amount.
+    """
+    columns = ["id", "trip", "payer", "participant", "paise"]
+    if df.empty or "shared_list" not in df.columns:
+        return pd.DataFrame(columns=columns)
+    shared = df[df["shared_list"].str.len() > 0]
+    exploded = (
+        shared[["id", "trip", "username", "amount", "shared_list"]]
+        .astype({"trip": object, "username": object})
+        .explode("shared_list")
+        .rename(columns={"username": "payer", "shared_list": "participant"})
+    )
+    exploded = exploded[exploded["participant"] != exploded["payer"]].drop_duplicates(["id", "participant"])
+    exploded = exploded.sort_values(["id", "participant"], kind="stable")
+    people = exploded.groupby("id")["participant"].transform("size").to_numpy() + 1
+    total = to_paise(exploded["amount"])
+    base = total // people
+    rank = exploded.groupby("id").cumcount().to_numpy()
+    exploded["paise"] = base + (rank < total - base * people)
+    return exploded[columns].reset_index(drop=True)
+
+
+def net_balances(shares: pd.DataFrame, by=("trip",)) -> pd.DataFrame:
+    """Net position per person (and per ``by`` group); positive means they are owed money.
+
+    Use ``by=()`` for balances across all trips.
+    """
+    by = list(by)
+    columns = by + ["person", "paise", "amount"]
+    if shares.empty:
+        return pd.DataFrame(columns=columns)
+    owed = shares.groupby(by + ["payer"])["paise"].sum().rename_axis(by + ["person"])
+    owes = shares.groupby(by + ["participant"])["paise"].sum().rename_axis(by + ["person"])
+    net = owed.sub(owes, fill_value=0).astype("int64")
+    out = net[net != 0].reset_index()
+    out["amount"] = out["paise"] / PAISE_PER_RUPEE
+    return out[columns].sort_values(by + ["paise"], ascending=[True] * len(by) + [False]).reset_index(drop=True)
+
+
+def settle(balances) -> pd.DataFrame:
+    """Transfers that clear ``balances`` (person -> paise, summing to zero).
+
+    Greedy over two heaps: the largest debtor pays the largest creditor as
+    much as one of them needs, and whoever is left with a remainder goes
+    back on the heap. That is at most ``people - 1`` transfers in
+    O(n log n), which stays fast for groups of hundreds.
+    """
+    if isinstance(balances, pd.DataFrame):
+        balances = balances.groupby("person")["paise"].sum()
+    pairs = list(balances.items()) if hasattr(balances, "items") else list(balances)
+    creditors = [(-int(p), person) for person, p in pairs if p > 0]
+    debtors = [(int(p), person) for person, p in pairs if p < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        paise = min(-credit, -debt)
+        transfers.append((debtor, creditor, paise))
+        if -credit > paise:
+            heapq.heappush(creditors, (credit + paise, creditor))
+        if -debt > paise:
+            heapq.heappush(debtors, (debt + paise, debtor))
+    plan = pd.DataFrame(transfers, columns=["from", "to", "paise"])
+    plan["amount"] = plan["paise"] / PAISE_PER_RUPEE
+    return plan
+
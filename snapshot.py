@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import CATEGORICAL_COLUMNS, DATE_COLUMNS, NUMERIC_COLUMNS, finish_expense_columns, normalize_header
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = "ledger_snapshot"
+SNAPSHOT_FORMAT = 1
+
+
+class LedgerSnapshot:
+    """Versioned, column-per-file copy of the ledger on local disk.
+
+    Every column is dictionary-encoded: an int32 ``.npy`` of codes, opened
+    memory-mapped, plus a JSON list of the distinct values. ``meta.json``
+    records the header, row count and the sheet revision, which is what a
+    reader validates against the live sheet (a tail sync then checks the
+    last row itself).
+    Versions live in ``v<N>/`` directories and ``CURRENT`` names the
+    complete one, so a crash mid-write never leaves a torn snapshot.
+    """
+
+    def __init__(self, directory: str, meta: dict):
+        self.directory = directory
+        self.meta = meta
+        self._columns = {}
+        self._users = None
+
+    @property
+    def header(self) -> list:
+        return self.meta["header"]
+
+    @property
+    def row_count(self) -> int:
+        return self.meta["row_count"]
+
+    # --- writing ---
+
+    @staticmethod
+    def save(root: str, header: list, rows: list, **meta) -> "LedgerSnapshot":
+        os.makedirs(root, exist_ok=True)
+        current = LedgerSnapshot._current_version(root)
+        version = current + 1
+        directory = os.path.join(root, f"v{version}")
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for idx in range(len(header)):
+            codes, uniques = pd.factorize(np.asarray([row[idx] for row in rows], dtype=object))
+            np.save(os.path.join(directory, f"c{idx}.codes.npy"), codes.astype("int32"))
+            with open(os.path.join(directory, f"c{idx}.values.json"), "w", encoding="utf-8") as f:
+                json.dump([str(v) for v in uniques], f)
+        meta = dict(meta, format=SNAPSHOT_FORMAT, version=version, header=list(header),
+                    row_count=len(rows), saved_at=time.time())
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        tmp = os.path.join(root, "CURRENT.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(version))
+        os.replace(tmp, os.path.join(root, "CURRENT"))
+        if current:
+            shutil.rmtree(os.path.join(root, f"v{current}"), ignore_errors=True)
+        logger.info("Saved ledger snapshot v%d (%d rows).", version, len(rows))
+        return LedgerSnapshot(directory, meta)
+
+    @staticmethod
+    def _current_version(root: str) -> int:
+        try:
+            with open(os.path.join(root, "CURRENT"), encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    # --- reading ---
+
+    @staticmethod
+    def open(root: str):
+        """Open the current snapshot under ``root``, or return None if there is none."""
+        version = LedgerSnapshot._current_version(root)
+        if not version:
+            return None
+        directory = os.path.join(root, f"v{version}")
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            return None
+        return LedgerSnapshot(directory, meta)
+
+    def _column(self, idx: int) -> tuple:
+        if idx not in self._columns:
+            codes = np.load(os.path.join(self.directory, f"c{idx}.codes.npy"), mmap_mode="r")
+            with open(os.path.join(self.directory, f"c{idx}.values.json"), encoding="utf-8") as f:
+                values = json.load(f)
+            self._columns[idx] = (codes, values)
+        return self._columns[idx]
+
+    def distinct(self, idx: int) -> list:
+        """The distinct values stored for column ``idx``."""
+        return list(self._column(idx)[1])
+
+    def rows(self) -> list:
+        """Materialize every row as a list of strings (for seeding the ledger cache)."""
+        columns = []
+        for idx in range(len(self.header)):
+            codes, values = self._column(idx)
+            columns.append(np.asarray(values, dtype=object)[codes].tolist() if len(codes) else [])
+        return [list(row) for row in zip(*columns)] if columns else []
+
+    def row(self, position: int) -> list:
+        """One row as a list of strings."""
+        row = []
+        for idx in range(len(self.header)):
+            codes, values = self._column(idx)
+            row.append(values[codes[position]])
+        return row
+
+    def user_positions(self) -> dict:
+        """Row positions (ascending) per username, grouped from the username codes without decoding a row."""
+        if self._users is None:
+            names = normalize_header(self.header)
+            codes, values = self._column(names.index("username") if "username" in names else 0)
+            codes = np.asarray(codes)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            self._users = {value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(values)}
+        return self._users
+
+    def positions(self, username: str, trip: str = None) -> np.ndarray:
+        """Positions of ``username``'s rows (on ``trip``), found from the codes alone."""
+        positions = self.user_positions().get(username, np.empty(0, dtype=np.int64))
+        if trip:
+            names = normalize_header(self.header)
+            if "trip" not in names:
+                return positions[:0]
+            codes, values = self._column(names.index("trip"))
+            code = values.index(trip) if trip in values else -1
+            positions = positions[np.asarray(codes)[positions] == code]
+        return positions
+
+    def frame(self, columns: list = None, username: str = None, trip: str = None,
+              row_numbers: bool = False) -> pd.DataFrame:
+        """Typed frame of just ``columns`` (default: all), like schema.build_expense_frame.
+
+        ``username``/``trip`` keep one user's rows; ``row_numbers`` adds their
+        sheet ``Row``. Only the requested columns are read, each distinct value
+        is parsed once, and categoricals come straight from the stored codes.
+        """
+        names = normalize_header(self.header)
+        present = list(dict.fromkeys(name for name in names if name))
+        if columns is not None and "amount" in columns:
+            # split_amount falls back to amount, so read the stored one with it.
+            columns = list(columns) + ["split_amount"]
+        wanted = present if columns is None else [name for name in present if name in columns]
+        positions = None if username is None else self.positions(username, trip)
+        data = {}
+        for name in wanted:
+            codes, values = self._column(names.index(name))
+            codes = np.asarray(codes) if positions is None else np.asarray(codes)[positions]
+            if name in CATEGORICAL_COLUMNS:
+                # Stored values are already distinct, so the codes can be used as-is.
+                column = pd.Categorical.from_codes(codes, categories=values).remove_unused_categories()
+                data[name] = column.reorder_categories(sorted(column.categories))
+            elif name in NUMERIC_COLUMNS:
+                parsed = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy("float64")
+                data[name] = parsed[codes]
+            elif name in DATE_COLUMNS:
+                data[name] = pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy()[codes]
+            else:
+                data[name] = np.asarray(values, dtype=object)[codes]
+        data = finish_expense_columns(data)
+        df = pd.DataFrame(data, columns=list(data))
+        if row_numbers:
+            rows = np.arange(self.row_count) if positions is None else positions
+            df["Row"] = np.asarray(rows, dtype="int64") + 2
+        return df
@@ -0,0 +1,603 @@
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+import google_sheets_utils as gsu
+from anomaly import SpendingStats
+from schema import build_expense_frame, split_participants
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Sheet1 header, in column order; schema.build_expense_frame types and renames them on load.
+EXPENSE_COLUMNS = [
+    "username", "date", "category", "description", "amount",
+    "location", "trip", "shared_with", "split amount", "id",
+    "currency", "original amount",
+]
+EDITABLE_COLUMNS = gsu.EDITABLE_COLUMNS
+QUERY_SORT_KEYS = gsu.QUERY_SORT_KEYS
+QUERY_PAGE_SIZE = gsu.QUERY_PAGE_SIZE
+DEFAULT_SQLITE_PATH = "expenses.db"
+
+
+def split_amount(amount, shared_with=None):
+    """Return the stored ``shared_with`` string and the per-person share."""
+    if shared_with:
+        total_people = len(shared_with) + 1  # including payer
+        return ",".join(shared_with), round(float(amount) / total_people, 2)
+    return "", float(amount)
+
+
+class ExpenseStore(ABC):
+    """Everything script.py needs from persistence, independent of where it lives."""
+
+    @abstractmethod
+    def load_expenses(self, username: str, trip: str = None) -> pd.DataFrame:
+        ...
+
+    @abstractmethod
+    def add_expense(self, username, date, category, description, amount, location, trip="General", shared_with=None,
+                    currency=None, original_amount=None) -> str:
+        """Store an expense (``amount`` in rupees) and return its id.
+
+        ``currency`` and ``original_amount`` optionally record what it was
+        entered as, for expenses paid in another currency.
+        """
+
+    def add_expenses(self, expenses: list) -> list:
+        """Store many expenses (dicts of ``add_expense`` arguments) and return their ids."""
+        return [self.add_expense(**expense) for expense in expenses]
+
+    @abstractmethod
+    def query_expenses(self, username: str, trip: str = None, start=None, end=None, categories=None,
+                       location: str = None, shared: bool = None, sort_by: str = "date", descending: bool = False,
+                       offset: int = 0, limit: int = QUERY_PAGE_SIZE) -> tuple:
+        """One page of a user's expenses matching the filters, plus the total match count.
+
+        ``start``/``end`` are inclusive dates, ``categories`` a list,
+        ``location`` a case-insensitive substring and ``shared`` True/False
+        for split/unsplit expenses; ``sort_by`` is one of QUERY_SORT_KEYS.
+        Returns ``(frame, total)``.
+        """
+
+    @abstractmethod
+    def load_all_expenses(self) -> pd.DataFrame:
+        """Every user's expenses in one frame, for batch reports."""
+
+    @abstractmethod
+    def load_budgets(self) -> pd.DataFrame:
+        """All budgets as ``username, trip, budget``; a blank trip is the user's overall budget."""
+
+    @abstractmethod
+    def load_shared_expenses(self, username: str, trip: str = None) -> pd.DataFrame:
+        """Shared expenses ``username`` paid or is split into, whoever paid them (see settlement.py)."""
+
+    @abstractmethod
+    def update_expenses(self, updates: dict) -> None:
+        """Apply ``{expense_id: {column: value}}`` edits in one round trip."""
+
+    @abstractmethod
+    def delete_expenses(self, expense_ids: list) -> None:
+        ...
+
+    def update_expense(self, expense_id, date, category, description, amount, location, trip="General") -> None:
+        self.update_expenses({expense_id: {
+            "date": date, "category": category, "description": description,
+            "amount": amount, "location": location, "trip": trip,
+        }})
+
+    def delete_expense(self, expense_id) -> None:
+        self.delete_expenses([expense_id])
+
+    def dropped_writes(self, since: int = 0) -> list:
+        """Writes accepted earlier but lost since, as ``{"seq", "kind", "worksheet", "error"}`` dicts.
+
+        Only backends that write in the background can lose a write after
+        returning; for the others this is always empty.
+        """
+        return []
+
+    def migrate(self) -> None:
+        """Bring data written by older versions up to date; cheap once done.
+
+        Only the app calls this, so read-only jobs never change the store.
+        SQLite migrates its schema when opened, so by default it is a no-op.
+        """
+
+    @abstractmethod
+    def data_version(self, username: str):
+        """A value that changes whenever ``username``'s expenses do, for caches derived from them."""
+
+    @abstractmethod
+    def get_budget(self, username: str, trip: str = None) -> float:
+        """Budget for ``trip``, falling back to the user's overall budget."""
+
+    @abstractmethod
+    def set_budget(self, username: str, amount: float, trip: str = None) -> None:
+        ...
+
+    @abstractmethod
+    def list_trips(self, username: str) -> list:
+        ...
+
+    @abstractmethod
+    def score_expense(self, username: str, category: str, amount: float, trip: str = None, location: str = None):
+        """How unusual ``amount`` is for this user and category; see anomaly.SpendingStats.score."""
+
+    @abstractmethod
+    def category_totals(self, username: str, trip: str = None) -> pd.DataFrame:
+        """Pre-aggregated ``category, amount, count`` for the summary dashboard."""
+
+    @abstractmethod
+    def daily_totals(self, username: str, trip: str = None) -> pd.DataFrame:
+        """Pre-aggregated ``date, category, amount, count`` with ``date`` as datetime64."""
+
+
+class SheetsStore(ExpenseStore):
+    """The Google Sheets ledger, via the helpers in google_sheets_utils."""
+
+    def __init__(self, sheet=None, write_behind: bool = gsu.WRITE_BEHIND):
+        self.sheet = sheet if sheet is not None else gsu.connect_sheet(write_behind=write_behind)
+
+    def load_expenses(self, username, trip=None):
+        return gsu.load_expense_with_trip(self.sheet, username, trip=trip)
+
+    def add_expense(self, username, date, category, description, amount, location, trip="General", shared_with=None,
+                    currency=None, original_amount=None):
+        return gsu.add_expense_with_trip(self.sheet, username, date, category, description, amount, location,
+                                         trip=trip, shared_with=shared_with,
+                                         currency=currency, original_amount=original_amount)
+
+    def add_expenses(self, expenses):
+        return gsu.add_expenses(self.sheet, expenses)
+
+    def query_expenses(self, username, trip=None, start=None, end=None, categories=None, location=None, shared=None,
+                       sort_by="date", descending=False, offset=0, limit=QUERY_PAGE_SIZE):
+        return gsu.query_expenses(self.sheet, username, trip=trip, start=start, end=end, categories=categories,
+                                  location=location, shared=shared, sort_by=sort_by, descending=descending,
+                                  offset=offset, limit=limit)
+
+    def load_all_expenses(self):
+        return gsu.load_all_expenses(self.sheet)
+
+    def load_budgets(self):
+        return gsu.load_budgets(self.sheet)
+
+    def load_shared_expenses(self, username, trip=None):
+        return gsu.load_shared_expenses(self.sheet, username, trip=trip)
+
+    def update_expenses(self, updates):
+        gsu.update_expenses(self.sheet, updates)
+
+    def delete_expenses(self, expense_ids):
+        gsu.delete_expenses(self.sheet, expense_ids)
+
+    def dropped_writes(self, since=0):
+        return gsu.dropped_writes(since)
+
+    def migrate(self):
+        gsu.migrate_ledger(self.sheet)
+
+    def data_version(self, username):
+        return gsu.data_version(self.sheet, username)
+
+    def get_budget(self, username, trip=None):
+        return gsu.get_budget(self.sheet, username, trip=trip)
+
+    def set_budget(self, username, amount, trip=None):
+        gsu.set_budget(self.sheet, username, amount, trip=trip)
+
+    def list_trips(self, username):
+        return gsu.get_user_trips(self.sheet, username)
+
+    def score_expense(self, username, category, amount, trip=None, location=None):
+        return gsu.score_expense(self.sheet, username, category, amount, trip=trip, location=location)
+
+    def category_totals(self, username, trip=None):
+        return gsu.get_category_totals(self.sheet, username, trip)
+
+    def daily_totals(self, username, trip=None):
+        return gsu.get_daily_totals(self.sheet, username, trip)
+
+
+class SQLiteStore(ExpenseStore):
+    """Local SQLite ledger; per-user queries go through a (username, trip, date) index.
+
+    The primary key doubles as the expense id (and as ``Row`` in loaded frames).
+    Triggers keep the ``category_totals`` and ``daily_totals`` summary tables
+    current on every insert, update and delete, and ``expense_participants``
+    indexes who each shared expense is split with. Spending statistics are built
+    per user on first use and then updated by the write methods.
+    """
+
+    # Expense rows in EXPENSE_COLUMNS order.
+    _ROW_COLUMNS = (
+        "username, date, category, description, amount, location, trip, shared_with, split_amount, CAST(id AS TEXT),"
+        " currency, original_amount"
+    )
+    _ROW_SELECT = f"SELECT {_ROW_COLUMNS} FROM expenses"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            date TEXT,
+            category TEXT,
+            description TEXT,
+            amount REAL NOT NULL DEFAULT 0,
+            location TEXT,
+            trip TEXT NOT NULL DEFAULT 'General',
+            shared_with TEXT NOT NULL DEFAULT '',
+            split_amount REAL,
+            currency TEXT NOT NULL DEFAULT '',
+            original_amount REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_expenses_user_trip_date ON expenses (username, trip, date);
+        CREATE TABLE IF NOT EXISTS expense_participants (
+            participant TEXT NOT NULL,
+            expense_id INTEGER NOT NULL,
+            PRIMARY KEY (participant, expense_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_participants_expense ON expense_participants (expense_id);
+        CREATE TABLE IF NOT EXISTS budgets (
+            username TEXT NOT NULL,
+            trip TEXT NOT NULL DEFAULT '',
+            amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, trip)
+        );
+        CREATE TABLE IF NOT EXISTS category_totals (
+            username TEXT NOT NULL,
+            trip TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, trip, category)
+        );
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            username TEXT NOT NULL,
+            trip TEXT NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, trip, day, category)
+        );
+    """
+
+    # Applied as "{sign}" = + for the new row and - for the old one.
+    _SUMMARY_DELTA = """
+        INSERT INTO category_totals (username, trip, category, amount, count)
+            VALUES ({r}.username, {r}.trip, COALESCE({r}.category, ''), {sign}{r}.amount, {sign}1)
+            ON CONFLICT (username, trip, category)
+            DO UPDATE SET amount = amount + excluded.amount, count = count + excluded.count;
+        INSERT INTO daily_totals (username, trip, day, category, amount, count)
+            VALUES ({r}.username, {r}.trip, substr(COALESCE({r}.date, ''), 1, 10), COALESCE({r}.category, ''),
+                    {sign}{r}.amount, {sign}1)
+            ON CONFLICT (username, trip, day, category)
+            DO UPDATE SET amount = amount + excluded.amount, count = count + excluded.count;
+    """
+    _SUMMARY_PRUNE = """
+        DELETE FROM category_totals WHERE count <= 0;
+        DELETE FROM daily_totals WHERE count <= 0;
+    """
+    TRIGGERS = f"""
+        CREATE TRIGGER IF NOT EXISTS expenses_summary_insert AFTER INSERT ON expenses BEGIN
+            {_SUMMARY_DELTA.format(r="new", sign="")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS expenses_summary_delete AFTER DELETE ON expenses BEGIN
+            {_SUMMARY_DELTA.format(r="old", sign="-")}
+            {_SUMMARY_PRUNE}
+        END;
+        CREATE TRIGGER IF NOT EXISTS expenses_participants_delete AFTER DELETE ON expenses BEGIN
+            DELETE FROM expense_participants WHERE expense_id = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS expenses_summary_update AFTER UPDATE ON expenses BEGIN
+            {_SUMMARY_DELTA.format(r="old", sign="-")}
+            {_SUMMARY_DELTA.format(r="new", sign="")}
+            {_SUMMARY_PRUNE}
+        END;
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._stats = {}
+        # Streamlit serves sessions from several threads; the lock serialises access.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(self.SCHEMA)
+        self._add_missing_columns()
+        self._conn.executescript(self.TRIGGERS)
+        self._rebuild_summaries_if_missing()
+        self._rebuild_participants_if_missing()
+        self._conn.commit()
+        logger.info("Opened SQLite store at %s.", path)
+
+    # Columns added after the first release, for ALTER TABLE on older databases.
+    _LATER_COLUMNS = {"currency": "TEXT NOT NULL DEFAULT ''", "original_amount": "REAL"}
+
+    def _add_missing_columns(self) -> None:
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(expenses)")}
+        for name, decl in self._LATER_COLUMNS.items():
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE expenses ADD COLUMN {name} {decl}")
+                logger.info("Added column %s to the expenses table.", name)
+
+    def _rebuild_summaries_if_missing(self) -> None:
+        """Fill the summary tables for databases created before they existed."""
+        has_summary = self._conn.execute("SELECT 1 FROM category_totals LIMIT 1").fetchone()
+        has_expenses = self._conn.execute("SELECT 1 FROM expenses LIMIT 1").fetchone()
+        if has_summary or not has_expenses:
+            return
+        self._conn.executescript("""
+            INSERT INTO category_totals (username, trip, category, amount, count)
+                SELECT username, trip, COALESCE(category, ''), SUM(amount), COUNT(*)
+                FROM expenses GROUP BY 1, 2, 3;
+            INSERT INTO daily_totals (username, trip, day, category, amount, count)
+                SELECT username, trip, substr(COALESCE(date, ''), 1, 10), COALESCE(category, ''), SUM(amount), COUNT(*)
+                FROM expenses GROUP BY 1, 2, 3, 4;
+        """)
+        logger.info("Rebuilt expense summary tables.")
+
+    def _rebuild_participants_if_missing(self) -> None:
+        """Index the participants of shared expenses stored before the index existed."""
+        if self._conn.execute("SELECT 1 FROM expense_participants LIMIT 1").fetchone():
+            return
+        rows = self._conn.execute("SELECT id, shared_with FROM expenses WHERE shared_with != ''").fetchall()
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO expense_participants (participant, expense_id) VALUES (?, ?)",
+            [(p, expense_id) for expense_id, shared in rows for p in split_participants(shared)],
+        )
+        if rows:
+            logger.info("Indexed participants of %d shared expenses.", len(rows))
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            cur = self._conn.execute(query, params)
+            self._conn.commit()
+            return cur
+
+    def _query(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def _rows_by_ids(self, ids: list) -> list:
+        placeholders = ", ".join("?" * len(ids))
+        return self._query(f"{self._ROW_SELECT} WHERE id IN ({placeholders})", ids)
+
+    def _track(self, rows: list, add: bool) -> None:
+        """Apply written or removed rows to already-built spending statistics."""
+        for row in rows:
+            stats = self._stats.get(row[0])
+            if stats is not None:
+                (stats.add if add else stats.remove)(list(row))
+
+    def load_expenses(self, username, trip=None):
+        query = f"SELECT {self._ROW_COLUMNS}, id FROM expenses WHERE username = ?"
+        params = [username]
+        if trip:
+            query += " AND trip = ?"
+            params.append(trip)
+        query += " ORDER BY date, id"
+        rows = self._query(query, params)
+        return build_expense_frame(EXPENSE_COLUMNS, [row[:-1] for row in rows], [row[-1] for row in rows])
+
+    def add_expense(self, username, date, category, description, amount, location, trip="General", shared_with=None,
+                    currency=None, original_amount=None):
+        shared_str, split_amt = split_amount(amount, shared_with)
+        original = float(original_amount) if currency and original_amount is not None else None
+        with self._lock:
+            cur = self._execute(
+                "INSERT INTO expenses (username, date, category, description, amount, location, trip, shared_with,"
+                " split_amount, currency, original_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (username, date, category, description, float(amount), location, trip, shared_str, split_amt,
+                 currency or "", original),
+            )
+            if shared_str:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO expense_participants (participant, expense_id) VALUES (?, ?)",
+                    [(p, cur.lastrowid) for p in split_participants(shared_str)],
+                )
+                self._conn.commit()
+            self._track(self._rows_by_ids([cur.lastrowid]), add=True)
+        return str(cur.lastrowid)
+
+    def add_expenses(self, expenses):
+        """Insert all of ``expenses`` in one transaction."""
+        with self._lock:
+            ids = []
+            try:
+                for e in expenses:
+                    shared_str, split_amt = split_amount(e["amount"], e.get("shared_with"))
+                    currency = e.get("currency") or ""
+                    original = e.get("original_amount")
+                    cur = self._conn.execute(
+                        "INSERT INTO expenses (username, date, category, description, amount, location, trip,"
+                        " shared_with, split_amount, currency, original_amount) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (e["username"], e["date"], e["category"], e["description"], float(e["amount"]), e["location"],
+                         e.get("trip", "General"), shared_str, split_amt, currency,
+                         float(original) if currency and original is not None else None),
+                    )
+                    ids.append(cur.lastrowid)
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO expense_participants (participant, expense_id) VALUES (?, ?)",
+                        [(p, cur.lastrowid) for p in split_participants(shared_str)],
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            if ids:
+                self._track(self._rows_by_ids(ids), add=True)
+        logger.info("Inserted %d expenses.", len(ids))
+        return [str(i) for i in ids]
+
+    def query_expenses(self, username, trip=None, start=None, end=None, categories=None, location=None, shared=None,
+                       sort_by="date", descending=False, offset=0, limit=QUERY_PAGE_SIZE):
+        if sort_by not in QUERY_SORT_KEYS:
+            raise ValueError(f"Cannot sort by {sort_by!r}; use one of {QUERY_SORT_KEYS}.")
+        # Served from the (username, trip, date) index; the other filters apply to those rows only.
+        where, params = ["username = ?"], [username]
+        if trip:
+            where.append("trip = ?")
+            params.append(trip)
+        if start:
+            where.append("substr(date, 1, 10) >= ?")
+            params.append(str(start)[:10])
+        if end:
+            where.append("substr(date, 1, 10) <= ?")
+            params.append(str(end)[:10])
+        if categories:
+            where.append(f"category IN ({', '.join('?' * len(categories))})")
+            params.extend(categories)
+        if location:
+            escaped = location.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("location LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if shared is not None:
+            where.append("shared_with != ''" if shared else "shared_with = ''")
+        condition = " AND ".join(where)
+        total = self._query(f"SELECT COUNT(*) FROM expenses WHERE {condition}", params)[0][0]
+        order = f"lower({sort_by})" if sort_by in ("category", "location", "description") else sort_by
+        rows = self._query(
+            f"SELECT {self._ROW_COLUMNS}, id FROM expenses WHERE {condition}"
+            f" ORDER BY {order} {'DESC' if descending else 'ASC'}, id LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)],
+        )
+        frame = build_expense_frame(EXPENSE_COLUMNS, [row[:-1] for row in rows], [row[-1] for row in rows])
+        return frame, total
+
+    def load_all_expenses(self):
+        rows = self._query(f"SELECT {self._ROW_COLUMNS}, id FROM expenses ORDER BY username, trip, date, id")
+        return build_expense_frame(EXPENSE_COLUMNS, [row[:-1] for row in rows], [row[-1] for row in rows])
+
+    def load_budgets(self):
+        return pd.DataFrame(self._query("SELECT username, trip, amount FROM budgets"),
+                            columns=["username", "trip", "budget"])
+
+    def load_shared_expenses(self, username, trip=None):
+        query = (
+            f"SELECT {self._ROW_COLUMNS}, id FROM expenses WHERE id IN ("
+            " SELECT id FROM expenses WHERE username = ? AND shared_with != ''"
+            " UNION SELECT expense_id FROM expense_participants WHERE participant = ?)"
+        )
+        params = [username, username]
+        if trip:
+            query += " AND trip = ?"
+            params.append(trip)
+        query += " ORDER BY date, id"
+        rows = self._query(query, params)
+        return build_expense_frame(EXPENSE_COLUMNS, [row[:-1] for row in rows], [row[-1] for row in rows])
+
+    def update_expenses(self, updates):
+        editable = set(EDITABLE_COLUMNS)
+        ids = [int(eid) for eid in updates]
+        if not ids:
+            return
+        with self._lock:
+            rows = self._rows_by_ids(ids)
+            self._track(rows, add=False)
+            shared = {row[9]: row[7] for row in rows}
+            for expense_id, fields in updates.items():
+                fields = {k: v for k, v in fields.items() if k in editable}
+                if "amount" in fields:
+                    fields["amount"] = float(fields["amount"])
+                    # Each participant's share follows the new amount.
+                    _, fields["split_amount"] = split_amount(
+                        fields["amount"], split_participants(shared.get(str(expense_id), "")))
+                if fields:
+                    assignments = ", ".join(f"{col} = ?" for col in fields)
+                    self._conn.execute(f"UPDATE expenses SET {assignments} WHERE id = ?",
+                                       (*fields.values(), int(expense_id)))
+            self._conn.commit()
+            self._track(self._rows_by_ids(ids), add=True)
+
+    def delete_expenses(self, expense_ids):
+        ids = [int(eid) for eid in expense_ids]
+        if not ids:
+            return
+        placeholders = ", ".join("?" * len(ids))
+        with self._lock:
+            self._track(self._rows_by_ids(ids), add=False)
+            self._execute(f"DELETE FROM expenses WHERE id IN ({placeholders})", ids)
+        logger.info("Deleted %d expenses.", len(ids))
+
+    def data_version(self, username):
+        # Our own writes move total_changes; data_version moves when another connection commits.
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0], self._conn.total_changes
+
+    def get_budget(self, username, trip=None):
+        # The trip-specific row, if any, sorts after the overall ('') one.
+        rows = self._query(
+            "SELECT amount FROM budgets WHERE username = ? AND trip IN ('', ?) ORDER BY trip DESC LIMIT 1",
+            (username, trip or ""),
+        )
+        return float(rows[0][0]) if rows else 0.0
+
+    def set_budget(self, username, amount, trip=None):
+        self._execute(
+            "INSERT INTO budgets (username, trip, amount) VALUES (?, ?, ?)"
+            " ON CONFLICT(username, trip) DO UPDATE SET amount = excluded.amount",
+            (username, trip or "", float(amount)),
+        )
+
+    def list_trips(self, username):
+        # Served from the leading columns of the (username, trip, date) index.
+        rows = self._query("SELECT DISTINCT trip FROM expenses WHERE username = ? ORDER BY trip", (username,))
+        return [r[0] for r in rows] or ["General"]
+
+    def score_expense(self, username, category, amount, trip=None, location=None):
+        with self._lock:
+            stats = self._stats.get(username)
+            if stats is None:
+                stats = self._stats[username] = SpendingStats(EXPENSE_COLUMNS)
+                for row in self._query(f"{self._ROW_SELECT} WHERE username = ?", (username,)):
+                    stats.add(list(row))
+            return stats.score(username, category, amount, trip=trip, location=location)
+
+    def category_totals(self, username, trip=None):
+        query = "SELECT category, ROUND(SUM(amount), 2), SUM(count) FROM category_totals WHERE username = ?"
+        params = [username]
+        if trip:
+            query += " AND trip = ?"
+            params.append(trip)
+        query += " GROUP BY category ORDER BY category"
+        return pd.DataFrame(self._query(query, params), columns=["category", "amount", "count"])
+
+    def daily_totals(self, username, trip=None):
+        query = "SELECT day, category, ROUND(SUM(amount), 2), SUM(count) FROM daily_totals WHERE username = ?"
+        params = [username]
+        if trip:
+            query += " AND trip = ?"
+            params.append(trip)
+        query += " GROUP BY day, category ORDER BY day, category"
+        df = pd.DataFrame(self._query(query, params), columns=["date", "category", "amount", "count"])
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        return df
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(write_behind: bool = gsu.WRITE_BEHIND) -> ExpenseStore:
+    """Return the backend named by the ``storage_backend`` setting ("sheets" or "sqlite").
+
+    The setting is read from the ``EXPENSE_STORAGE_BACKEND`` environment
+    variable or Streamlit secrets; ``sqlite_path`` picks the database file.
+    Command-line jobs pass ``write_behind=False`` (see gsu.connect_sheet).
+    """
+    backend = str(get_setting("storage_backend", "sheets")).lower()
+    if backend == "sheets":
+        return SheetsStore(write_behind=write_behind)
+    if backend == "sqlite":
+        path = get_setting("sqlite_path", DEFAULT_SQLITE_PATH)
+        with _stores_lock:
+            if path not in _stores:
+                _stores[path] = SQLiteStore(path)
+            return _stores[path]
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google_sheets_utils as gsu  # noqa: E402
+from benchmarks.fake_gspread import FakeSpreadsheet  # noqa: E402
+from benchmarks.ledger import generate_budgets, generate_ledger  # noqa: E402
+from storage import SheetsStore, SQLiteStore  # noqa: E402
+
+
+def _reset_caches() -> None:
+    gsu.invalidate_ledger()
+    gsu._budgets.invalidate()
+    gsu._connection.reset()
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    """Start every test with empty process-wide caches and no on-disk ledger snapshots."""
+    monkeypatch.setattr(gsu._ledger, "snapshot_dir", None)
+    _reset_caches()
+    yield
+    _reset_caches()
+
+
+@pytest.fixture
+def sheet():
+    """An in-memory spreadsheet holding 300 expenses of 4 users, and their budgets."""
+    ledger = generate_ledger(300, n_users=4, n_trips=2)
+    return FakeSpreadsheet({gsu.SHEET_NAME: ledger, gsu.BUDGET_SHEET: generate_budgets(ledger)})
+
+
+@pytest.fixture(params=["sheets", "sqlite"])
+def store(request, sheet, tmp_path):
+    if request.param == "sheets":
+        return SheetsStore(sheet, write_behind=False)
+    return SQLiteStore(str(tmp_path / "expenses.db"))
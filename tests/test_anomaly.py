@@ -0,0 +1,90 @@
+import random
+import statistics
+
+import pandas as pd
+import pytest
+
+from anomaly import MIN_SAMPLES, RunningStats, SpendingStats, flag_anomalies
+from benchmarks.ledger import generate_ledger
+from schema import build_expense_frame
+
+
+def test_running_stats_remove_matches_rebuild():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(6, 1) for _ in range(300)]
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    removed = set(rng.sample(range(len(values)), 120))
+    for i in removed:
+        stats.remove(values[i])
+
+    kept = [v for i, v in enumerate(values) if i not in removed]
+    assert stats.count == len(kept)
+    assert stats.mean == pytest.approx(statistics.fmean(kept), rel=1e-9)
+    assert stats.std == pytest.approx(statistics.stdev(kept), rel=1e-9)
+
+
+def test_running_stats_remove_down_to_empty():
+    stats = RunningStats()
+    for value in (10.0, 20.0):
+        stats.add(value)
+    stats.remove(10.0)
+    assert (stats.count, stats.mean, stats.std) == (1, 20.0, 0.0)
+    stats.remove(20.0)
+    assert (stats.count, stats.mean, stats.m2) == (0, 0.0, 0.0)
+
+
+def test_spending_stats_remove_matches_rebuild():
+    ledger = generate_ledger(3000, n_users=3, n_trips=2)
+    header, rows = ledger[0], ledger[1:]
+    rng = random.Random(11)
+    removed = set(rng.sample(range(len(rows)), 1000))
+    kept = [row for i, row in enumerate(rows) if i not in removed]
+
+    incremental = SpendingStats(header)
+    for row in rows:
+        incremental.add(row)
+    for i in sorted(removed):
+        incremental.remove(rows[i])
+    rebuilt = SpendingStats(header)
+    for row in kept:
+        rebuilt.add(row)
+
+    for username, _, category, _, amount, location, trip, *_ in rows[:200]:
+        for scope in ({}, {"trip": trip}, {"location": location}, {"trip": trip, "location": location}):
+            got = incremental.score(username, category, float(amount), **scope)
+            want = rebuilt.score(username, category, float(amount), **scope)
+            if want is None:
+                assert got is None
+                continue
+            assert (got["scope"], got["count"]) == (want["scope"], want["count"])
+            assert got["mean"] == pytest.approx(want["mean"], rel=1e-9)
+            assert got["z"] == pytest.approx(want["z"], rel=1e-6, abs=1e-9)
+
+
+def test_score_needs_enough_history():
+    header = ["username", "category", "amount"]
+    stats = SpendingStats(header)
+    for amount in range(MIN_SAMPLES - 1):
+        stats.add(["amy", "Food", str(100 + amount)])
+    assert stats.score("amy", "Food", 500) is None
+    stats.add(["amy", "Food", "104"])
+    assert stats.score("amy", "Food", 500)["scope"] == "user"
+
+
+def test_flag_anomalies_matches_per_group_zscores():
+    ledger = generate_ledger(2000, n_users=4, n_trips=2)
+    df = build_expense_frame(ledger[0], ledger[1:])
+    df.loc[5, "amount"] = df["amount"].max() * 50
+
+    flagged = flag_anomalies(df)
+
+    assert bool(flagged.loc[5, "is_anomaly"])
+    for (_, _), group in df.groupby(["username", "category"], observed=True):
+        z = flagged.loc[group.index, "z"]
+        if len(group) < MIN_SAMPLES:
+            assert z.isna().all()
+            continue
+        want = (group["amount"] - group["amount"].mean()) / group["amount"].std()
+        pd.testing.assert_series_equal(z, want, check_names=False)
@@ -0,0 +1,80 @@
+import datetime
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forecast import BURN_WINDOW_DAYS, EWM_HALFLIFE_DAYS, forecast_frame, forecast_trip
+
+TODAY = datetime.date(2024, 3, 31)
+# Rates are rounded to paise.
+ROUNDING = 0.005 + 1e-9
+
+
+def _daily(seed: int = 5) -> pd.DataFrame:
+    """Sparse daily totals for two trips: one still running, one that went quiet weeks ago."""
+    rng = random.Random(seed)
+    rows = []
+    for username, trip, first, last in (("amy", "Goa", datetime.date(2024, 3, 1), TODAY),
+                                        ("bob", "Kochi", datetime.date(2024, 1, 10), datetime.date(2024, 2, 5))):
+        day = first
+        while day <= last:
+            for category in ("Food", "Hotels"):
+                if rng.random() < 0.4:
+                    rows.append((username, trip, pd.Timestamp(day), category, round(rng.uniform(50, 5000), 2)))
+            day += datetime.timedelta(days=rng.choice((1, 1, 2, 4)))
+    return pd.DataFrame(rows, columns=["username", "trip", "date", "category", "amount"])
+
+
+def _series(daily: pd.DataFrame, start) -> pd.Series:
+    """The zero-filled daily spend from ``start`` (the trip's first expense) through today."""
+    return daily.groupby("date")["amount"].sum().reindex(pd.date_range(start, TODAY), fill_value=0.0)
+
+
+def test_rates_match_pandas_ewm_and_rolling():
+    daily = _daily()
+    budgets = pd.DataFrame([("amy", "", 100000.0), ("bob", "Kochi", 50000.0)], columns=["username", "trip", "budget"])
+
+    trips, categories = forecast_frame(daily, budgets, today=TODAY)
+
+    for trip in trips.itertuples(index=False):
+        mine = daily[(daily["username"] == trip.username) & (daily["trip"] == trip.trip)]
+        start = mine["date"].min()
+        series = _series(mine, start)
+        assert trip.spent == pytest.approx(mine["amount"].sum(), abs=ROUNDING)
+        assert trip.burn_rate == pytest.approx(series.ewm(halflife=EWM_HALFLIFE_DAYS).mean().iloc[-1], abs=ROUNDING)
+        assert trip.run_rate == pytest.approx(
+            series.rolling(BURN_WINDOW_DAYS, min_periods=1).mean().iloc[-1], abs=ROUNDING)
+        for category in categories[categories["username"] == trip.username].itertuples(index=False):
+            series = _series(mine[mine["category"] == category.category], start)
+            assert category.burn_rate == pytest.approx(
+                series.ewm(halflife=EWM_HALFLIFE_DAYS).mean().iloc[-1], abs=ROUNDING)
+            assert category.run_rate == pytest.approx(
+                series.rolling(BURN_WINDOW_DAYS, min_periods=1).mean().iloc[-1], abs=ROUNDING)
+
+
+def test_exhaustion_projects_the_burn_rate():
+    daily = _daily()
+    amy = daily[daily["username"] == "amy"].drop(columns=["username", "trip"])
+    spent = amy["amount"].sum()
+
+    result = forecast_trip(amy, spent + 1000.0, today=TODAY)
+
+    assert result["remaining"] == pytest.approx(1000.0, abs=ROUNDING)
+    assert result["days_left"] == pytest.approx(result["remaining"] / result["burn_rate"])
+    expected = pd.Timestamp(TODAY) + pd.Timedelta(days=int(np.floor(result["days_left"])))
+    assert result["exhaustion_date"] == expected
+    assert list(result["categories"]["burn_rate"]) == sorted(result["categories"]["burn_rate"], reverse=True)
+
+
+def test_exhausted_budget_reports_the_day_it_ran_out():
+    daily = _daily()
+    amy = daily[daily["username"] == "amy"].drop(columns=["username", "trip"])
+    by_day = amy.groupby("date")["amount"].sum().cumsum()
+    budget = by_day.iloc[len(by_day) // 2]
+
+    result = forecast_trip(amy, budget, today=TODAY)
+
+    assert result["days_left"] == 0
+    assert result["exhaustion_date"] == by_day[by_day >= budget].index[0]
@@ -0,0 +1,23 @@
+import pytest
+
+from importer import parse_amount
+
+
+@pytest.mark.parametrize("text, amount", [
+    ("300", 300.0),
+    ("Rs. 300", 300.0),
+    ("Rs.300", 300.0),
+    ("INR 1,200.50", 1200.5),
+    ("₹1,00,000", 100000.0),
+    ("-300", -300.0),
+    ("(300.25)", -300.25),
+    ("300 CR", -300.0),
+])
+def test_parse_amount(text, amount):
+    assert parse_amount(text) == amount
+
+
+@pytest.mark.parametrize("text", ["1.200,50", "300,50", "12/05 300", "", "n/a"])
+def test_parse_amount_refuses_what_it_cannot_read_safely(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
@@ -0,0 +1,20 @@
+import pytest
+
+import instrumentation
+from instrumentation import current_rerun, metered_rerun
+
+
+def test_rerun_is_unset_even_when_cut_short(monkeypatch):
+    finished = []
+    monkeypatch.setattr(instrumentation.registry, "add_rerun", finished.append)
+
+    with pytest.raises(RuntimeError):
+        with metered_rerun("amy@example.com", path=None):
+            raise RuntimeError("st.stop()")
+    assert current_rerun() is None
+    assert finished == []
+
+    with metered_rerun("amy@example.com", path=None) as run:
+        assert current_rerun() is run
+    assert current_rerun() is None
+    assert finished == [run]
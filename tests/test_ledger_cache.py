@@ -0,0 +1,67 @@
+import google_sheets_utils as gsu
+from google_sheets_utils import LedgerCache
+
+
+def _stale_cache() -> LedgerCache:
+    # A negative TTL makes every read after the first one sync with the sheet.
+    return LedgerCache(ttl=-1, snapshot_dir=None)
+
+
+def _sheet_rows(sheet) -> list:
+    width = len(sheet._worksheets[gsu.SHEET_NAME].rows[0])
+    return [[str(v) for v in row] + [""] * (width - len(row)) for row in sheet._worksheets[gsu.SHEET_NAME].rows[1:]]
+
+
+def test_tail_sync_reads_only_appended_rows(sheet):
+    cache = _stale_cache()
+    _, rows, _ = cache.all_rows(sheet)
+    appended = list(rows[0][:10])
+    appended[9] = "appended-elsewhere"
+    sheet._worksheets[gsu.SHEET_NAME].rows.append(appended)
+    sheet.api.reset()
+
+    _, synced, numbers = cache.all_rows(sheet)
+
+    assert sheet.api.calls["get"] == 1
+    assert sheet.api.calls["get_all_values"] == 0
+    assert synced == _sheet_rows(sheet)
+    assert numbers[-1] == len(synced) + 1
+    assert cache.rows_for_ids(sheet, ["appended-elsewhere"]) == {"appended-elsewhere": len(synced) + 1}
+
+
+def test_tail_sync_without_new_rows_reads_one_row(sheet):
+    cache = _stale_cache()
+    cache.all_rows(sheet)
+    sheet.api.reset()
+
+    cache.all_rows(sheet)
+
+    assert sheet.api.calls["get"] == 1
+    assert sheet.api.cells_read <= len(sheet._worksheets[gsu.SHEET_NAME].rows[0])
+
+
+def test_external_delete_forces_full_resync(sheet):
+    cache = _stale_cache()
+    _, rows, _ = cache.all_rows(sheet)
+    gone = rows[5][9]
+    del sheet._worksheets[gsu.SHEET_NAME].rows[6]
+    sheet.api.reset()
+
+    _, synced, _ = cache.all_rows(sheet)
+
+    assert sheet.api.calls["get_all_values"] == 1
+    assert synced == _sheet_rows(sheet)
+    assert cache.rows_for_ids(sheet, [gone]) == {}
+    assert cache.rows_for_ids(sheet, [rows[6][9]]) == {rows[6][9]: 7}
+
+
+def test_external_edit_of_last_row_forces_full_resync(sheet):
+    cache = _stale_cache()
+    cache.all_rows(sheet)
+    sheet._worksheets[gsu.SHEET_NAME].rows[-1][4] = "1.0"
+    sheet.api.reset()
+
+    _, synced, _ = cache.all_rows(sheet)
+
+    assert sheet.api.calls["get_all_values"] == 1
+    assert synced[-1][4] == "1.0"
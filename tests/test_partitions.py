@@ -0,0 +1,29 @@
+import pytest
+
+import google_sheets_utils as gsu
+from google_sheets_utils import PartitionCatalog
+
+
+def test_missing_catalog_is_not_looked_up_again(sheet):
+    catalog = PartitionCatalog(ttl=-1)
+    assert catalog.partitions(sheet) == []
+    sheet.api.reset()
+
+    for _ in range(3):
+        assert catalog.partitions(sheet) == []
+    assert sheet.api.calls["worksheet"] == 0
+
+    catalog.record(sheet, [{"partition": "Archive 2024", "username": "amy@example.com", "trip": "Goa"}])
+    sheet.api.reset()
+    assert catalog.partition(sheet, "amy@example.com", "Goa") == "Archive 2024"
+    assert sheet.api.calls["get_all_values"] == 1
+
+
+def test_row_based_helpers_are_deprecated(sheet):
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    eid = ws.rows[2][9]
+
+    with pytest.warns(DeprecationWarning, match="delete_expenses"):
+        gsu.delete_expense(sheet, 3)
+
+    assert eid not in [row[9] for row in ws.rows]
@@ -0,0 +1,50 @@
+import pandas as pd
+
+from benchmarks.ledger import generate_ledger
+from schema import build_expense_frame
+from settlement import expense_shares, net_balances, settle, to_paise
+
+
+def _frame(n_rows: int = 2000):
+    ledger = generate_ledger(n_rows, n_users=12, n_trips=3)
+    return build_expense_frame(ledger[0], ledger[1:])
+
+
+def test_expense_shares_leave_the_payer_an_equal_share():
+    df = _frame()
+    shares = expense_shares(df)
+    totals = pd.Series(to_paise(df["amount"]), index=df["id"])
+    owed = shares.groupby("id")["paise"]
+    people = owed.size() + 1
+    payer_share = totals[owed.sum().index] - owed.sum()
+    # Everyone's share, the payer's included, is the total split as evenly as paise allow.
+    assert (payer_share >= 0).all()
+    assert ((owed.max() - payer_share).isin([0, 1])).all()
+    assert ((owed.max() - owed.min()) <= 1).all()
+    assert (payer_share + owed.sum() == totals[people.index]).all()
+
+
+def test_net_balances_sum_to_zero():
+    shares = expense_shares(_frame())
+
+    per_trip = net_balances(shares)
+    overall = net_balances(shares, by=())
+
+    assert (per_trip.groupby("trip")["paise"].sum() == 0).all()
+    assert overall["paise"].sum() == 0
+    assert overall["paise"].dtype == "int64"
+
+
+def test_settle_clears_every_balance():
+    balances = net_balances(expense_shares(_frame()), by=())
+
+    plan = settle(balances)
+
+    left = balances.set_index("person")["paise"].to_dict()
+    for payer, payee, paise in plan[["from", "to", "paise"]].itertuples(index=False):
+        assert paise > 0
+        left[payer] += paise
+        left[payee] -= paise
+    assert set(left.values()) == {0}
+    assert len(plan) <= len(balances) - 1
+
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+import google_sheets_utils as gsu
+from google_sheets_utils import LedgerCache
+
+
+@pytest.fixture
+def snapshotted(sheet, tmp_path):
+    """A warm cache that has written its snapshot, and a cold one (a fresh process) opening it."""
+    warm = LedgerCache(snapshot_dir=str(tmp_path))
+    warm.all_rows(sheet)
+    sheet.api.reset()
+    return warm, LedgerCache(snapshot_dir=str(tmp_path))
+
+
+def _users_and_trips(sheet) -> list:
+    rows = sheet._worksheets[gsu.SHEET_NAME].rows[1:]
+    return sorted({(row[0], row[6]) for row in rows})
+
+
+def test_cold_start_reads_user_frames_from_the_snapshot(sheet, snapshotted):
+    warm, cold = snapshotted
+
+    for username, trip in _users_and_trips(sheet):
+        for scope in (None, trip):
+            pd.testing.assert_frame_equal(cold.user_frame(sheet, username, trip=scope),
+                                          warm.user_frame(sheet, username, trip=scope))
+        pd.testing.assert_frame_equal(cold.user_frame(sheet, username, columns=["trip", "amount"]),
+                                      warm.user_frame(sheet, username, columns=["trip", "amount"]))
+
+    assert sheet.api.calls["get_all_values"] == 0
+    assert cold._entries[sheet.id]["snapshot"] is not None
+
+
+def test_cold_start_totals_match_the_running_aggregates(sheet, snapshotted):
+    warm, cold = snapshotted
+
+    for username, trip in _users_and_trips(sheet):
+        for scope in (None, trip):
+            pd.testing.assert_frame_equal(cold.category_totals(sheet, username, scope),
+                                          warm.category_totals(sheet, username, scope), check_exact=False)
+            pd.testing.assert_frame_equal(cold.daily_totals(sheet, username, scope),
+                                          warm.daily_totals(sheet, username, scope), check_exact=False)
+
+    assert cold._entries[sheet.id]["snapshot"] is not None
+
+
+def test_writes_decode_the_snapshot_first(sheet, snapshotted):
+    warm, cold = snapshotted
+    username = _users_and_trips(sheet)[0][0]
+    cold.user_frame(sheet, username)
+
+    _, rows, _ = cold.all_rows(sheet)
+    cold.append(sheet, rows[0])
+
+    assert cold._entries[sheet.id]["snapshot"] is None
+    assert len(cold.user_frame(sheet, username)) == len(warm.user_frame(sheet, username)) + (rows[0][0] == username)
+    assert cold.rows_for_ids(sheet, [rows[3][9]]) == {rows[3][9]: 5}
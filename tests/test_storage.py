@@ -0,0 +1,55 @@
+import pandas as pd
+
+from storage import SQLiteStore
+
+USER = "amy@example.com"
+
+
+def _expense(trip: str, category: str, amount: float, date: str = "2024-05-01") -> dict:
+    return {"username": USER, "date": date, "category": category, "description": f"{category} on {trip}",
+            "amount": amount, "location": "Goa", "trip": trip}
+
+
+def test_load_filters_by_user_and_trip(store):
+    store.add_expenses([_expense("Goa", "Food", 100.0), _expense("Kochi", "Hotels", 900.0),
+                        _expense("Goa", "Fuel", 50.0, date="2024-05-02")])
+
+    goa = store.load_expenses(USER, trip="Goa")
+    everything = store.load_expenses(USER)
+
+    assert list(goa["category"].astype(str)) == ["Food", "Fuel"]
+    assert sorted(everything["trip"].astype(str)) == ["Goa", "Goa", "Kochi"]
+    assert set(everything["username"].astype(str)) == {USER}
+    assert sorted(store.list_trips(USER)) == ["Goa", "Kochi"]
+    assert store.list_trips("nobody@example.com") == ["General"]
+
+
+def test_budget_falls_back_to_the_overall_one(store):
+    store.set_budget(USER, 5000.0)
+    store.set_budget(USER, 800.0, trip="Goa")
+
+    assert store.get_budget(USER, trip="Goa") == 800.0
+    assert store.get_budget(USER, trip="Kochi") == 5000.0
+    assert store.get_budget(USER) == 5000.0
+
+
+def test_totals_follow_every_write(store):
+    ids = store.add_expenses([_expense("Goa", "Food", 100.0), _expense("Goa", "Food", 40.0),
+                              _expense("Goa", "Fuel", 60.0)])
+    version = store.data_version(USER)
+
+    store.update_expenses({ids[0]: {"amount": 150.0}})
+    store.delete_expense(ids[2])
+
+    totals = store.category_totals(USER, "Goa")
+    assert totals.to_dict("records") == [{"category": "Food", "amount": 190.0, "count": 2}]
+    daily = store.daily_totals(USER, "Goa")
+    assert list(daily["date"]) == [pd.Timestamp("2024-05-01")]
+    assert store.data_version(USER) != version
+
+
+def test_sqlite_user_queries_use_the_index(tmp_path):
+    store = SQLiteStore(str(tmp_path / "expenses.db"))
+    plan = store._query("EXPLAIN QUERY PLAN SELECT * FROM expenses WHERE username = ? AND trip = ?", (USER, "Goa"))
+
+    assert any("idx_expenses_user_trip_date" in str(step) for step in plan)
@@ -0,0 +1,111 @@
+import google_sheets_utils as gsu
+from benchmarks.fake_gspread import FakeSpreadsheet
+from benchmarks.ledger import generate_ledger
+from storage import SheetsStore
+
+USER = "amy@example.com"
+
+
+def _expense(description: str, amount: float, shared_with=None) -> dict:
+    return {"username": USER, "date": "2024-05-01", "category": "Food", "description": description,
+            "amount": amount, "location": "Goa", "trip": "Trip 1", "shared_with": shared_with}
+
+
+def _reload(store):
+    # Read back from the backend rather than the write-through ledger cache.
+    gsu.invalidate_ledger()
+    return store.load_expenses(USER).set_index("id")
+
+
+def test_update_and_delete_address_expenses_by_id(store):
+    ids = store.add_expenses([
+        _expense("first", 100.0),
+        _expense("second", 200.0),
+        _expense("third", 300.0, shared_with=["bob@example.com", "cat@example.com"]),
+    ])
+
+    # Deleting the first moves the others up a row; the update must still find "third".
+    store.delete_expense(ids[0])
+    store.update_expenses({ids[2]: {"amount": 600, "description": "dinner"}})
+
+    df = _reload(store)
+    assert list(df.index) == [str(eid) for eid in ids[1:]]
+    second, third = df.loc[str(ids[1])], df.loc[str(ids[2])]
+    assert (second["description"], second["amount"], second["split_amount"]) == ("second", 200.0, 200.0)
+    assert (third["description"], third["amount"]) == ("dinner", 600.0)
+    assert third["split_amount"] == 200.0
+    assert third["category"] == "Food" and third["location"] == "Goa"
+
+
+def test_update_keeps_other_users_rows(store):
+    others_before = store.load_all_expenses()
+    others_before = others_before[others_before["username"] != USER].set_index("id")
+    [eid] = store.add_expenses([_expense("only", 50.0)])
+
+    store.update_expense(eid, "2024-05-03", "Transport", "cab", 75.0, "Goa", "Trip 1")
+    store.delete_expenses([])
+
+    gsu.invalidate_ledger()
+    df = store.load_all_expenses().set_index("id")
+    mine = df.loc[str(eid)]
+    assert (mine["description"], mine["amount"], mine["category"]) == ("cab", 75.0, "Transport")
+    others = df[df["username"] != USER]
+    assert others["amount"].to_dict() == others_before["amount"].to_dict()
+
+
+def test_delete_many_across_the_ledger(store):
+    ids = store.add_expenses([_expense(f"e{i}", 10.0 + i) for i in range(6)])
+
+    store.delete_expenses([ids[1], ids[4], ids[5]])
+
+    df = _reload(store)
+    assert list(df["description"]) == ["e0", "e2", "e3"]
+
+
+def _legacy_sheet():
+    """A ledger from before expense ids: nine columns, and no spare column in the grid."""
+    sheet = FakeSpreadsheet({gsu.SHEET_NAME: [row[:9] for row in generate_ledger(50, n_users=3)]})
+    sheet._worksheets[gsu.SHEET_NAME].col_count = 9
+    return sheet
+
+
+def test_reads_leave_a_legacy_sheet_alone():
+    sheet = _legacy_sheet()
+    store = SheetsStore(sheet, write_behind=False)
+    username = sheet._worksheets[gsu.SHEET_NAME].rows[1][0]
+
+    store.load_all_expenses()
+    store.load_expenses(username)
+    store.category_totals(username)
+
+    assert sheet.api.revision == 0
+
+
+def test_migration_adds_ids_and_grows_the_grid():
+    sheet = _legacy_sheet()
+    store = SheetsStore(sheet, write_behind=False)
+
+    store.migrate()
+
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    assert ws.rows[0][9] == "id"
+    ids = [row[9] for row in ws.rows[1:]]
+    assert all(ids) and len(set(ids)) == len(ids)
+    writes = sheet.api.revision
+    gsu.invalidate_ledger()
+    store.migrate()
+    assert sheet.api.revision == writes
+
+
+def test_first_write_migrates_a_legacy_sheet():
+    sheet = _legacy_sheet()
+    store = SheetsStore(sheet, write_behind=False)
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    username = ws.rows[1][0]
+
+    [eid] = store.add_expenses([_expense("new", 10.0)])
+    old_id = ws.rows[1][9]
+    store.update_expenses({old_id: {"description": "renamed"}})
+
+    assert ws.rows[-1][9] == eid
+    assert ws.rows[1][3] == "renamed" and ws.rows[1][0] == username
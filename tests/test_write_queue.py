@@ -0,0 +1,162 @@
+import json
+
+import gspread
+import pytest
+
+import google_sheets_utils as gsu
+import write_queue
+from write_queue import JournalLockedError, WriteBehindQueue
+
+ID_COL = 9
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "LINGER_SECONDS", 0)
+    return str(tmp_path / "pending_writes.jsonl")
+
+
+def _queue(sheet, journal, **kwargs) -> WriteBehindQueue:
+    return WriteBehindQueue(lambda title: sheet._worksheets[title], journal_path=journal, **kwargs)
+
+
+def _expense(eid: str) -> list:
+    return ["amy@example.com", "2024-05-01", "Food", "lunch", "250.0", "Goa", "Trip 1", "", "250.0", eid]
+
+
+def _journal_lines(journal) -> list:
+    with open(journal, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_unacknowledged_writes_are_replayed(sheet, journal):
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    before = len(ws.rows)
+    queue = _queue(sheet, journal)
+    queue.submit("append", gsu.SHEET_NAME, _expense("a"))
+    queue.submit("append", gsu.SHEET_NAME, _expense("b"))
+    # The process dies before the worker sends anything.
+    queue.stop()
+    assert len(ws.rows) == before
+    assert [op["seq"] for op in _journal_lines(journal)] == [1, 2]
+
+    queue = _queue(sheet, journal).start()
+    assert [op["values"][ID_COL] for op in queue.pending()] == ["a", "b"]
+    assert queue.flush(timeout=5)
+    queue.stop()
+
+    assert [row[ID_COL] for row in ws.rows[-2:]] == ["a", "b"]
+    assert sheet.api.calls["append_rows"] == 1
+    assert _journal_lines(journal) == []
+
+
+def test_acknowledged_ops_are_not_replayed(sheet, journal):
+    ops = [{"seq": seq, "kind": "append", "worksheet": gsu.SHEET_NAME, "values": _expense(eid)}
+           for seq, eid in ((1, "a"), (2, "b"), (3, "c"))]
+    with open(journal, "w", encoding="utf-8") as f:
+        for record in ops + [{"ack": 1}, {"ack": 3}]:
+            f.write(json.dumps(record) + "\n")
+        # A crash mid-write leaves a torn last line; that op was never acknowledged to its caller.
+        f.write('{"seq": 4, "kind": "app')
+
+    queue = _queue(sheet, journal)
+    try:
+        assert [op["seq"] for op in queue.pending()] == [2]
+        # The journal is compacted to what is still pending, and numbering carries on after it.
+        assert _journal_lines(journal) == [ops[1]]
+        assert queue.submit("append", gsu.SHEET_NAME, _expense("d")) == 4
+    finally:
+        queue.stop()
+
+
+def test_journal_has_one_owner(sheet, journal):
+    queue = _queue(sheet, journal)
+    try:
+        with pytest.raises(JournalLockedError):
+            _queue(sheet, journal)
+    finally:
+        queue.stop()
+    _queue(sheet, journal).stop()
+
+
+class _Refused:
+    status_code = 401
+    text = "Request had invalid authentication credentials."
+
+    def json(self):
+        return {"error": {"code": 401, "message": self.text, "status": "UNAUTHENTICATED"}}
+
+
+def test_revoked_credentials_are_given_up_on(sheet, journal, monkeypatch):
+    monkeypatch.setattr(write_queue, "backoff_delay", lambda attempt: 0.0)
+    reconnects = []
+
+    def get_worksheet(title):
+        raise gspread.exceptions.APIError(_Refused())
+
+    queue = WriteBehindQueue(get_worksheet, journal_path=journal, on_auth_error=lambda: reconnects.append(1))
+    seq = queue.submit("append", gsu.SHEET_NAME, _expense("a"))
+    queue.start()
+    assert queue.flush(timeout=5)
+    queue.stop()
+
+    assert len(reconnects) == write_queue.MAX_AUTH_RETRIES
+    assert [record["seq"] for record in queue.dropped()] == [seq]
+    assert _journal_lines(journal) == []
+
+
+def _locate(ws):
+    def locate(title, expense_ids):
+        return {row[ID_COL]: number for number, row in enumerate(ws.rows, start=1) if row[ID_COL] in expense_ids}
+    return locate
+
+
+def test_replay_skips_appends_that_reached_the_sheet(sheet, journal):
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    queue = _queue(sheet, journal)
+    queue.submit("append", gsu.SHEET_NAME, _expense("written"), expense_id="written")
+    queue.submit("append", gsu.SHEET_NAME, _expense("lost"), expense_id="lost")
+    queue.stop()
+    # The first append went out, but the process died before acknowledging it.
+    ws.rows.append(_expense("written"))
+
+    queue = _queue(sheet, journal, locate=_locate(ws)).start()
+    assert queue.flush(timeout=5)
+    queue.stop()
+
+    ids = [row[ID_COL] for row in ws.rows]
+    assert ids.count("written") == 1
+    assert ids.count("lost") == 1
+    assert _journal_lines(journal) == []
+
+
+def test_update_follows_its_expense_when_rows_move(sheet, journal):
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    eid = ws.rows[10][ID_COL]
+    queue = _queue(sheet, journal, locate=_locate(ws))
+    queue.submit("update", gsu.SHEET_NAME, [["2024-05-02", "Hotels", "moved", 999.0, "Kochi", "Trip 2"]],
+                 range_name="B{row}:G{row}", expense_id=eid)
+    # A row above it is deleted before the update goes out.
+    del ws.rows[3]
+    queue.start()
+    assert queue.flush(timeout=5)
+    queue.stop()
+
+    row = next(row for row in ws.rows if row[ID_COL] == eid)
+    assert [str(v) for v in row[1:7]] == ["2024-05-02", "Hotels", "moved", "999.0", "Kochi", "Trip 2"]
+    assert queue.dropped() == []
+
+
+def test_update_of_deleted_expense_is_dropped_and_reported(sheet, journal):
+    ws = sheet._worksheets[gsu.SHEET_NAME]
+    dropped = []
+    queue = _queue(sheet, journal, locate=_locate(ws), on_drop=lambda batch, error: dropped.extend(batch))
+    seq = queue.submit("update", gsu.SHEET_NAME, [["x"]], range_name="D{row}", expense_id="no-such-expense")
+    queue.start()
+    assert queue.flush(timeout=5)
+    queue.stop()
+
+    assert [op["seq"] for op in dropped] == [seq]
+    assert [(record["seq"], record["kind"]) for record in queue.dropped()] == [(seq, "update")]
+    assert queue.dropped(since=seq) == []
+    assert _journal_lines(journal) == []
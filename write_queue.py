@@ -0,0 +1,325 @@
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import gspread
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to an exclusive-create lock file.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+WRITE_JOURNAL = "pending_writes.jsonl"
+# Rows or ranges sent in a single append_rows / batch_update call.
+MAX_BATCH = 500
+# Wait this long after the first queued write so a burst goes out as one call.
+LINGER_SECONDS = 0.5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 64.0
+RETRYABLE_STATUS = {401, 408, 429, 500, 502, 503, 504}
+# Ops rejected for good that are kept for ``dropped``; older ones are forgotten.
+MAX_DROPPED = 100
+# A batch still refused with 401 after this many reconnects is given up on: the credential is revoked, not expired.
+MAX_AUTH_RETRIES = 3
+
+
+class JournalLockedError(RuntimeError):
+    """Another process owns the write journal."""
+
+
+def _lock_journal(journal_path: str) -> int:
+    """Take the journal's lock file; the lock is released when the returned fd is closed (or the process dies)."""
+    lock_path = journal_path + ".lock"
+    if fcntl is not None:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise JournalLockedError(f"{journal_path} is in use by another process.")
+    else:
+        try:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            raise JournalLockedError(
+                f"{journal_path} is in use by another process (delete {lock_path} if none is running).")
+    os.write(fd, f"{os.getpid()}\n".encode())
+    return fd
+
+
+def _status(e: Exception):
+    response = getattr(e, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, gspread.exceptions.APIError):
+        return _status(e) in RETRYABLE_STATUS
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class WriteBehindQueue:
+    """Journals sheet mutations locally and writes them from a background thread.
+
+    Each op is fsync'd to an append-only JSON-lines journal before ``submit``
+    returns; the worker later acknowledges it in the same file. Consecutive
+    appends to one worksheet go out as a single ``append_rows`` and consecutive
+    updates as a single ``batch_update``. Ops left unacknowledged by a crash are
+    replayed when the queue is created again. Only one process at a time may
+    own a journal: creating a second queue on it raises JournalLockedError.
+
+    ``get_worksheet`` maps a worksheet title to a gspread Worksheet and is
+    called on every attempt, so it can pick up a rebuilt connection.
+    ``on_auth_error`` is called when Sheets answers 401, and ``on_drop(batch,
+    error)`` when a batch fails with a permanent error (or is still refused
+    with 401 after MAX_AUTH_RETRIES reconnects) and is given up on; those
+    ops are also kept for ``dropped``.
+
+    An update may name the expense it edits instead of a fixed row: its
+    ``range_name`` is then a template like ``"B{row}:G{row}"``, and
+    ``locate(worksheet, expense_ids)`` maps the ids to their rows when the
+    batch is sent, so edits survive rows moving in between. An append that
+    names its expense is skipped on replay if ``locate`` already finds it:
+    the crash came after the write but before its acknowledgement.
+    """
+
+    def __init__(self, get_worksheet, journal_path: str = WRITE_JOURNAL, on_auth_error=None, on_drop=None,
+                 locate=None):
+        self.get_worksheet = get_worksheet
+        self.locate = locate
+        self.journal_path = journal_path
+        self.on_auth_error = on_auth_error
+        self.on_drop = on_drop
+        self._dropped = collections.deque(maxlen=MAX_DROPPED)
+        self._lock_fd = _lock_journal(journal_path)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._seq = 0
+        self._attempt = 0
+        self._auth_failures = 0
+        self._replayed = set()
+        self._thread = None
+        self._stopped = False
+        self._replay()
+
+    # --- journal ---
+
+    def _replay(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+        ops, acked = {}, set()
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-write; the op never returned.
+                    continue
+                if "ack" in record:
+                    acked.add(record["ack"])
+                else:
+                    ops[record["seq"]] = record
+        self._seq = max(ops, default=0)
+        self._pending = [ops[seq] for seq in sorted(ops) if seq not in acked]
+        self._replayed = {op["seq"] for op in self._pending}
+        if self._pending:
+            logger.info("Replaying %d journaled sheet writes.", len(self._pending))
+        self._compact()
+
+    def _append_journal(self, records: list) -> None:
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self) -> None:
+        """Rewrite the journal with just the pending ops."""
+        tmp_path = f"{self.journal_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for op in self._pending:
+                f.write(json.dumps(op) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    # --- producer side ---
+
+    def start(self) -> "WriteBehindQueue":
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sheet-write-behind", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, kind: str, worksheet: str, values: list, range_name: str = None, expense_id: str = None) -> int:
+        """Journal one mutation and return its sequence number.
+
+        ``kind`` is "append" (``values`` is one row) or "update" (``values`` is
+        a 2-D block written at ``range_name``, a ``{row}`` template when
+        ``expense_id`` is given). ``expense_id`` names the expense the op
+        adds or edits.
+        """
+        with self._cond:
+            self._seq += 1
+            op = {"seq": self._seq, "kind": kind, "worksheet": worksheet, "values": values}
+            if range_name:
+                op["range"] = range_name
+            if expense_id:
+                op["id"] = expense_id
+            self._append_journal([op])
+            self._pending.append(op)
+            self._cond.notify_all()
+            return op["seq"]
+
+    def pending(self, worksheet: str = None) -> list:
+        with self._cond:
+            return [dict(op) for op in self._pending if worksheet is None or op["worksheet"] == worksheet]
+
+    def dropped(self, since: int = 0) -> list:
+        """Ops given up on after a permanent error, with sequence numbers above ``since``, oldest first.
+
+        Each is ``{"seq", "kind", "worksheet", "error"}``.
+        """
+        with self._cond:
+            return [dict(record) for record in self._dropped if record["seq"] > since]
+
+    def flush(self, worksheet: str = None, timeout: float = 30.0) -> bool:
+        """Block until no ops (for ``worksheet``, if given) are pending."""
+        def done():
+            return not any(worksheet is None or op["worksheet"] == worksheet for op in self._pending)
+
+        if threading.current_thread() is self._thread:
+            # A read made while sending (locating rows); everything before the batch is already written.
+            return True
+        with self._cond:
+            if done():
+                return True
+            self.start()
+            self._cond.notify_all()
+            return self._cond.wait_for(done, timeout)
+
+    def stop(self) -> None:
+        """Stop the worker and give up the journal; anything still pending is replayed by the next owner."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+                if fcntl is None:
+                    os.remove(self.journal_path + ".lock")
+
+    # --- worker side ---
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+            time.sleep(LINGER_SECONDS)
+            delay = self._drain()
+            if delay:
+                time.sleep(delay)
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            if not self._pending:
+                return []
+            first = self._pending[0]
+            batch = [first]
+            for op in self._pending[1:MAX_BATCH]:
+                if op["kind"] != first["kind"] or op["worksheet"] != first["worksheet"]:
+                    break
+                batch.append(op)
+            return batch
+
+    def _drain(self) -> float:
+        """Write pending ops in order; return a backoff delay if we must retry."""
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return 0.0
+            try:
+                self._write(batch)
+            except Exception as e:
+                auth_error = _status(e) == 401
+                if auth_error:
+                    self._auth_failures += 1
+                if is_retryable(e) and not (auth_error and self._auth_failures > MAX_AUTH_RETRIES):
+                    if auth_error and self.on_auth_error:
+                        self.on_auth_error()
+                    delay = backoff_delay(self._attempt)
+                    self._attempt += 1
+                    logger.warning("Sheet write failed (%s), retrying %d ops in %.1fs.", e, len(batch), delay)
+                    return delay
+                logger.error("Dropping %d sheet writes after a permanent error: %s", len(batch), e)
+                self._drop(batch, e)
+            self._attempt = 0
+            self._auth_failures = 0
+            self._ack(batch)
+
+    def _write(self, batch: list) -> None:
+        first = batch[0]
+        ws = self.get_worksheet(first["worksheet"])
+        if first["kind"] == "append":
+            replayed = [op["id"] for op in batch if op["seq"] in self._replayed and "id" in op]
+            written = self.locate(first["worksheet"], replayed) if replayed and self.locate else {}
+            if written:
+                logger.info("Skipping %d replayed appends already in %s.", len(written), first["worksheet"])
+            rows = [op["values"] for op in batch if op.get("id") not in written]
+            if rows:
+                ws.append_rows(rows)
+            logger.info("Wrote %d %s ops to %s.", len(rows), first["kind"], first["worksheet"])
+            return
+        ids = [op["id"] for op in batch if "id" in op]
+        rows = {}
+        if ids:
+            if self.locate is None:
+                raise ValueError("Cannot send expense-id updates without a locate callback.")
+            rows = self.locate(first["worksheet"], ids)
+        data, gone = [], []
+        for op in batch:
+            if "id" not in op:
+                data.append({"range": op["range"], "values": op["values"]})
+            elif op["id"] in rows:
+                data.append({"range": op["range"].format(row=rows[op["id"]]), "values": op["values"]})
+            else:
+                gone.append(op)
+        if data:
+            ws.batch_update(data)
+        logger.info("Wrote %d %s ops to %s.", len(data), first["kind"], first["worksheet"])
+        if gone:
+            logger.error("Dropping %d updates to expenses no longer in %s.", len(gone), first["worksheet"])
+            self._drop(gone, LookupError("the expense is no longer in the sheet"))
+
+    def _drop(self, batch: list, error: Exception) -> None:
+        with self._cond:
+            for op in batch:
+                self._dropped.append({"seq": op["seq"], "kind": op["kind"], "worksheet": op["worksheet"],
+                                      "error": str(error)})
+        if self.on_drop:
+            self.on_drop(batch, error)
+
+    def _ack(self, batch: list) -> None:
+        seqs = {op["seq"] for op in batch}
+        with self._cond:
+            self._pending = [op for op in self._pending if op["seq"] not in seqs]
+            if self._pending:
+                self._append_journal([{"ack": seq} for seq in sorted(seqs)])
+            else:
+                self._compact()
+            self._cond.notify_all()